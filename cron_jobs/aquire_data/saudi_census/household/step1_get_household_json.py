@@ -5,7 +5,6 @@ import os
 import numpy as np
 from datetime import datetime
 import urllib3
-from time import sleep
 from downloading_household_files import download_json_files_recursive
 
 import logging
@@ -23,6 +22,13 @@ if(args.log_file):
     sys.path.append(grandparent_dir)
     from logging_utils import setup_logging
     setup_logging(args.log_file)
+
+sys.path.append(os.path.abspath(os.path.join(MODULE_DIR, "..", "..", "..", "..")))
+from service_guard import CircuitOpenError, service_guard
+
+# Shared by every page request: spaces pages out, retries with jittered backoff
+# and stops calling the server while it keeps failing
+CENSUS_GUARD = service_guard("saudi_census", rate=2, max_retries=2, base_delay=2.0)
     
 
 COLUMN_MAPPING = {
@@ -46,45 +52,38 @@ def calculate_centroid(coordinates):
     
     return latitude, longitude
 
-def fetch_with_pagination(url, params, max_retries=3):
-    """Fetch data with pagination and retry logic."""
+def fetch_with_pagination(url, params):
+    """Fetch data with pagination; each page goes through the census rate limit and retry."""
     all_features = []
     offset = 0
     result_limit = 10000  # Adjust this value based on server limitations
-    
+
+    def get_page(page_params):
+        response = requests.get(url, params=page_params, verify=False, timeout=30)
+        response.raise_for_status()
+        return response.json()
+
     while True:
         current_params = params.copy()
         current_params.update({
             'resultOffset': offset,
             'resultRecordCount': result_limit
         })
-        
-        for attempt in range(max_retries):
-            try:
-                response = requests.get(url, params=current_params, verify=False, timeout=30)
-                response.raise_for_status()
-                data = response.json()
-                
-                features = data.get('features', [])
-                all_features.extend(features)
-                
-                # Check if we've received all features
-                if len(features) < result_limit:
-                    return all_features
-                
-                offset += result_limit
-                # Add a small delay between requests to avoid overwhelming the server
-                sleep(0.5)
-                break
-                
-            except requests.exceptions.RequestException as e:
-                if attempt == max_retries - 1:
-                    logging.error(f"Failed after {max_retries} attempts: {str(e)}")
-                    return all_features
-                logging.warning(f"Attempt {attempt + 1} failed, retrying...")
-                sleep(2 ** attempt)  # Exponential backoff
-    
-    return all_features
+
+        try:
+            data = CENSUS_GUARD.call(get_page, current_params)
+        except (requests.exceptions.RequestException, CircuitOpenError) as e:
+            logging.error(f"Failed to fetch features from offset {offset}: {str(e)}")
+            return all_features
+
+        features = data.get('features', [])
+        all_features.extend(features)
+
+        # Check if we've received all features
+        if len(features) < result_limit:
+            return all_features
+
+        offset += result_limit
 
 def process_census_data(level):
     """Fetch and process census data for a specific level."""
@@ -191,6 +190,7 @@ def main():
     else:
         success=False
         logging.info("No data was processed successfully.")
+    CENSUS_GUARD.log_stats()
     return success
 
 if __name__ == "__main__":
@@ -2,16 +2,21 @@ import asyncio
 import aiohttp
 import json
 import os
+import sys
 from datetime import datetime
 # Removed the time import since we'll use asyncio.sleep instead
 
 # Define base URL as a constant to avoid repetition
-BASE_URL = "http://localhost:8000/fastapi"
+BASE_URL = os.getenv("FETCH_DATASET_API_URL", "http://localhost:8000/fastapi")
 LOGIN_URL = f"{BASE_URL}/login"
 FETCH_DATASET_URL = f"{BASE_URL}/fetch_dataset"
 
-async def make_api_call(session, query, token, page_num, search_type, obtained_auth_token):
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "..")))
+from token_manager import is_unauthorized, token_manager
+
+async def make_api_call(session, query, token, page_num, search_type, auth_tokens):
     city_name, boolean_query = query
+    obtained_auth_token = await auth_tokens.get_async()
     headers = {"Authorization": f"Bearer {obtained_auth_token}"}
 
     request_body = {
@@ -41,6 +46,10 @@ async def make_api_call(session, query, token, page_num, search_type, obtained_a
             return await response.json()
     except Exception as e:
         print(f"Query '{boolean_query}' - Error on page {page_num}: {str(e)}")
+        if is_unauthorized(e):
+            # Token rejected: log in again (once for all concurrent queries) before the retry
+            auth_tokens.invalidate(obtained_auth_token)
+            headers = {"Authorization": f"Bearer {await auth_tokens.get_async()}"}
         # Retry once
         try:
             async with session.post(FETCH_DATASET_URL, json=request_body, headers=headers) as response:
@@ -51,11 +60,11 @@ async def make_api_call(session, query, token, page_num, search_type, obtained_a
             print(f"Query '{boolean_query}' - Second attempt failed for page {page_num}: {str(e)}")
             return None
 
-async def initial_call(query, search_type, obtained_auth_token, all_responses):
+async def initial_call(query, search_type, auth_tokens, all_responses):
     tokens_to_process = []
     # First call - must be done separately
     async with aiohttp.ClientSession() as session:
-        first_response = await make_api_call(session, query, "", 1, search_type, obtained_auth_token)
+        first_response = await make_api_call(session, query, "", 1, search_type, auth_tokens)
         if first_response:
             all_responses.append(first_response)
             next_token = first_response["data"]["next_page_token"]
@@ -63,12 +72,12 @@ async def initial_call(query, search_type, obtained_auth_token, all_responses):
                 tokens_to_process.append(next_token)
     return tokens_to_process, first_response
 
-async def fetch_data(query, search_type, obtained_auth_token):
+async def fetch_data(query, search_type, auth_tokens):
     city_name, boolean_query = query
     print(f"Starting data collection for query: '{boolean_query}' in {city_name}...")
     
     all_responses = []
-    tokens_to_process, first_response = await initial_call(query, search_type, obtained_auth_token, all_responses)
+    tokens_to_process, first_response = await initial_call(query, search_type, auth_tokens, all_responses)
     all_responses.append(first_response)
     # Add a smaller delay between queries to avoid overwhelming the server
     # Changed to async sleep
@@ -84,7 +93,7 @@ async def fetch_data(query, search_type, obtained_auth_token):
 
             # Make a single API call
             response = await make_api_call(
-                session, query, current_token, page_num, search_type, obtained_auth_token
+                session, query, current_token, page_num, search_type, auth_tokens
             )
 
             # Process the response
@@ -136,11 +145,11 @@ async def login_and_get_token(username, password):
             print(f"Login failed due to an unexpected error: {str(e)}")
             return None
 
-async def process_query_and_save(query, search_type, obtained_auth_token):
+async def process_query_and_save(query, search_type, auth_tokens):
     """Process a single query and save its results"""
     city_name, boolean_query = query
     
-    responses, query = await fetch_data(query, search_type, obtained_auth_token)
+    responses, query = await fetch_data(query, search_type, auth_tokens)
     
     # Save results
     query_str = boolean_query.replace(" ", "_").replace("/", "_").replace("\\", "_")
@@ -166,9 +175,11 @@ async def main():
     api_password = "12351235"
 
     print("Logging in to get auth token...")
-    obtained_auth_token = await login_and_get_token(api_email, api_password)
-
-    if not obtained_auth_token:
+    # Shared by all queries, refreshed before the id token expires or after a 401
+    auth_tokens = token_manager("fetch_dataset", lambda: login_and_get_token(api_email, api_password))
+    try:
+        await auth_tokens.get_async()
+    except RuntimeError:
         print("Login failed or token not retrieved. Exiting application.")
         return  # Exit if login is unsuccessful
 
@@ -199,7 +210,7 @@ async def main():
     for query in queries:
         # Add a small delay between starting each query to avoid overwhelming the server
         await asyncio.sleep(5)
-        task = asyncio.create_task(process_query_and_save(query, search_type, obtained_auth_token))
+        task = asyncio.create_task(process_query_and_save(query, search_type, auth_tokens))
         tasks.append(task)
     
     # Wait for all tasks to complete
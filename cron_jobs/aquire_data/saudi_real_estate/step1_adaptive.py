@@ -0,0 +1,179 @@
+import json
+import logging
+import os
+import time
+from datetime import datetime
+from statistics import median
+
+# Kept under ignore/ so step3 does not upload crawl state to the bucket
+ADAPTIVE_STATE_PATH = os.path.join(os.path.dirname(__file__), 'ignore', 'adaptive_crawl_state.json')
+
+# Upstream statuses that mean "slow down" rather than "this page is broken"
+THROTTLE_STATUSES = [429, 500, 502, 503, 504, 520]
+
+
+class AdaptiveCrawlController:
+    """
+    Tunes the GraphQL page size and the number of in-flight requests during a crawl.
+
+    Observations are collected in windows of `window` responses. At the end of each window:
+      - error rate above `max_error_rate` halves concurrency and rolls back the last page size increase
+      - median latency above `target_latency` shrinks concurrency by one
+      - otherwise, until it settles, page size grows by `page_size_step` as long as listings/second
+        per in-flight request keeps improving and responses stay below `max_response_bytes`;
+        concurrency is held while page size is probed, then grows by one per window
+
+    The settled values are saved so the next run starts where this one ended.
+    """
+
+    def __init__(
+        self,
+        initial_page_size=20,
+        min_page_size=10,
+        max_page_size=200,
+        page_size_step=1.5,
+        initial_concurrency=4,
+        min_concurrency=1,
+        max_concurrency=32,
+        window=20,
+        target_latency=10.0,
+        max_error_rate=0.05,
+        max_response_bytes=8 * 1024 * 1024,
+        state_path=ADAPTIVE_STATE_PATH,
+    ):
+        self.logger = logging.getLogger(__name__)
+        self.min_page_size = min_page_size
+        self.max_page_size = max_page_size
+        self.page_size_step = page_size_step
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.window = window
+        self.target_latency = target_latency
+        self.max_error_rate = max_error_rate
+        self.max_response_bytes = max_response_bytes
+        self.state_path = state_path
+
+        state = self.load_state()
+        self.page_size = self._clamp(state.get('page_size', initial_page_size), min_page_size, max_page_size)
+        self.concurrency = self._clamp(state.get('concurrency', initial_concurrency), min_concurrency, max_concurrency)
+        self.page_size_settled = False
+        self.previous_page_size = None
+        self.best_throughput = 0.0
+        # Best listings/s per in-flight request seen while probing page size
+        self.best_request_throughput = 0.0
+
+        self.stats = {'responses': 0, 'errors': 0, 'bytes': 0, 'listings': 0}
+        self._reset_window()
+
+    @staticmethod
+    def _clamp(value, low, high):
+        return max(low, min(high, int(value)))
+
+    def _reset_window(self):
+        self.window_started = time.monotonic()
+        self.window_responses = 0
+        self.window_latencies = []
+        self.window_errors = 0
+        self.window_listings = 0
+        self.window_max_bytes = 0
+
+    def load_state(self):
+        if not os.path.exists(self.state_path):
+            return {}
+        with open(self.state_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def save_state(self):
+        state = {
+            'page_size': self.page_size,
+            'concurrency': self.concurrency,
+            'best_throughput': round(self.best_throughput, 2),
+            'saved_at': int(datetime.now().timestamp()),
+        }
+        os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+        with open(self.state_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, indent=2)
+        return state
+
+    def record_response(self, latency, status, body_bytes, listings):
+        """Record one completed request. Throttling statuses count as errors."""
+        self.stats['responses'] += 1
+        self.stats['bytes'] += body_bytes
+        self.stats['listings'] += listings
+        self.window_responses += 1
+        if latency is not None:
+            self.window_latencies.append(latency)
+        if status in THROTTLE_STATUSES:
+            self.stats['errors'] += 1
+            self.window_errors += 1
+        self.window_listings += listings
+        self.window_max_bytes = max(self.window_max_bytes, body_bytes)
+        self._maybe_adjust()
+
+    def record_failure(self, latency=None):
+        """Record a request that failed without a usable response (timeout, Zyte API error)."""
+        self.stats['responses'] += 1
+        self.stats['errors'] += 1
+        self.window_responses += 1
+        self.window_errors += 1
+        if latency is not None:
+            self.window_latencies.append(latency)
+        self._maybe_adjust()
+
+    def cap_page_size(self, returned):
+        """The endpoint returned fewer listings than asked for mid-catalogue, so it caps `size`."""
+        if returned < self.min_page_size:
+            return
+        if returned < self.max_page_size:
+            self.logger.info(f'Endpoint caps page size at {returned}, no longer growing past it')
+            self.max_page_size = returned
+            self.page_size = min(self.page_size, returned)
+            self.page_size_settled = True
+
+    def _maybe_adjust(self):
+        if self.window_responses < self.window:
+            return
+
+        elapsed = max(time.monotonic() - self.window_started, 1e-6)
+        error_rate = self.window_errors / self.window_responses
+        latency = median(self.window_latencies) if self.window_latencies else None
+        throughput = self.window_listings / elapsed
+
+        if error_rate > self.max_error_rate:
+            self.concurrency = max(self.min_concurrency, self.concurrency // 2)
+            if self.previous_page_size is not None and not self.page_size_settled:
+                self.page_size = self.previous_page_size
+                self.page_size_settled = True
+        elif latency is not None and latency > self.target_latency:
+            self.concurrency = max(self.min_concurrency, self.concurrency - 1)
+        elif not self.page_size_settled:
+            self._grow_page_size(throughput / self.concurrency)
+        else:
+            self.concurrency = min(self.max_concurrency, self.concurrency + 1)
+
+        self.best_throughput = max(self.best_throughput, throughput)
+        self.logger.info(
+            f'Adaptive window: {throughput:.1f} listings/s, error rate {error_rate:.1%}, '
+            f'median latency {latency if latency is None else round(latency, 2)}s, '
+            f'max response {self.window_max_bytes} bytes -> '
+            f'page size {self.page_size}, concurrency {self.concurrency}'
+        )
+        self._reset_window()
+
+    def _grow_page_size(self, request_throughput):
+        # The previous increase did not pay off, roll it back and stop exploring. Throughput is per
+        # in-flight request, so a concurrency cut for latency in between does not look like a loss
+        if self.previous_page_size is not None and request_throughput <= self.best_request_throughput * 1.05:
+            self.page_size = self.previous_page_size
+            self.page_size_settled = True
+            return
+        self.best_request_throughput = max(self.best_request_throughput, request_throughput)
+        if self.window_max_bytes * self.page_size_step > self.max_response_bytes:
+            self.page_size_settled = True
+            return
+        grown = self._clamp(self.page_size * self.page_size_step, self.min_page_size, self.max_page_size)
+        if grown == self.page_size:
+            self.page_size_settled = True
+            return
+        self.previous_page_size = self.page_size
+        self.page_size = grown
@@ -0,0 +1,119 @@
+import hashlib
+import io
+import json
+import os
+import shutil
+from datetime import datetime
+
+import zstandard as zstd
+
+# Kept under ignore/ so step3 does not upload the archive to the bucket
+ARCHIVE_DIR = os.path.join(os.path.dirname(__file__), 'ignore', 'archive')
+MANIFEST_NAME = 'run.json'
+
+
+class ResponseArchive:
+    """
+    Content-addressed archive of raw findListings response bodies for one crawl run.
+
+    Each record is a JSON line {sha256, variables, fetched_at, body} appended to
+    zstd-compressed segments (<prefix>segment-00001.jsonl.zst, ...), rotated every `segment_bytes`
+    of uncompressed data. A body already archived in this run is stored only once; runs do not
+    share bodies, so each run directory can be replayed or pruned on its own.
+    """
+
+    def __init__(self, run_id, extraction_timestamp, prefix='', archive_dir=ARCHIVE_DIR,
+                 segment_bytes=64 * 1024 * 1024, level=10):
+        self.run_dir = os.path.join(archive_dir, run_id)
+        self.prefix = prefix
+        self.segment_bytes = segment_bytes
+        self.compressor = zstd.ZstdCompressor(level=level)
+        self.hashes = set()
+        self.segment_index = 0
+        self.segment_written = 0
+        self.file = None
+        self.writer = None
+        self.stats = {'records': 0, 'duplicates': 0, 'bytes': 0}
+        os.makedirs(self.run_dir, exist_ok=True)
+        manifest_path = os.path.join(self.run_dir, MANIFEST_NAME)
+        if not os.path.exists(manifest_path):
+            with open(manifest_path, 'w', encoding='utf-8') as f:
+                json.dump({'run_id': run_id, 'extraction_timestamp': extraction_timestamp}, f, indent=2)
+
+    def _open_segment(self):
+        self._close_segment()
+        self.segment_index += 1
+        path = os.path.join(self.run_dir, f'{self.prefix}segment-{self.segment_index:05d}.jsonl.zst')
+        while os.path.exists(path):
+            self.segment_index += 1
+            path = os.path.join(self.run_dir, f'{self.prefix}segment-{self.segment_index:05d}.jsonl.zst')
+        self.file = open(path, 'wb')
+        self.writer = self.compressor.stream_writer(self.file)
+        self.segment_written = 0
+
+    def _close_segment(self):
+        if self.writer is not None:
+            self.writer.flush(zstd.FLUSH_FRAME)
+            self.writer.close()
+            self.writer = None
+            self.file = None
+
+    def write(self, variables, body):
+        """Archive one response body (bytes). Returns its sha256."""
+        digest = hashlib.sha256(body).hexdigest()
+        if digest in self.hashes:
+            self.stats['duplicates'] += 1
+            return digest
+        self.hashes.add(digest)
+        record = {
+            'sha256': digest,
+            'variables': variables,
+            'fetched_at': int(datetime.now().timestamp()),
+            'body': body.decode('utf-8'),
+        }
+        line = (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8')
+        if self.writer is None or self.segment_written + len(line) > self.segment_bytes:
+            self._open_segment()
+        self.writer.write(line)
+        self.segment_written += len(line)
+        self.stats['records'] += 1
+        self.stats['bytes'] += len(body)
+        return digest
+
+    def close(self):
+        self._close_segment()
+
+
+def list_runs(archive_dir=ARCHIVE_DIR):
+    if not os.path.isdir(archive_dir):
+        return []
+    return sorted(
+        name for name in os.listdir(archive_dir)
+        if os.path.exists(os.path.join(archive_dir, name, MANIFEST_NAME))
+    )
+
+
+def load_manifest(run_id, archive_dir=ARCHIVE_DIR):
+    with open(os.path.join(archive_dir, run_id, MANIFEST_NAME), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def iter_archive(run_id, archive_dir=ARCHIVE_DIR):
+    """Yield archived records of a run, segment by segment."""
+    run_dir = os.path.join(archive_dir, run_id)
+    decompressor = zstd.ZstdDecompressor()
+    for name in sorted(os.listdir(run_dir)):
+        if not name.endswith('.jsonl.zst'):
+            continue
+        with open(os.path.join(run_dir, name), 'rb') as f:
+            reader = io.TextIOWrapper(decompressor.stream_reader(f, read_across_frames=True), encoding='utf-8')
+            for line in reader:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def prune_runs(keep, archive_dir=ARCHIVE_DIR):
+    """Delete all but the newest `keep` archived runs."""
+    runs = list_runs(archive_dir)
+    for run_id in runs[:max(len(runs) - keep, 0)]:
+        shutil.rmtree(os.path.join(archive_dir, run_id), ignore_errors=True)
@@ -0,0 +1,219 @@
+import csv
+import hashlib
+import logging
+import os
+import sqlite3
+
+import orjson
+from scrapy import signals
+from scrapy.exceptions import DropItem
+from scrapy.logformatter import LogFormatter
+
+# Kept under ignore/ so step3 does not upload crawl state to the bucket
+FINGERPRINT_DB_PATH = os.path.join(os.path.dirname(__file__), 'ignore', 'listing_fingerprints.sqlite')
+TOMBSTONES_PATH = os.path.join(os.path.dirname(__file__), 'ignore', 'raw_saudi_real_estate_tombstones.csv')
+TOMBSTONE_COLUMNS = ['listing_id', 'url', 'change_type', 'last_seen_run', 'extraction_timestamp']
+
+
+def listing_fingerprint(listing):
+    """8-byte hash of the fields whose change makes a listing worth re-emitting."""
+    key = f"{listing.get('price')}|{listing.get('last_update')}|{listing.get('status')}"
+    return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'big', signed=True)
+
+
+def connect_store(path=FINGERPRINT_DB_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=60)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS fingerprints (
+            listing_id TEXT PRIMARY KEY,
+            fingerprint INTEGER NOT NULL,
+            url TEXT,
+            last_seen_run TEXT NOT NULL
+        ) WITHOUT ROWID
+        """
+    )
+    # Fingerprints seen by a run, promoted to `fingerprints` only once its feed is safely written
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS staged_fingerprints (
+            run_id TEXT NOT NULL,
+            listing_id TEXT NOT NULL,
+            fingerprint INTEGER NOT NULL,
+            url TEXT,
+            PRIMARY KEY (run_id, listing_id)
+        ) WITHOUT ROWID
+        """
+    )
+    return conn
+
+
+def promote_fingerprints(run_id, db_path=FINGERPRINT_DB_PATH):
+    """
+    Make the fingerprints staged by `run_id` the stored ones, in one transaction.
+    Call only once the run's feed is complete: a listing promoted but missing from the feed is never emitted again.
+    """
+    conn = connect_store(db_path)
+    try:
+        with conn:
+            cursor = conn.execute(
+                """
+                INSERT INTO fingerprints (listing_id, fingerprint, url, last_seen_run)
+                SELECT listing_id, fingerprint, url, run_id FROM staged_fingerprints WHERE run_id = ?
+                ON CONFLICT(listing_id) DO UPDATE SET
+                    fingerprint = excluded.fingerprint, url = excluded.url, last_seen_run = excluded.last_seen_run
+                """,
+                (run_id,),
+            )
+            conn.execute('DELETE FROM staged_fingerprints WHERE run_id = ?', (run_id,))
+        return cursor.rowcount
+    finally:
+        conn.close()
+
+
+def write_tombstones(run_id, extraction_timestamp, path=TOMBSTONES_PATH, db_path=FINGERPRINT_DB_PATH):
+    """
+    Write a tombstone for every stored listing not seen in `run_id`, then forget those listings.
+    Only valid after a crawl that covered the whole catalogue.
+    """
+    conn = connect_store(db_path)
+    try:
+        rows = conn.execute(
+            'SELECT listing_id, url, last_seen_run FROM fingerprints WHERE last_seen_run != ?', (run_id,)
+        ).fetchall()
+        with open(path, 'w', encoding='utf-8-sig', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(TOMBSTONE_COLUMNS)
+            for listing_id, url, last_seen_run in rows:
+                writer.writerow([listing_id, url, 'deleted', last_seen_run, extraction_timestamp])
+        conn.execute('DELETE FROM fingerprints WHERE last_seen_run != ?', (run_id,))
+        conn.commit()
+    finally:
+        conn.close()
+    return len(rows)
+
+
+class QuietDropLogFormatter(LogFormatter):
+    """Unchanged listings are dropped by the hundred thousand, log them at DEBUG instead of WARNING."""
+
+    def dropped(self, item, exception, response, spider):
+        entry = super().dropped(item, exception, response, spider)
+        entry['level'] = logging.DEBUG
+        return entry
+
+
+class ChangeDetectionPipeline:
+    """
+    Lets only inserted or changed listings through to the feed.
+
+    A fingerprint (price, last_update, status) per listing id is kept in SQLite across runs.
+    Unchanged listings are dropped; listings without an id cannot be tracked and always go
+    through. Fingerprints of the current run are only staged; they are
+    promoted once the spider finished cleanly and the feed was stored, so the listings of a
+    crashed, cancelled or unexported run are emitted again by the next one. Distributed workers
+    leave the promotion to the coordinator, after the shards are merged.
+
+    After a cleanly finished full crawl in which no page was abandoned, listings that were not
+    seen any more are written to a tombstones CSV next to the raw feed.
+    """
+
+    def __init__(self, db_path=FINGERPRINT_DB_PATH, batch_size=1000, stats=None, expects_feed=True,
+                 tombstones_path=TOMBSTONES_PATH):
+        self.db_path = db_path
+        self.tombstones_path = tombstones_path
+        self.batch_size = batch_size
+        self.crawler_stats = stats
+        self.expects_feed = expects_feed
+        self.conn = None
+        self.pending = []
+        self.close_reason = None
+        self.feed_closed = False
+        self.stats = {'inserted': 0, 'changed': 0, 'unchanged': 0, 'without_id': 0, 'promoted': 0, 'tombstones': 0}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        pipeline = cls(stats=crawler.stats, expects_feed=bool(crawler.settings.getdict('FEEDS')))
+        crawler.signals.connect(pipeline.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(pipeline.feed_exporter_closed, signal=signals.feed_exporter_closed)
+        return pipeline
+
+    def open_spider(self, spider):
+        self.spider = spider
+        self.conn = connect_store(self.db_path)
+        # Left over by runs that never finished
+        self.conn.execute('DELETE FROM staged_fingerprints WHERE run_id != ?', (spider.run_id,))
+        self.conn.commit()
+
+    def process_item(self, item, spider):
+        listing = orjson.loads(item['data'])
+        if listing.get('id') is None:
+            # str(None) would give every id-less listing the same 'None' fingerprint row
+            self.stats['without_id'] += 1
+            return item
+        listing_id = str(listing['id'])
+        fingerprint = listing_fingerprint(listing)
+        row = self.conn.execute(
+            'SELECT fingerprint FROM fingerprints WHERE listing_id = ?', (listing_id,)
+        ).fetchone()
+        self.pending.append((listing_id, fingerprint, item.get('url'), spider.run_id))
+        if len(self.pending) >= self.batch_size:
+            self._flush()
+
+        if row is None:
+            self.stats['inserted'] += 1
+        elif row[0] != fingerprint:
+            self.stats['changed'] += 1
+        else:
+            self.stats['unchanged'] += 1
+            raise DropItem(f'Listing {listing_id} unchanged')
+        return item
+
+    def _flush(self):
+        if not self.pending:
+            return
+        self.conn.executemany(
+            'INSERT OR REPLACE INTO staged_fingerprints (listing_id, fingerprint, url, run_id) VALUES (?, ?, ?, ?)',
+            self.pending,
+        )
+        self.conn.commit()
+        self.pending = []
+
+    def close_spider(self, spider):
+        self._flush()
+        self.conn.close()
+
+    def feed_exporter_closed(self):
+        self.feed_closed = True
+        self._finish()
+
+    def spider_closed(self, spider, reason):
+        self.close_reason = reason
+        self._finish()
+
+    def _feed_failed(self):
+        counts = self.crawler_stats.get_stats() if self.crawler_stats else {}
+        return any(key.startswith('feedexport/failed_count/') and count for key, count in counts.items())
+
+    def _finish(self):
+        """Promote and tombstone once both the spider and its feed are closed, in whichever order they arrive."""
+        spider = self.spider
+        if self.close_reason is None or (self.expects_feed and not self.feed_closed):
+            return
+        if self.close_reason != 'finished' or self._feed_failed():
+            spider.logger.warning(
+                f'Run closed with {self.close_reason!r}, feed failed: {self._feed_failed()}; '
+                'fingerprints not promoted, its listings are emitted again next run'
+            )
+        elif spider.worker_id is None:
+            self.stats['promoted'] = promote_fingerprints(spider.run_id, self.db_path)
+            # Incremental runs only see part of the catalogue, and a run that gave up on a page
+            # would mark that page's live listings as removed; distributed runs are handled by the coordinator
+            if spider.covers_full_catalogue() and not spider.abandoned_pages:
+                self.stats['tombstones'] = write_tombstones(
+                    spider.run_id, spider.extraction_timestamp, path=self.tombstones_path, db_path=self.db_path
+                )
+            elif spider.abandoned_pages:
+                spider.logger.warning(f'{spider.abandoned_pages} pages abandoned, no tombstones written')
+        spider.logger.info(f'Change detection: {self.stats}')
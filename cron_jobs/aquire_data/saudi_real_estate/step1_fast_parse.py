@@ -0,0 +1,57 @@
+import re
+
+import orjson
+
+# Start of the listings array inside {"data":{"Web":{"find":{... "listings":[ ... ]}}}}.
+# An escaped quote inside a string value can never produce this pattern, so the first match is the key.
+_LISTINGS_ARRAY = re.compile(rb'"listings"\s*:\s*\[')
+# Consumes strings and plain characters up to the next brace, so only braces cost a Python iteration.
+# Runs on a copy where escapes are blanked out, so every remaining quote delimits a string.
+_NEXT_BRACE = re.compile(rb'[^"{}]*(?:"[^"]*"[^"{}]*)*([{}])')
+
+
+def _blank_escapes(body):
+    """Same-length copy of `body` with escaped backslashes and quotes replaced, offsets are unchanged."""
+    return body.replace(b'\\\\', b'__').replace(b'\\"', b'__')
+
+
+def listing_slices(body, expected=None):
+    """
+    Return the raw byte slice of every object in the listings array, in order.
+    Slices are taken from the response as-is, nothing is decoded or re-encoded.
+    Scanning stops after `expected` listings when the count is already known.
+    """
+    start = _LISTINGS_ARRAY.search(body)
+    if start is None:
+        return []
+    slices = []
+    depth = 0
+    object_start = None
+    for match in _NEXT_BRACE.finditer(_blank_escapes(body), start.end()):
+        if match.group(1) == b'{':
+            if depth == 0:
+                object_start = match.start(1)
+            depth += 1
+        else:
+            depth -= 1
+            if depth < 0:
+                # Past the end of the listings array
+                break
+            if depth == 0:
+                slices.append(body[object_start:match.end(1)])
+                if len(slices) == expected:
+                    break
+    return slices
+
+
+def parse_listings_page(body):
+    """
+    Parse a findListings response body once with orjson and pair each listing dict with its original JSON text.
+    Falls back to re-encoding with orjson if the slices cannot be matched to the parsed listings.
+    """
+    page = orjson.loads(body)
+    listings = (((page.get('data') or {}).get('Web') or {}).get('find') or {}).get('listings') or []
+    slices = listing_slices(body, len(listings))
+    if len(slices) != len(listings):
+        slices = [orjson.dumps(listing) for listing in listings]
+    return page, list(zip(listings, (raw.decode('utf-8') for raw in slices)))
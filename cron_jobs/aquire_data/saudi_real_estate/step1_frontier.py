@@ -0,0 +1,153 @@
+import json
+import os
+import sqlite3
+import time
+from abc import ABC, abstractmethod
+
+# Kept under ignore/ so step3 does not upload crawl state to the bucket
+FRONTIER_PATH = os.path.join(os.path.dirname(__file__), 'ignore', 'crawl_frontier.sqlite')
+
+
+class Frontier(ABC):
+    """
+    Shared queue of crawl tasks pulled by one or more worker spiders.
+
+    A task is a dict with 'id', 'kind' ('total', 'tile' or 'page') and 'payload'.
+    Workers claim tasks, then mark them complete, or release them so another worker retries them.
+    Implementations only have to make claim() atomic across processes.
+
+    Delivery is at-least-once: a task whose lease expires before its worker completes or renews it
+    (a stalled or crashed worker) is handed out again, so the same page can be crawled twice.
+    The shard merge drops duplicate listings by URL.
+    """
+
+    @abstractmethod
+    def push(self, tasks):
+        """Add (kind, payload) tuples to the queue."""
+
+    @abstractmethod
+    def claim(self, worker_id, limit=1):
+        """Lease up to `limit` pending tasks to `worker_id` and return them."""
+
+    @abstractmethod
+    def renew(self, worker_id):
+        """Extend the leases of every task `worker_id` still holds."""
+
+    @abstractmethod
+    def complete(self, task_id):
+        pass
+
+    @abstractmethod
+    def release(self, task_id, max_attempts):
+        """Put a claimed task back in the queue, or mark it failed after `max_attempts` claims."""
+
+    @abstractmethod
+    def is_drained(self):
+        """True once no task is pending or leased, i.e. no worker can produce more work."""
+
+    @abstractmethod
+    def stats(self):
+        pass
+
+
+class SQLiteFrontier(Frontier):
+    """
+    Frontier stored in a local SQLite file, shared by worker processes on the same machine
+    (or on a filesystem with working file locks).
+    Leases expire after `lease_seconds` unless renewed, so tasks held by a crashed worker are
+    handed out again.
+    """
+
+    def __init__(self, path=FRONTIER_PATH, lease_seconds=600):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS tasks (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                worker_id TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                claimed_at REAL
+            )
+            """
+        )
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks (status)')
+
+    def reset(self):
+        self.conn.execute('DELETE FROM tasks')
+
+    def push(self, tasks):
+        rows = [(kind, json.dumps(payload)) for kind, payload in tasks]
+        if not rows:
+            return
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            self.conn.executemany('INSERT INTO tasks (kind, payload) VALUES (?, ?)', rows)
+            self.conn.execute('COMMIT')
+        except Exception:
+            self.conn.execute('ROLLBACK')
+            raise
+
+    def claim(self, worker_id, limit=1):
+        now = time.time()
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            rows = self.conn.execute(
+                """
+                SELECT id, kind, payload FROM tasks
+                WHERE status = 'pending' OR (status = 'claimed' AND claimed_at < ?)
+                ORDER BY id
+                LIMIT ?
+                """,
+                (now - self.lease_seconds, limit),
+            ).fetchall()
+            self.conn.executemany(
+                """
+                UPDATE tasks SET status = 'claimed', worker_id = ?, claimed_at = ?, attempts = attempts + 1
+                WHERE id = ?
+                """,
+                [(str(worker_id), now, row[0]) for row in rows],
+            )
+            self.conn.execute('COMMIT')
+        except Exception:
+            self.conn.execute('ROLLBACK')
+            raise
+        return [{'id': row[0], 'kind': row[1], 'payload': json.loads(row[2])} for row in rows]
+
+    def renew(self, worker_id):
+        self.conn.execute(
+            "UPDATE tasks SET claimed_at = ? WHERE status = 'claimed' AND worker_id = ?",
+            (time.time(), str(worker_id)),
+        )
+
+    def complete(self, task_id):
+        self.conn.execute("UPDATE tasks SET status = 'done' WHERE id = ?", (task_id,))
+
+    def release(self, task_id, max_attempts):
+        self.conn.execute(
+            """
+            UPDATE tasks
+            SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, worker_id = NULL
+            WHERE id = ?
+            """,
+            (max_attempts, task_id),
+        )
+
+    def is_drained(self):
+        row = self.conn.execute(
+            "SELECT COUNT(*) FROM tasks WHERE status IN ('pending', 'claimed')"
+        ).fetchone()
+        return row[0] == 0
+
+    def stats(self):
+        rows = self.conn.execute('SELECT status, COUNT(*) FROM tasks GROUP BY status').fetchall()
+        return dict(rows)
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,122 @@
+import pyarrow as pa
+import pyarrow.parquet as pq
+from scrapy.exporters import BaseItemExporter
+
+from step1_watermark import to_timestamp
+
+# Hot listing fields are stored as native typed columns, the full listing JSON stays in 'data'
+RAW_PARQUET_SCHEMA = pa.schema([
+    ('url', pa.string()),
+    ('price', pa.float64()),
+    ('latitude', pa.float64()),
+    ('longitude', pa.float64()),
+    ('category', pa.string()),
+    ('category_id', pa.int32()),
+    ('city', pa.string()),
+    ('city_id', pa.int32()),
+    ('title', pa.string()),
+    ('address', pa.string()),
+    ('rent_period', pa.int32()),
+    ('listing_created_timestamp', pa.int64()),
+    ('extraction_timestamp', pa.int64()),
+    ('data', pa.large_string()),
+])
+
+# 'data' dominates the file size, so it gets the stronger codec
+COLUMN_COMPRESSION = {field.name: 'snappy' for field in RAW_PARQUET_SCHEMA}
+COLUMN_COMPRESSION['data'] = 'zstd'
+DICTIONARY_COLUMNS = ['category', 'city']
+# Epoch seconds; the server sends create_time either as a number or as an ISO date
+TIMESTAMP_COLUMNS = ['listing_created_timestamp', 'extraction_timestamp']
+
+
+def _coerce(value, arrow_type, name=None):
+    """Cast a scraped value to the column type, None when it does not fit."""
+    if value is None or value == '':
+        return None
+    if name in TIMESTAMP_COLUMNS:
+        return to_timestamp(value)
+    try:
+        if pa.types.is_integer(arrow_type):
+            return int(float(value))
+        if pa.types.is_floating(arrow_type):
+            return float(value)
+    except (TypeError, ValueError):
+        return None
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    return str(value)
+
+
+class ParquetItemExporter(BaseItemExporter):
+    """
+    Scrapy feed exporter writing items as Parquet row groups of `row_group_size` items.
+    Registered through FEED_EXPORTERS under the 'parquet' format.
+    """
+
+    def __init__(self, file, row_group_size=10000, **kwargs):
+        super().__init__(dont_fail=True, **kwargs)
+        self.file = file
+        self.row_group_size = row_group_size
+        self.schema = RAW_PARQUET_SCHEMA
+        self.rows = {field.name: [] for field in self.schema}
+        self.buffered = 0
+        self.writer = None
+
+    def start_exporting(self):
+        self.writer = pq.ParquetWriter(
+            self.file,
+            self.schema,
+            compression=COLUMN_COMPRESSION,
+            use_dictionary=DICTIONARY_COLUMNS,
+        )
+
+    def export_item(self, item):
+        for field in self.schema:
+            self.rows[field.name].append(_coerce(item.get(field.name), field.type, field.name))
+        self.buffered += 1
+        if self.buffered >= self.row_group_size:
+            self._flush()
+
+    def _flush(self):
+        if not self.buffered:
+            return
+        table = pa.table(self.rows, schema=self.schema)
+        self.writer.write_table(table)
+        self.rows = {field.name: [] for field in self.schema}
+        self.buffered = 0
+
+    def finish_exporting(self):
+        self._flush()
+        self.writer.close()
+
+
+def merge_parquet_shards(shard_paths, output_path):
+    """
+    Concatenate worker Parquet shards into one file, keeping each url once.
+    Shards are streamed a row group at a time.
+    """
+    seen_urls = set()
+    rows_written = 0
+    writer = pq.ParquetWriter(
+        output_path,
+        RAW_PARQUET_SCHEMA,
+        compression=COLUMN_COMPRESSION,
+        use_dictionary=DICTIONARY_COLUMNS,
+    )
+    try:
+        for shard_path in shard_paths:
+            shard = pq.ParquetFile(shard_path)
+            for index in range(shard.num_row_groups):
+                table = shard.read_row_group(index)
+                keep = []
+                for url in table.column('url').to_pylist():
+                    keep.append(url not in seen_urls)
+                    seen_urls.add(url)
+                table = table.filter(pa.array(keep))
+                if table.num_rows:
+                    writer.write_table(table.cast(RAW_PARQUET_SCHEMA))
+                    rows_written += table.num_rows
+    finally:
+        writer.close()
+    return rows_written
@@ -0,0 +1,108 @@
+"""
+Micro-benchmark of AqarStandaloneSpider.parse on recorded findListings pages.
+
+    python cron_jobs/aquire_data/saudi_real_estate/step1_parse_benchmark.py               # newest archived run
+    python cron_jobs/aquire_data/saudi_real_estate/step1_parse_benchmark.py --run 20250101_010000 --pages 200
+
+Runs the same pages through parse twice: once with the previous json.loads + json.dumps per listing,
+once with the orjson passthrough, and prints items per second for both.
+Without an archived run a synthetic page is used.
+"""
+import argparse
+import json
+import time
+
+from scrapy.http import Request, TextResponse
+
+import step1_scrapy_aquire_data
+from step1_archive import iter_archive, list_runs
+from step1_fast_parse import parse_listings_page
+from step1_scrapy_aquire_data import BASE_URL, AqarStandaloneSpider
+
+
+def legacy_parse_listings_page(body):
+    """Previous behaviour: decode the whole page, then re-encode every listing."""
+    page = json.loads(body)
+    listings = page.get('data', {}).get('Web', {}).get('find', {}).get('listings', [])
+    return page, [(listing, json.dumps(listing)) for listing in listings]
+
+
+def synthetic_page(size=100):
+    listings = []
+    for i in range(size):
+        listings.append({
+            'id': 6000000 + i,
+            'path': f'/شقق-للإيجار/الرياض/شمال-الرياض/حي-الملقا/{6000000 + i}',
+            'price': 55000 + i,
+            'location': {'lat': 24.8 + i / 1000, 'lng': 46.6 + i / 1000},
+            'category': 1,
+            'city': 'الرياض',
+            'city_id': 21,
+            'title': 'شقة للإيجار في حي الملقا',
+            'address': 'الرياض، حي الملقا، شارع الأمير محمد',
+            'rent_period': 3,
+            'create_time': 1735700000 + i,
+            'last_update': 1735800000 + i,
+            'content': 'شقة مؤثثة بالكامل، مدخل خاص، قريبة من الخدمات ' * 5,
+            'imgs': [f'{i}_{n}.jpg' for n in range(10)],
+            'native': {'image': None, 'description': None, 'title': None, 'logo': None},
+            'extended_details': {'direction_id': 1, 'beds': 3, 'livings': 1, 'wc': 2, 'area': 180},
+        })
+    body = {'data': {'Web': {'find': {'total': size, 'listings': listings}}}}
+    return json.dumps(body, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def load_pages(run_id=None, max_pages=100):
+    runs = list_runs()
+    if not run_id and not runs:
+        return [synthetic_page()], 'synthetic'
+    run_id = run_id or runs[-1]
+    pages = []
+    for record in iter_archive(run_id):
+        if not record.get('variables', {}).get('size'):
+            continue
+        pages.append(record['body'].encode('utf-8'))
+        if len(pages) >= max_pages:
+            break
+    return pages, f'run {run_id}'
+
+
+def time_parse(pages, repeat):
+    spider = AqarStandaloneSpider(archive=False)
+    spider.controller = None
+    request = Request(f'{BASE_URL}/graphql', method='POST', meta={'page_from': 0})
+    responses = [
+        TextResponse(url=request.url, body=body, encoding='utf-8', request=request)
+        for body in pages
+    ]
+    items = 0
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for response in responses:
+            for output in spider.parse(response):
+                if isinstance(output, dict):
+                    items += 1
+    return items / max(time.perf_counter() - started, 1e-9)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--run", help="Archived run id (defaults to the newest run)")
+    parser.add_argument("--pages", type=int, default=100, help="Number of recorded pages to load")
+    parser.add_argument("--repeat", type=int, default=20, help="Passes over the loaded pages")
+    args = parser.parse_args()
+
+    pages, source = load_pages(args.run, args.pages)
+    print(f'Benchmarking parse on {len(pages)} pages ({source}), {args.repeat} passes')
+
+    step1_scrapy_aquire_data.parse_listings_page = legacy_parse_listings_page
+    before = time_parse(pages, args.repeat)
+    step1_scrapy_aquire_data.parse_listings_page = parse_listings_page
+    after = time_parse(pages, args.repeat)
+
+    print(f'json decode/re-encode: {before:,.0f} items/s')
+    print(f'orjson passthrough:    {after:,.0f} items/s ({after / max(before, 1e-9):.2f}x)')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Replay an archived crawl through AqarStandaloneSpider.parse without calling Zyte.
+
+    python cron_jobs/aquire_data/saudi_real_estate/step1_replay.py            # latest run
+    python cron_jobs/aquire_data/saudi_real_estate/step1_replay.py --run 20250101_010000
+    python cron_jobs/aquire_data/saudi_real_estate/step1_replay.py --list
+
+The rebuilt feed is written to the same raw feed path(s) as a live crawl, so step2 can run right after.
+
+Pages go straight to the spider's parse callback, not through the Scrapy engine, so item pipelines
+do not run: change detection drops nothing and the feed holds every archived listing. A listing
+archived more than once (offset pages that shifted mid-crawl, or the worker<N>- segments of a
+distributed run) is written only once, keyed by its id.
+"""
+import argparse
+import time
+
+import orjson
+from scrapy.exporters import CsvItemExporter
+from scrapy.http import Request, TextResponse
+
+from step1_archive import iter_archive, list_runs, load_manifest
+from step1_scrapy_aquire_data import BASE_URL, RAW_FEED_BASE, AqarStandaloneSpider, feed_formats
+
+
+def open_exporters(output_base):
+    exporters = []
+    for feed_format in feed_formats():
+        file = open(f'{output_base}.{feed_format}', 'wb')
+        if feed_format == 'parquet':
+            from step1_parquet_exporter import ParquetItemExporter
+            exporter = ParquetItemExporter(file)
+        else:
+            exporter = CsvItemExporter(file, encoding='utf-8-sig')
+        exporter.start_exporting()
+        exporters.append((exporter, file))
+    return exporters
+
+
+def listing_key(item):
+    """The listing id of an item, or its URL for a listing without one."""
+    listing_id = orjson.loads(item['data']).get('id')
+    return str(listing_id) if listing_id is not None else item['url']
+
+
+def replay_run(run_id, output_base=RAW_FEED_BASE):
+    """Feed every archived listings page of `run_id` back through the spider's parse callback."""
+    manifest = load_manifest(run_id)
+    spider = AqarStandaloneSpider(archive=False)
+    spider.controller = None
+    spider.extraction_timestamp = manifest['extraction_timestamp']
+
+    exporters = open_exporters(output_base)
+    started = time.perf_counter()
+    pages = 0
+    items = 0
+    duplicates = 0
+    seen = set()
+    try:
+        for record in iter_archive(run_id):
+            variables = record.get('variables', {})
+            if not variables.get('size'):
+                # Total-only requests carry no listings
+                continue
+            request = Request(f'{BASE_URL}/graphql', method='POST', meta={'page_from': variables.get('from')})
+            response = TextResponse(
+                url=request.url,
+                body=record['body'].encode('utf-8'),
+                encoding='utf-8',
+                request=request,
+            )
+            pages += 1
+            for output in spider.parse(response):
+                if isinstance(output, dict):
+                    key = listing_key(output)
+                    if key in seen:
+                        duplicates += 1
+                        continue
+                    seen.add(key)
+                    for exporter, _ in exporters:
+                        exporter.export_item(output)
+                    items += 1
+    finally:
+        for exporter, file in exporters:
+            exporter.finish_exporting()
+            file.close()
+
+    elapsed = time.perf_counter() - started
+    print(
+        f'Replayed run {run_id}: {pages} pages, {items} listings ({duplicates} duplicates skipped) in {elapsed:.2f}s '
+        f'({items / max(elapsed, 1e-9):.0f} listings/s) -> {output_base}.{{{",".join(feed_formats())}}}'
+    )
+    return items
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--log-file", help="Path to shared log file", required=False)
+    parser.add_argument("--run", help="Archived run id (defaults to the newest run)")
+    parser.add_argument("--output-base", default=RAW_FEED_BASE, help="Output path without extension")
+    parser.add_argument("--list", action="store_true", help="List archived runs and exit")
+    args = parser.parse_args()
+
+    runs = list_runs()
+    if args.list:
+        for run_id in runs:
+            print(run_id)
+        return
+    if not runs and not args.run:
+        print('No archived runs found')
+        return
+    replay_run(args.run or runs[-1], args.output_base)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,35 +1,142 @@
+import argparse
+import csv
 import json
 import os
+import subprocess
+import sys
+from collections import deque
 from datetime import datetime
 from dotenv import load_dotenv
 from scrapy.crawler import CrawlerProcess
-from scrapy import Spider, Request
+from scrapy import Spider, Request, signals
+from scrapy.exceptions import DontCloseSpider
+from twisted.internet.task import LoopingCall
+from step1_adaptive import THROTTLE_STATUSES, AdaptiveCrawlController
+from step1_archive import ResponseArchive, prune_runs
+from step1_fast_parse import parse_listings_page
+from step1_frontier import FRONTIER_PATH, SQLiteFrontier
+from step1_tiles import Tile, should_split
+from step1_watermark import load_watermark, save_watermark, to_timestamp
 load_dotenv()
 
 BASE_URL = 'https://sa.aqar.fm'
 
-with open('cron_jobs/secret_saudi_real_estate.json') as f:
-    config_data = json.load(f)
-ZYTE_API_KEY = config_data.get("zyte_api_key")
-os.environ['ZYTE_API_KEY'] = ZYTE_API_KEY
+# Incremental mode: stop paginating once a page holds only listings older than the last run's watermark
+INCREMENTAL = os.getenv('INCREMENTAL', 'false').lower() == 'true'
+INCREMENTAL_OVERLAP_SECONDS = int(os.getenv('INCREMENTAL_OVERLAP_SECONDS', 86400))
+INCREMENTAL_LOOKAHEAD_PAGES = int(os.getenv('INCREMENTAL_LOOKAHEAD_PAGES', 4))
+
+# Adaptive mode: tune page size and in-flight requests from observed latency, errors and response size
+ADAPTIVE = os.getenv('ADAPTIVE', 'false').lower() == 'true'
+ADAPTIVE_MAX_PAGE_SIZE = int(os.getenv('ADAPTIVE_MAX_PAGE_SIZE', 200))
+ADAPTIVE_MAX_CONCURRENCY = int(os.getenv('ADAPTIVE_MAX_CONCURRENCY', 32))
+ADAPTIVE_TARGET_LATENCY = float(os.getenv('ADAPTIVE_TARGET_LATENCY', 10))
+MAX_PAGE_ATTEMPTS = int(os.getenv('MAX_PAGE_ATTEMPTS', 5))
+
+# Tile mode: split Saudi Arabia into polygon tiles small enough to page with shallow offsets
+CRAWL_MODE = os.getenv('CRAWL_MODE', 'offsets')
+TILE_MAX_LISTINGS = int(os.getenv('TILE_MAX_LISTINGS', 1000))
+TILE_MAX_DEPTH = int(os.getenv('TILE_MAX_DEPTH', 12))
+
+# Distributed mode: workers pull total/tile/page tasks from a shared frontier and write one feed shard each
+CRAWL_WORKERS = int(os.getenv('CRAWL_WORKERS', 1))
+WORKER_CONCURRENCY = int(os.getenv('WORKER_CONCURRENCY', 16))
+
+# Raw feed format: csv (default), parquet (typed columns, zstd-compressed data column) or both
+RAW_FEED_FORMAT = os.getenv('RAW_FEED_FORMAT', 'csv')
+RAW_FEED_BASE = os.path.join(os.path.dirname(__file__), 'ignore', 'raw_saudi_real_estate')
+SHARDS_DIR = os.path.join(os.path.dirname(__file__), 'ignore', 'shards')
+
+# Set to archive raw findListings responses per run, so parsing can be replayed without Zyte spend
+ARCHIVE_RESPONSES = os.getenv('ARCHIVE_RESPONSES', 'false').lower() == 'true'
+ARCHIVE_KEEP_RUNS = int(os.getenv('ARCHIVE_KEEP_RUNS', 7))
+
+# Change detection: only emit new or changed listings and write tombstones for vanished ones
+CHANGE_DETECTION = os.getenv('CHANGE_DETECTION', 'false').lower() == 'true'
+
 os.makedirs(os.path.join(os.path.dirname(__file__), 'ignore'), exist_ok=True)
 
+
+def load_zyte_api_key():
+    # Only needed for live crawls, so replaying the archive works without the secret file
+    with open('cron_jobs/secret_saudi_real_estate.json') as f:
+        config_data = json.load(f)
+    os.environ['ZYTE_API_KEY'] = config_data.get("zyte_api_key")
+
+
+def feed_formats():
+    return ['csv', 'parquet'] if RAW_FEED_FORMAT == 'both' else [RAW_FEED_FORMAT]
+
+
+def feed_settings(base_path):
+    feeds = {}
+    if 'csv' in feed_formats():
+        feeds[f'{base_path}.csv'] = {
+            'format': 'csv',
+            'encoding': 'utf-8-sig',
+            'overwrite': True,
+        }
+    if 'parquet' in feed_formats():
+        feeds[f'{base_path}.parquet'] = {
+            'format': 'parquet',
+            'overwrite': True,
+        }
+    return feeds
+
+
 class AqarStandaloneSpider(Spider):
     name = "saudi_real_estate"
     allowed_domains = ["aqar.fm"]    
     
-    def __init__(self):
-        super().__init__()
+    def __init__(self, *args, frontier_path=None, worker_id=None, archive=ARCHIVE_RESPONSES, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.frontier = SQLiteFrontier(frontier_path) if frontier_path else None
+        self.worker_id = worker_id
         # Store the extraction timestamp when spider starts
         self.extraction_timestamp = int(datetime.now().timestamp())
+        # Workers of one distributed run share the coordinator's run id
+        self.run_id = os.getenv('CRAWL_RUN_ID') or datetime.fromtimestamp(self.extraction_timestamp).strftime('%Y%m%d_%H%M%S')
+        self.archive = None
+        if archive:
+            prefix = f'worker{worker_id}-' if worker_id is not None else ''
+            self.archive = ResponseArchive(self.run_id, self.extraction_timestamp, prefix=prefix)
+        # Newest timestamps seen in this run, saved as the next run's watermark
+        self.max_create_time = None
+        self.max_last_update = None
+        self.tile_mode = CRAWL_MODE == 'tiles'
+        self.watermark = load_watermark() if INCREMENTAL else None
+        self.incremental_cutoff = None
+        if (self.tile_mode or self.frontier) and INCREMENTAL:
+            self.logger.warning(
+                'Incremental crawl relies on the global create_time order, ignored in tile and distributed mode'
+            )
+        elif self.watermark and self.watermark.get('create_time'):
+            self.incremental_cutoff = self.watermark['create_time'] - INCREMENTAL_OVERLAP_SECONDS
+        self.total = 0
+        self.page_size = int(os.getenv('PAGE_SIZE', 20))
+        self.next_from = 0
+        self.watermark_reached = False
+        self.in_flight = 0
+        # Pages given up on: their listings are missing from this run's feed
+        self.abandoned_pages = 0
+        # (from, size, attempt, tile, total) page ranges waiting to be requested ahead of the global offsets
+        self.pending_ranges = deque()
+        # Listings on tile edges are returned by every tile touching them
+        self.seen_listing_ids = set()
+        self.duplicate_count = 0
+        self.controller = None
+        if ADAPTIVE:
+            self.controller = AdaptiveCrawlController(
+                initial_page_size=self.page_size,
+                max_page_size=ADAPTIVE_MAX_PAGE_SIZE,
+                max_concurrency=ADAPTIVE_MAX_CONCURRENCY,
+                target_latency=ADAPTIVE_TARGET_LATENCY,
+            )
     
     custom_settings = {
-        'FEEDS': {
-            os.path.join(os.path.dirname(__file__), 'ignore', 'raw_saudi_real_estate.csv'): {
-                'format': 'csv',
-                'encoding': 'utf-8-sig',
-                'overwrite': True,
-            }
+        'FEEDS': feed_settings(RAW_FEED_BASE),
+        'FEED_EXPORTERS': {
+            'parquet': 'step1_parquet_exporter.ParquetItemExporter',
         },
         'ROBOTSTXT_OBEY': False,
         'USER_AGENT': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36',
@@ -48,6 +155,13 @@ class AqarStandaloneSpider(Spider):
             "scrapy_zyte_api.Addon": 500,
         },
     }
+    if CHANGE_DETECTION:
+        custom_settings['ITEM_PIPELINES'] = {'step1_change_detection.ChangeDetectionPipeline': 300}
+        custom_settings['LOG_FORMATTER'] = 'step1_change_detection.QuietDropLogFormatter'
+    if ADAPTIVE:
+        # The controller enforces its own in-flight limit, Scrapy only must not cap it lower
+        custom_settings['CONCURRENT_REQUESTS'] = ADAPTIVE_MAX_CONCURRENCY
+        custom_settings['CONCURRENT_REQUESTS_PER_DOMAIN'] = ADAPTIVE_MAX_CONCURRENCY
 
     meta = {
         "zyte_api_automap": {
@@ -57,7 +171,33 @@ class AqarStandaloneSpider(Spider):
         },
     }
 
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        crawler.signals.connect(spider.spider_idle, signal=signals.spider_idle)
+        return spider
+
+    def spider_idle(self):
+        """Keep a distributed worker alive while other workers may still push tasks to the frontier."""
+        if not self.frontier:
+            return
+        scheduled = False
+        for request in self.fill_window():
+            self.crawler.engine.crawl(request)
+            scheduled = True
+        if scheduled or not self.frontier.is_drained():
+            raise DontCloseSpider
+
     def start_requests(self):
+        if self.frontier:
+            # Renew the leases of slow pages well before they expire and another worker takes them
+            self.lease_renewal = LoopingCall(self.frontier.renew, self.worker_id)
+            self.lease_renewal.start(self.frontier.lease_seconds / 3, now=False)
+            yield from self.fill_window()
+            return
+        if self.tile_mode:
+            yield self.tile_total_request(Tile.root())
+            return
         json_data = self.generate_json_data(from_value=0, size_value=0)
         yield Request(
             url=f'{BASE_URL}/graphql',
@@ -67,30 +207,267 @@ class AqarStandaloneSpider(Spider):
             meta=self.meta,
         )
 
+    def covers_full_catalogue(self):
+        """True when this spider alone requests every listing (not incremental, not one of several workers)."""
+        return self.incremental_cutoff is None and self.frontier is None
+
+    def may_save_watermark(self, reason):
+        """
+        Only a cleanly finished run that lost no page may advance the watermark: the next incremental
+        run skips everything older than it. Distributed workers each see a part of the catalogue.
+        """
+        if reason != 'finished' or self.max_create_time is None or self.abandoned_pages:
+            return False
+        single_incremental = self.incremental_cutoff is not None and self.frontier is None
+        return self.covers_full_catalogue() or single_incremental
+
+    def archive_response(self, response):
+        if self.archive is None or response.status != 200:
+            return
+        variables = json.loads(response.request.body).get('variables', {})
+        self.archive.write(variables, response.body)
+
     def parse_total(self, response):
+        self.archive_response(response)
         data = json.loads(response.text)
         total = data.get('data', {}).get('Web', {}).get('find', {}).get('total', 0)
         self.logger.info(f'Total listings: {total}')
 
         if total == 0:
             self.logger.error('Unable to retrieve listings')
+            self.task_finished(response.meta)
             return
-        
-        page_size = int(os.getenv('PAGE_SIZE', 20))
-        for i in range(0, total, page_size):
-            json_data = self.generate_json_data(from_value=i, size_value=page_size)
-            yield Request(
+
+        if self.frontier:
+            # Hand every page to the shared frontier so all workers can pick them up
+            page_size = self.controller.page_size if self.controller else self.page_size
+            for from_value in range(0, total, page_size):
+                self.enqueue_page(from_value, page_size, None, total)
+            self.task_finished(response.meta)
+            yield from self.fill_window()
+            return
+        self.total = total
+
+        if self.incremental_cutoff is not None:
+            # Pages are sorted by create_time desc, so only a small window is kept in flight
+            # and each fresh page schedules the next one until the watermark is reached.
+            self.logger.info(
+                f'Incremental crawl: stopping at listings created before {self.incremental_cutoff} '
+                f'(watermark {self.watermark["create_time"]} minus {INCREMENTAL_OVERLAP_SECONDS}s overlap)'
+            )
+        elif INCREMENTAL:
+            self.logger.warning('Incremental crawl requested but no watermark found, running a full crawl')
+        yield from self.fill_window()
+
+    def tile_total_request(self, tile, task_id=None):
+        json_data = self.generate_json_data(from_value=0, size_value=0, polygon=tile.polygon())
+        return Request(
+            url=f'{BASE_URL}/graphql',
+            method='POST',
+            body=json.dumps(json_data),
+            callback=self.parse_tile_total,
+            errback=self.task_failed if task_id is not None else None,
+            meta={**self.meta, 'tile': tile, 'task_id': task_id},
+            dont_filter=True,
+        )
+
+    def parse_tile_total(self, response):
+        tile = response.meta['tile']
+        self.archive_response(response)
+        data = json.loads(response.text)
+        total = data.get('data', {}).get('Web', {}).get('find', {}).get('total', 0)
+
+        if should_split(tile, total, TILE_MAX_LISTINGS, TILE_MAX_DEPTH):
+            self.logger.info(f'Tile {tile.key} holds {total} listings, splitting')
+            if self.frontier:
+                self.frontier.push([('tile', {'tile': list(child)}) for child in tile.split()])
+            else:
+                for child in tile.split():
+                    yield self.tile_total_request(child)
+        elif total:
+            self.logger.info(f'Leaf tile {tile.key}: {total} listings')
+            page_size = self.controller.page_size if self.controller else self.page_size
+            for from_value in range(0, total, page_size):
+                self.enqueue_page(from_value, page_size, tile, total)
+        self.task_finished(response.meta)
+        yield from self.fill_window()
+
+    def enqueue_page(self, from_value, size_value, tile, total):
+        """Queue a page range locally, or on the shared frontier in distributed mode."""
+        if self.frontier:
+            self.frontier.push([('page', {
+                'from': from_value,
+                'size': size_value,
+                'tile': list(tile) if tile else None,
+                'total': total,
+            })])
+        else:
+            self.pending_ranges.append((from_value, size_value, 1, tile, total))
+
+    def request_for_task(self, task):
+        payload = task['payload']
+        if task['kind'] == 'total':
+            json_data = self.generate_json_data(from_value=0, size_value=0)
+            return Request(
                 url=f'{BASE_URL}/graphql',
                 method='POST',
                 body=json.dumps(json_data),
-                callback=self.parse,
-                meta=self.meta,
+                callback=self.parse_total,
+                errback=self.task_failed,
+                meta={**self.meta, 'task_id': task['id']},
+                dont_filter=True,
             )
+        if task['kind'] == 'tile':
+            return self.tile_total_request(Tile(*payload['tile']), task_id=task['id'])
+        tile = Tile(*payload['tile']) if payload.get('tile') else None
+        return self.page_request(payload['from'], payload['size'], 1, tile, payload['total'], task_id=task['id'])
+
+    def task_finished(self, meta):
+        """Mark a frontier task done once everything it produced has been pushed."""
+        task_id = meta.get('task_id')
+        if task_id is None:
+            return
+        self.in_flight -= 1
+        self.frontier.complete(task_id)
+
+    def task_failed(self, failure):
+        self.in_flight -= 1
+        self.logger.warning(f'Frontier task failed: {failure.value!r}')
+        self.frontier.release(failure.request.meta['task_id'], MAX_PAGE_ATTEMPTS)
+        yield from self.fill_window()
+
+    def window_size(self):
+        """Maximum number of page requests this spider keeps in flight."""
+        if self.controller:
+            return self.controller.concurrency
+        if self.frontier:
+            return WORKER_CONCURRENCY
+        if self.incremental_cutoff is not None:
+            return INCREMENTAL_LOOKAHEAD_PAGES
+        return float('inf')
+
+    def fill_window(self):
+        """Yield page requests until the in-flight window is full or nothing is left to fetch."""
+        while self.in_flight < self.window_size():
+            request = self.next_page_request()
+            if request is None:
+                break
+            self.in_flight += 1
+            yield request
+
+    def next_page_request(self):
+        """Build the request for the next page offset, or None once the catalogue (or watermark) is exhausted."""
+        if self.watermark_reached:
+            return None
+        if self.pending_ranges:
+            return self.page_request(*self.pending_ranges.popleft())
+        if self.next_from < self.total:
+            size_value = self.controller.page_size if self.controller else self.page_size
+            request = self.page_request(self.next_from, size_value, 1, None, self.total)
+            self.next_from += size_value
+            return request
+        if self.frontier:
+            tasks = self.frontier.claim(self.worker_id, limit=1)
+            return self.request_for_task(tasks[0]) if tasks else None
+        return None
+
+    def page_request(self, from_value, size_value, attempt, tile, total, task_id=None):
+        json_data = self.generate_json_data(
+            from_value=from_value, size_value=size_value, polygon=tile.polygon() if tile else None
+        )
+        meta = {
+            **self.meta,
+            'page_from': from_value,
+            'page_size': size_value,
+            'page_attempt': attempt,
+            'page_total': total,
+            'tile': tile,
+            'task_id': task_id,
+        }
+        if self.controller:
+            # Let throttling statuses reach the callback so the controller can see and react to them
+            meta['handle_httpstatus_list'] = THROTTLE_STATUSES
+        return Request(
+            url=f'{BASE_URL}/graphql',
+            method='POST',
+            body=json.dumps(json_data),
+            callback=self.parse,
+            errback=self.page_failed,
+            meta=meta,
+            dont_filter=attempt > 1,
+        )
+
+    def retry_range(self, meta):
+        if meta.get('task_id') is not None:
+            # The frontier counts attempts and hands the page to whichever worker is free
+            self.frontier.release(meta['task_id'], MAX_PAGE_ATTEMPTS)
+            return
+        attempt = meta.get('page_attempt', 1)
+        if attempt >= MAX_PAGE_ATTEMPTS:
+            self.logger.error(f'Giving up on offset {meta.get("page_from")} after {attempt} attempts')
+            self.abandoned_pages += 1
+            return
+        self.pending_ranges.append(
+            (meta['page_from'], meta['page_size'], attempt + 1, meta.get('tile'), meta['page_total'])
+        )
+
+    def page_failed(self, failure):
+        self.in_flight -= 1
+        self.logger.warning(f'Page request failed: {failure.value!r}')
+        request = failure.request
+        if self.controller:
+            self.controller.record_failure(request.meta.get('download_latency'))
+            self.retry_range(request.meta)
+        elif request.meta.get('task_id') is not None:
+            self.retry_range(request.meta)
+        else:
+            self.abandoned_pages += 1
+        yield from self.fill_window()
 
     def parse(self, response):
-        data = json.loads(response.text)
-        for listing in data.get('data', {}).get('Web', {}).get('find', {}).get('listings', []):
+        self.in_flight -= 1
+        if self.controller and response.status in THROTTLE_STATUSES:
+            self.controller.record_response(
+                response.meta.get('download_latency'), response.status, len(response.body), 0
+            )
+            self.retry_range(response.meta)
+            yield from self.fill_window()
+            return
+
+        self.archive_response(response)
+        # Listings are parsed once and their original JSON text is passed through to 'data'
+        _, listings = parse_listings_page(response.body)
+        if self.controller:
+            self.controller.record_response(
+                response.meta.get('download_latency'), response.status, len(response.body), len(listings)
+            )
+            requested = response.meta['page_size']
+            page_from = response.meta['page_from']
+            page_total = response.meta['page_total']
+            if 0 < len(listings) < requested and page_from + len(listings) < page_total:
+                # Short page mid-catalogue: re-queue the rest so no offset is skipped
+                self.controller.cap_page_size(len(listings))
+                self.enqueue_page(
+                    page_from + len(listings), requested - len(listings), response.meta.get('tile'), page_total
+                )
+        has_fresh_listing = False
+        for listing, raw_listing in listings:
+            if self.tile_mode:
+                listing_id = listing.get('id')
+                if listing_id is not None and listing_id in self.seen_listing_ids:
+                    self.duplicate_count += 1
+                    continue
+                self.seen_listing_ids.add(listing_id)
             location = listing.get('location', {})
+
+            create_time = to_timestamp(listing.get('create_time'))
+            last_update = to_timestamp(listing.get('last_update'))
+            if create_time is not None:
+                self.max_create_time = max(self.max_create_time or create_time, create_time)
+                if self.incremental_cutoff is None or create_time >= self.incremental_cutoff:
+                    has_fresh_listing = True
+            if last_update is not None:
+                self.max_last_update = max(self.max_last_update or last_update, last_update)
             
             # Extract listing creation timestamp from server
             listing_created_timestamp = listing.get('create_time') or listing.get('published_at')
@@ -109,10 +486,39 @@ class AqarStandaloneSpider(Spider):
                 'rent_period': listing.get('rent_period'),
                 'listing_created_timestamp': listing_created_timestamp,  # When listing was created on server
                 'extraction_timestamp': self.extraction_timestamp,  # When our code ran to extract data
-                'data': json.dumps(listing),
+                'data': raw_listing,
             }
 
-    def generate_json_data(self, from_value=0, size_value=0):
+        if response.meta.get('task_id') is not None:
+            self.frontier.complete(response.meta['task_id'])
+        if self.incremental_cutoff is not None and not self.watermark_reached and not has_fresh_listing:
+            self.watermark_reached = True
+            self.logger.info(f'Watermark reached at offset {self.next_from}, stopping pagination')
+        yield from self.fill_window()
+
+    def closed(self, reason):
+        if self.archive:
+            self.archive.close()
+            self.logger.info(f'Archived responses: {self.archive.stats}')
+            if self.worker_id is None:
+                prune_runs(ARCHIVE_KEEP_RUNS)
+        if self.frontier:
+            if getattr(self, 'lease_renewal', None) is not None and self.lease_renewal.running:
+                self.lease_renewal.stop()
+            self.logger.info(f'Worker {self.worker_id} done, frontier: {self.frontier.stats()}')
+            self.frontier.close()
+        if self.tile_mode:
+            self.logger.info(
+                f'Tile crawl: {len(self.seen_listing_ids)} unique listings, {self.duplicate_count} edge duplicates dropped'
+            )
+        if self.controller:
+            state = self.controller.save_state()
+            self.logger.info(f'Adaptive crawl stats: {self.controller.stats}, settled on {state}')
+        if self.may_save_watermark(reason):
+            watermark = save_watermark(self.max_create_time, self.max_last_update)
+            self.logger.info(f'Saved crawl watermark: {watermark}')
+
+    def generate_json_data(self, from_value=0, size_value=0, polygon=None):
         json_data = {
             'operationName': 'findListings',
             'variables': {
@@ -126,12 +532,143 @@ class AqarStandaloneSpider(Spider):
             },
             'query': 'fragment WebResult on WebResults {\n  total\n  listings {\n    id\n    rnpl_monthly_price\n    sov_campaign_id\n    boosted\n    ac\n    age\n    apts\n    area\n    backyard\n    basement\n    beds\n    car_entrance\n    category\n    city_id\n    create_time\n    biddable\n    published_at\n    direction_id\n    district_id\n    province_id\n    driver\n    duplex\n    extra_unit\n    family\n    family_section\n    fb\n    fl\n    furnished\n    has_img\n    imgs\n    imgs_desc\n    ketchen\n    last_update\n    refresh\n    lift\n    livings\n    location {\n      lat\n      lng\n      __typename\n    }\n    maid\n    men_place\n    meter_price\n    playground\n    pool\n    premium\n    price\n    price_2_payments\n    price_4_payments\n    price_12_payments\n    range_price\n    rent_period\n    rooms\n    stairs\n    stores\n    status\n    street_direction\n    street_width\n    tent\n    trees\n    type\n    user_id\n    user {\n      phone\n      name\n      img\n      type\n      paid\n      fee\n      review\n      iam_verified\n      rega_id\n      bml_license_number\n      bml_url\n      __typename\n    }\n    user_type\n    vb\n    wc\n    wells\n    women_place\n    has_video\n    videos {\n      video\n      thumbnail\n      orientation\n      __typename\n    }\n    verified\n    special\n    employee_user_id\n    mgr_user_id\n    unique_listing\n    advertiser_type\n    appraisal_id\n    appraisal\n    virtual_tour_link\n    project_id\n    approved\n    native {\n      logo\n      title\n      image\n      description\n      external_url\n      __typename\n    }\n    gh_id\n    private_listing\n    blur\n    location_circle_radius\n    width\n    length\n    water_availability\n    electrical_availability\n    drainage_availability\n    private_roof\n    apartment_in_villa\n    two_entrances\n    special_entrance\n    daily_rentable\n    has_extended_details\n    extended_details {\n      minimum_booking_days\n      __typename\n    }\n    hide_contact_details\n    ad_license_number\n    deed_number\n    rega_licensed\n    published\n    comments_enabled\n    content\n    address\n    district\n    direction\n    city\n    title\n    path\n    uri\n    range_price\n    original_range_price\n    plan_no\n    parcel_no\n    __typename\n  }\n  __typename\n}\n\nquery findListings($size: Int, $from: Int, $sort: SortInput, $where: WhereInput, $polygon: [LocationInput!], $daily_renting_filter: DailyRentingFilter) {\n  Web {\n    find(\n      size: $size\n      from: $from\n      sort: $sort\n      where: $where\n      polygon: $polygon\n      daily_renting_filter: $daily_renting_filter\n    ) {\n      ...WebResult\n      __typename\n    }\n    __typename\n  }\n}\n',
         }
+        if polygon:
+            json_data['variables']['polygon'] = polygon
         return json_data
 
-def main():
+def seed_frontier(frontier_path):
+    """Reset the frontier and queue the first task for the configured crawl mode."""
+    frontier = SQLiteFrontier(frontier_path)
+    frontier.reset()
+    if CRAWL_MODE == 'tiles':
+        frontier.push([('tile', {'tile': list(Tile.root())})])
+    else:
+        frontier.push([('total', {})])
+    frontier.close()
+
+
+def merge_feed_shards(shard_paths, output_path):
+    """
+    Concatenate worker feed shards into a single feed CSV.
+    Listings crawled by more than one worker (tile edges, re-leased pages) are kept once, by url.
+    """
+    csv.field_size_limit(2**31 - 1)
+    seen_urls = set()
+    rows_written = 0
+    header = None
+    with open(output_path, 'w', encoding='utf-8-sig', newline='') as out:
+        writer = csv.writer(out)
+        for shard_path in shard_paths:
+            if not os.path.exists(shard_path):
+                continue
+            with open(shard_path, 'r', encoding='utf-8-sig', newline='') as f:
+                reader = csv.reader(f)
+                shard_header = next(reader, None)
+                if shard_header is None:
+                    continue
+                if header is None:
+                    header = shard_header
+                    writer.writerow(header)
+                url_index = shard_header.index('url')
+                order = [shard_header.index(column) for column in header]
+                for row in reader:
+                    if row[url_index] in seen_urls:
+                        continue
+                    seen_urls.add(row[url_index])
+                    writer.writerow([row[i] for i in order])
+                    rows_written += 1
+    return rows_written
+
+
+def shard_base(worker_id):
+    return os.path.join(SHARDS_DIR, f'raw_saudi_real_estate.worker{worker_id}')
+
+
+def merge_shards(workers):
+    """Merge the shards of every configured feed format into the raw feed files."""
+    for feed_format in feed_formats():
+        shard_paths = [f'{shard_base(worker_id)}.{feed_format}' for worker_id in range(workers)]
+        output_path = f'{RAW_FEED_BASE}.{feed_format}'
+        if feed_format == 'parquet':
+            from step1_parquet_exporter import merge_parquet_shards
+            rows = merge_parquet_shards([path for path in shard_paths if os.path.exists(path)], output_path)
+        else:
+            rows = merge_feed_shards(shard_paths, output_path)
+        print(f'Merged {rows} listings from {workers} worker shards into {output_path}')
+
+
+def run_worker(worker_id, frontier_path):
+    AqarStandaloneSpider.custom_settings = {
+        **AqarStandaloneSpider.custom_settings,
+        'FEEDS': feed_settings(shard_base(worker_id)),
+    }
     process = CrawlerProcess()
-    process.crawl(AqarStandaloneSpider)
+    crawler = process.create_crawler(AqarStandaloneSpider)
+    process.crawl(crawler, frontier_path=frontier_path, worker_id=worker_id)
     process.start()
+    # A non-zero exit keeps the coordinator from merging and promoting an incomplete run
+    stats = crawler.stats.get_stats()
+    feed_failed = any(key.startswith('feedexport/failed_count/') and count for key, count in stats.items())
+    if stats.get('finish_reason') != 'finished' or feed_failed:
+        sys.exit(1)
+
+
+def run_coordinator(workers, frontier_path):
+    """Seed the frontier, run `workers` local worker processes and merge their shards."""
+    os.makedirs(SHARDS_DIR, exist_ok=True)
+    os.environ.setdefault('CRAWL_RUN_ID', datetime.now().strftime('%Y%m%d_%H%M%S'))
+    for worker_id in range(workers):
+        for feed_format in feed_formats():
+            if os.path.exists(f'{shard_base(worker_id)}.{feed_format}'):
+                os.remove(f'{shard_base(worker_id)}.{feed_format}')
+    seed_frontier(frontier_path)
+    processes = [
+        subprocess.Popen([sys.executable, os.path.abspath(__file__), '--worker-id', str(worker_id), '--frontier', frontier_path])
+        for worker_id in range(workers)
+    ]
+    exit_codes = [process.wait() for process in processes]
+    if any(exit_codes):
+        raise RuntimeError(f'Crawl workers failed with exit codes {exit_codes}')
+    merge_shards(workers)
+    if CHANGE_DETECTION:
+        from step1_change_detection import promote_fingerprints, write_tombstones
+        run_id = os.environ['CRAWL_RUN_ID']
+        # The merged feed is written: the fingerprints the workers staged can become the stored ones
+        print(f'Promoted {promote_fingerprints(run_id)} listing fingerprints')
+        frontier = SQLiteFrontier(frontier_path)
+        failed_tasks = frontier.stats().get('failed', 0)
+        frontier.close()
+        if failed_tasks:
+            print(f'{failed_tasks} frontier tasks failed, no tombstones written')
+        else:
+            extraction_timestamp = int(datetime.strptime(run_id, '%Y%m%d_%H%M%S').timestamp())
+            print(f'Wrote {write_tombstones(run_id, extraction_timestamp)} tombstones')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--log-file", help="Path to shared log file", required=False)
+    parser.add_argument("--workers", type=int, default=CRAWL_WORKERS, help="Local worker processes to run")
+    parser.add_argument("--worker-id", type=int, help="Run a single worker against an already seeded frontier")
+    parser.add_argument("--frontier", default=FRONTIER_PATH, help="Path to the shared SQLite frontier")
+    parser.add_argument("--seed", action="store_true", help="Only reset and seed the frontier (multi-node runs)")
+    parser.add_argument("--merge", type=int, metavar="WORKERS", help="Only merge the shards of WORKERS workers")
+    args = parser.parse_args()
+    load_zyte_api_key()
+
+    if args.seed:
+        seed_frontier(args.frontier)
+    elif args.merge:
+        merge_shards(args.merge)
+    elif args.worker_id is not None:
+        run_worker(args.worker_id, args.frontier)
+    elif args.workers > 1:
+        run_coordinator(args.workers, args.frontier)
+        prune_runs(ARCHIVE_KEEP_RUNS)
+    else:
+        process = CrawlerProcess()
+        process.crawl(AqarStandaloneSpider)
+        process.start()
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -0,0 +1,48 @@
+from collections import namedtuple
+
+# Bounding box covering Saudi Arabia (lat/lng degrees)
+SAUDI_BBOX = {
+    'min_lat': 16.0,
+    'min_lng': 34.4,
+    'max_lat': 32.3,
+    'max_lng': 55.8,
+}
+
+
+class Tile(namedtuple('Tile', ['min_lat', 'min_lng', 'max_lat', 'max_lng', 'depth'])):
+    """Axis-aligned lat/lng rectangle used to partition the findListings result set."""
+
+    @classmethod
+    def root(cls, bbox=SAUDI_BBOX):
+        return cls(bbox['min_lat'], bbox['min_lng'], bbox['max_lat'], bbox['max_lng'], 0)
+
+    @property
+    def key(self):
+        return f'{self.depth}:{self.min_lat:.5f},{self.min_lng:.5f},{self.max_lat:.5f},{self.max_lng:.5f}'
+
+    def polygon(self):
+        """Closed ring in the shape expected by the findListings $polygon argument."""
+        return [
+            {'lat': self.min_lat, 'lng': self.min_lng},
+            {'lat': self.min_lat, 'lng': self.max_lng},
+            {'lat': self.max_lat, 'lng': self.max_lng},
+            {'lat': self.max_lat, 'lng': self.min_lng},
+            {'lat': self.min_lat, 'lng': self.min_lng},
+        ]
+
+    def split(self):
+        """Split into four equal quadrants one level deeper."""
+        mid_lat = (self.min_lat + self.max_lat) / 2
+        mid_lng = (self.min_lng + self.max_lng) / 2
+        depth = self.depth + 1
+        return [
+            Tile(self.min_lat, self.min_lng, mid_lat, mid_lng, depth),
+            Tile(self.min_lat, mid_lng, mid_lat, self.max_lng, depth),
+            Tile(mid_lat, self.min_lng, self.max_lat, mid_lng, depth),
+            Tile(mid_lat, mid_lng, self.max_lat, self.max_lng, depth),
+        ]
+
+
+def should_split(tile, total, max_listings, max_depth):
+    """A tile is split while it holds more listings than can be paged with shallow offsets."""
+    return total > max_listings and tile.depth < max_depth
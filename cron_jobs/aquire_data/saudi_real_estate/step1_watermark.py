@@ -0,0 +1,55 @@
+import json
+import os
+from datetime import datetime
+
+# Kept under ignore/ so step3 does not upload crawl state to the bucket
+WATERMARK_PATH = os.path.join(os.path.dirname(__file__), 'ignore', 'crawl_watermark.json')
+
+
+def to_timestamp(value):
+    """
+    Normalise a listing timestamp (epoch seconds, numeric string or ISO date) to epoch seconds.
+    Returns None when the value cannot be interpreted.
+    """
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        return int(datetime.fromisoformat(str(value).replace('Z', '+00:00')).timestamp())
+    except ValueError:
+        return None
+
+
+def load_watermark(path=WATERMARK_PATH):
+    """
+    Load the watermark saved by the previous successful crawl.
+    Returns a dict with 'create_time' and 'last_update' (epoch seconds) or None if no run was recorded.
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_watermark(create_time, last_update, path=WATERMARK_PATH):
+    """
+    Persist the newest create_time/last_update seen in a crawl.
+    Values never move backwards, so a short or partial run cannot undo a newer watermark.
+    """
+    previous = load_watermark(path) or {}
+    watermark = {
+        'create_time': max(filter(None, [create_time, previous.get('create_time')]), default=None),
+        'last_update': max(filter(None, [last_update, previous.get('last_update')]), default=None),
+        'saved_at': int(datetime.now().timestamp()),
+    }
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(watermark, f, indent=2)
+    os.replace(temp_path, path)
+    return watermark
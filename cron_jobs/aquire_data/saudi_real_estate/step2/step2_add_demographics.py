@@ -1,10 +1,16 @@
 import httpx
 import json
+import os
+from functools import lru_cache
+import sys
 from typing import Dict
-import psycopg2
-from psycopg2.extras import RealDictCursor
 
-# os is not required here; filesystem access is handled by callers
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "..", "..")))
+from service_guard import service_guard
+from token_manager import token_manager
+
+# Point at a local stand-in (see step2_mock_services.py) with DEMOGRAPHICS_API_URL=http://127.0.0.1:8765/fastapi
+DEMOGRAPHICS_API_URL = os.getenv("DEMOGRAPHICS_API_URL", "http://37.27.195.216:8000/fastapi")
 
 
 def pct_above(age, avg_median_age):
@@ -26,7 +32,7 @@ def generate_bbox(center_lat, center_lng, radius_km=1):
 
 
 def login_and_get_user():
-    login_url = "http://37.27.195.216:8000/fastapi/login"
+    login_url = f"{DEMOGRAPHICS_API_URL}/login"
     login_payload = {
         "message": "login",
         "request_info": {},
@@ -42,29 +48,13 @@ def login_and_get_user():
     id_token = data.get("data", {}).get("idToken")
     return user_id, id_token
 
-def fetch_demographics(center_lat, center_lng, user_id, id_token, radius_km=1):
 
-    bbox = generate_bbox(center_lat, center_lng, radius_km)
-    url = "http://37.27.195.216:8000/fastapi/fetch_population_by_viewport"
-    headers = {"Authorization": f"Bearer {id_token}"} if id_token else {}
-    with httpx.Client() as client:
-        payload = {
-            "message": "fetch population",
-            "request_info": {},
-            "request_body": {
-                "top_lng": bbox["top_lng"],
-                "top_lat": bbox["top_lat"],
-                "bottom_lng": bbox["bottom_lng"],
-                "bottom_lat": bbox["bottom_lat"],
-                "zoom_level": 12,
-                "user_id": user_id,
-                "population": True,
-                "income": True,
-            },
-        }
-        response = client.post(url, json=payload, headers=headers)
-        data = response.json()
+# (user_id, id_token) shared by every demographics call of the process
+DEMOGRAPHICS_TOKENS = token_manager("demographics", login_and_get_user, token=lambda credentials: credentials[1])
 
+
+def summarise_demographics(data):
+    """Aggregate a fetch_population_by_viewport response into the demographic columns."""
     features = data.get("data", {}).get("features", [])
 
     if not features:
@@ -126,8 +116,107 @@ def fetch_demographics(center_lat, center_lng, user_id, id_token, radius_km=1):
     return processed
 
 
+DEMOGRAPHICS_URL = f"{DEMOGRAPHICS_API_URL}/fetch_population_by_viewport"
+# Rate limit, retry and circuit breaker shared by every demographics request of the process
+DEMOGRAPHICS_GUARD = service_guard("demographics", rate=20)
+
+
+def demographics_payload(center_lat, center_lng, user_id, radius_km=1):
+    bbox = generate_bbox(center_lat, center_lng, radius_km)
+    return {
+        "message": "fetch population",
+        "request_info": {},
+        "request_body": {
+            "top_lng": bbox["top_lng"],
+            "top_lat": bbox["top_lat"],
+            "bottom_lng": bbox["bottom_lng"],
+            "bottom_lat": bbox["bottom_lat"],
+            "zoom_level": 12,
+            "user_id": user_id,
+            "population": True,
+            "income": True,
+        },
+    }
+
+
+def fetch_demographics(center_lat, center_lng, user_id, id_token, radius_km=1):
+
+    headers = {"Authorization": f"Bearer {id_token}"} if id_token else {}
+
+    def post():
+        response = client.post(DEMOGRAPHICS_URL, json=payload, headers=headers)
+        response.raise_for_status()
+        return response
+
+    with httpx.Client() as client:
+        payload = demographics_payload(center_lat, center_lng, user_id, radius_km)
+        data = DEMOGRAPHICS_GUARD.call(post).json()
+
+    return summarise_demographics(data)
+
+
+def _feature_bounds(feature):
+    """(min_lng, max_lng, min_lat, max_lat) of a GeoJSON feature, None without geometry."""
+    coordinates = (feature.get("geometry") or {}).get("coordinates")
+    lngs, lats = [], []
+
+    def walk(value):
+        if value and isinstance(value[0], (int, float)):
+            lngs.append(value[0])
+            lats.append(value[1])
+        else:
+            for item in value or []:
+                walk(item)
+
+    walk(coordinates)
+    if not lngs:
+        return None
+    return min(lngs), max(lngs), min(lats), max(lats)
+
+
+def summarise_demographics_rings(data, center_lat, center_lng, radii_km):
+    """
+    summarise_demographics for each radius from one response fetched with the largest radius.
+    Smaller rings keep the features whose bounds overlap their bbox; the largest keeps them all,
+    as a request of that radius would.
+    """
+    features = data.get("data", {}).get("features", [])
+    bounds = [_feature_bounds(feature) for feature in features]
+    rings = {}
+    for radius_km in radii_km:
+        if radius_km == max(radii_km):
+            rings[radius_km] = summarise_demographics(data)
+            continue
+        bbox = generate_bbox(center_lat, center_lng, radius_km)
+        inside = [
+            feature
+            for feature, box in zip(features, bounds)
+            if box is not None
+            and box[0] <= bbox["top_lng"] and box[1] >= bbox["bottom_lng"]
+            and box[2] <= bbox["top_lat"] and box[3] >= bbox["bottom_lat"]
+        ]
+        rings[radius_km] = summarise_demographics({"data": {"features": inside}})
+    return rings
+
+
+async def fetch_demographics_rings_async(client, center_lat, center_lng, user_id, id_token, radii_km=(1,)):
+    """Demographics of each radius from a single request over a shared httpx.AsyncClient, as {radius: result}."""
+    headers = {"Authorization": f"Bearer {id_token}"} if id_token else {}
+    payload = demographics_payload(center_lat, center_lng, user_id, max(radii_km))
+
+    async def post():
+        response = await client.post(DEMOGRAPHICS_URL, json=payload, headers=headers)
+        # Raise rather than summarise an error body, a 401 lets the token manager log in again
+        response.raise_for_status()
+        return response
+
+    response = await DEMOGRAPHICS_GUARD.call_async(post)
+    return summarise_demographics_rings(response.json(), center_lat, center_lng, radii_km)
+
+
+@lru_cache(maxsize=1)
 def _read_db_config():
-    """Read DB credentials from cron_jobs/secrets_database.json -> dev-s-locator."""
+    """Read DB credentials from cron_jobs/secrets_database.json -> dev-s-locator (once per process)."""
     secrets_path = r"cron_jobs/secrets_database.json"
     with open(secrets_path, "r", encoding="utf-8") as fh:
         data = json.load(fh)
@@ -136,44 +225,102 @@ def _read_db_config():
     return cfg
 
 
-def fetch_household_from_db(
-    center_lat: float, center_lng: float, radius_km: float = 1
-) -> Dict:
+# Set-based ring queries: $1 coordinate keys, $2 latitudes, $3 longitudes, $4 half-width in degrees of the
+# largest bbox, then one half-width per radius ring. Every point is joined laterally with the features
+# in its largest bbox once, and each ring aggregates the features overlapping its own bbox, matching
+# aggregate_household/aggregate_housing (missing values count as 0, no features give 0s).
+HOUSEHOLD_BATCH_SOURCE = (
+    "schema_marketplace.household_all_features_v12",
+    '"Household_Average_Size", "Household_Median_Size", density',
+)
+HOUSEHOLD_BATCH_AGGREGATES = {
+    "total_households": "COUNT(*) FILTER (WHERE {ring})",
+    "avg_household_size": 'COALESCE(ROUND((AVG(COALESCE(f."Household_Average_Size", 0)) FILTER (WHERE {ring}))::numeric, 2), 0)::float8',
+    "median_household_size": 'COALESCE(ROUND((AVG(COALESCE(f."Household_Median_Size", 0)) FILTER (WHERE {ring}))::numeric, 2), 0)::float8',
+    "density_sum": "ROUND(COALESCE(SUM(f.density) FILTER (WHERE {ring}), 0)::numeric, 2)::float8",
+}
+
+HOUSING_BATCH_COLUMNS = [
+    "Total_housings", "Residential_housings", "Non_Residential_housings", "Owned_housings",
+    "Rented_housings", "Provided_housings", "Other_Residential_housings", "Public_Housing",
+    "Work_Camps", "Commercial_housings", "Other_housings",
+]
+HOUSING_BATCH_SOURCE = (
+    "schema_marketplace.housing_all_features_v12",
+    ", ".join(f'"{column}"' for column in HOUSING_BATCH_COLUMNS) + ", density",
+)
+HOUSING_BATCH_AGGREGATES = {
+    # SUM of the BIGINT columns step4 creates is numeric, which asyncpg returns as Decimal
+    **{
+        column.lower(): f'COALESCE(SUM(f."{column}") FILTER (WHERE {{ring}}), 0)::float8'
+        for column in HOUSING_BATCH_COLUMNS
+    },
+    "density_sum": "ROUND(COALESCE(SUM(f.density) FILTER (WHERE {ring}), 0)::numeric, 2)::float8",
+}
+
+
+def rings_batch_sql(source, aggregates, ring_count):
+    """Batch query aggregating `ring_count` radius rings; ring i's columns are aliased <column>__<i>."""
+    table, columns = source
+    selects = []
+    for index in range(ring_count):
+        delta = f"${index + 5}"
+        ring = (
+            f"f.xmin <= p.lng + {delta} AND f.xmax >= p.lng - {delta} "
+            f"AND f.ymin <= p.lat + {delta} AND f.ymax >= p.lat - {delta}"
+        )
+        selects += [f"{aggregate.format(ring=ring)} AS {alias}__{index}" for alias, aggregate in aggregates.items()]
+    select = ",\n           ".join(selects)
+    return f"""
+    SELECT p.coord_key,
+           {select}
+    FROM unnest($1::bigint[], $2::float8[], $3::float8[]) AS p(coord_key, lat, lng)
+    LEFT JOIN LATERAL (
+        SELECT {columns},
+               ST_XMin(geometry) AS xmin, ST_XMax(geometry) AS xmax,
+               ST_YMin(geometry) AS ymin, ST_YMax(geometry) AS ymax
+        FROM {table}
+        WHERE geometry && ST_MakeEnvelope(p.lng - $4, p.lat - $4, p.lng + $4, p.lat + $4, 4326)
+    ) f ON TRUE
+    GROUP BY p.coord_key
     """
-    Query Postgres household_all_features_v12 for features within a square bbox around the center point.
-    Returns aggregated household statistics compatible with demographics result shape.
 
-    Returns dict with keys:
-      total_households, avg_household_size, median_household_size, density_sum, features_count
-    """
+
+def _batch_args(locations, radii_km):
+    """unnest arrays and bbox half-widths for rings_batch_sql; locations are {lat, lng, key}."""
+    return (
+        [int(loc["key"]) for loc in locations],
+        [float(loc["lat"]) for loc in locations],
+        [float(loc["lng"]) for loc in locations],
+        max(radii_km) / 111,
+        *(radius_km / 111 for radius_km in radii_km),
+    )
+
+
+async def create_db_pool(max_size=10):
+    """asyncpg connection pool on the database in cron_jobs/secrets_database.json."""
+    import asyncpg
+
     cfg = _read_db_config()
-    conn = None
-    bbox = generate_bbox(center_lat, center_lng, radius_km)
-    # Build simple bbox geometry query using ST_MakeEnvelope assuming geometry uses lon/lat
-    sql = f"""
-    SELECT "Household_Average_Size", "Household_Median_Size", density
-    FROM schema_marketplace.household_all_features_v12
-    WHERE geometry && ST_MakeEnvelope({bbox['bottom_lng']}, {bbox['bottom_lat']}, {bbox['top_lng']}, {bbox['top_lat']}, 4326)
+    return await asyncpg.create_pool(
+        database=cfg.get("dbname"),
+        user=cfg.get("user"),
+        password=cfg.get("password"),
+        host=cfg.get("host"),
+        port=int(cfg.get("port") or 5432),
+        min_size=1,
+        max_size=max_size,
+    )
+
+
+def aggregate_household(rows) -> Dict:
     """
-    results = []
-    try:
-        conn = psycopg2.connect(
-            dbname=cfg.get("dbname"),
-            user=cfg.get("user"),
-            password=cfg.get("password"),
-            host=cfg.get("host"),
-            port=cfg.get("port"),
-        )
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute(sql)
-            rows = cur.fetchall()
-            for r in rows:
-                results.append(r)
-    finally:
-        if conn:
-            conn.close()
-
-    if not results:
+    Aggregate household_all_features_v12 rows.
+
+    Returns dict with keys:
+      total_households, avg_household_size, median_household_size, density_sum
+    """
+    if not rows:
         return {
             "total_households": 0,
             "avg_household_size": 0.0,
@@ -182,10 +329,10 @@ def fetch_household_from_db(
         }
 
     # Aggregate
-    total_households = len(results)
-    avg_sizes = [r.get("Household_Average_Size") or 0 for r in results]
-    median_sizes = [r.get("Household_Median_Size") or 0 for r in results]
-    densities = [r.get("density") or 0 for r in results]
+    total_households = len(rows)
+    avg_sizes = [r.get("Household_Average_Size") or 0 for r in rows]
+    median_sizes = [r.get("Household_Median_Size") or 0 for r in rows]
+    densities = [r.get("density") or 0 for r in rows]
 
     aggregated = {
         "total_households": total_households,
@@ -202,41 +349,8 @@ def fetch_household_from_db(
     return aggregated
 
 
-def fetch_housing_from_db(
-    center_lat: float, center_lng: float, radius_km: float = 1
-) -> Dict:
-    """
-    Query Postgres housing_all_features_v12 for features within a square bbox around the center point.
-    Returns aggregated housing statistics.
-
-    Returns dict with keys for totals and averages matching the table columns.
-    """
-    cfg = _read_db_config()
-    conn = None
-    bbox = generate_bbox(center_lat, center_lng, radius_km)
-    sql = f"""
-    SELECT "Total_housings", "Residential_housings", "Non_Residential_housings", "Owned_housings",
-           "Rented_housings", "Provided_housings", "Other_Residential_housings", "Public_Housing",
-           "Work_Camps", "Commercial_housings", "Other_housings", density
-    FROM schema_marketplace.housing_all_features_v12
-    WHERE geometry && ST_MakeEnvelope({bbox['bottom_lng']}, {bbox['bottom_lat']}, {bbox['top_lng']}, {bbox['top_lat']}, 4326)
-    """
-    rows = []
-    try:
-        conn = psycopg2.connect(
-            dbname=cfg.get("dbname"),
-            user=cfg.get("user"),
-            password=cfg.get("password"),
-            host=cfg.get("host"),
-            port=cfg.get("port"),
-        )
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute(sql)
-            rows = cur.fetchall()
-    finally:
-        if conn:
-            conn.close()
-
+def aggregate_housing(rows) -> Dict:
+    """Aggregate housing_all_features_v12 rows into totals matching the table columns."""
     if not rows:
         return {
             "total_housings": 0,
@@ -286,6 +400,34 @@ def fetch_housing_from_db(
     return aggregated
 
 
+def _by_ring(rows, radii_km):
+    """Rows of rings_batch_sql as {radius: {key: result}}."""
+    rings = {radius_km: {} for radius_km in radii_km}
+    for row in rows:
+        row = dict(row)
+        key = row.pop("coord_key")
+        for radius_km in radii_km:
+            rings[radius_km][key] = {}
+        for alias, value in row.items():
+            column, index = alias.rsplit("__", 1)
+            rings[radii_km[int(index)]][key][column] = value
+    return rings
+
+
+async def fetch_household_rings_async(pool, locations, radii_km=(1,)):
+    """Household statistics of every {lat, lng, key} location for each radius in one query, as {radius: {key: result}}."""
+    radii_km = list(radii_km)
+    sql = rings_batch_sql(HOUSEHOLD_BATCH_SOURCE, HOUSEHOLD_BATCH_AGGREGATES, len(radii_km))
+    return _by_ring(await pool.fetch(sql, *_batch_args(locations, radii_km)), radii_km)
+
+
+async def fetch_housing_rings_async(pool, locations, radii_km=(1,)):
+    """Housing statistics of every {lat, lng, key} location for each radius in one query, as {radius: {key: result}}."""
+    radii_km = list(radii_km)
+    sql = rings_batch_sql(HOUSING_BATCH_SOURCE, HOUSING_BATCH_AGGREGATES, len(radii_km))
+    return _by_ring(await pool.fetch(sql, *_batch_args(locations, radii_km)), radii_km)
+
+
 if __name__ == "__main__":
     # 6051728
     # latitude	longitude
@@ -0,0 +1,52 @@
+import asyncio
+import logging
+import os
+import time
+
+# Calls in flight per enricher, override with ENRICHMENT_CONCURRENCY_<ENRICHER>.
+# Household and housing calls are batched queries of a few thousand locations each,
+# traffic calls are jobs of minutes each that the service processes side by side.
+DEFAULT_CONCURRENCY = {
+    "demographics": 16,
+    "household": 4,
+    "housing": 4,
+    "traffic": 4,
+}
+
+
+def enricher_concurrency(enricher):
+    return int(os.getenv(f"ENRICHMENT_CONCURRENCY_{enricher.upper()}", DEFAULT_CONCURRENCY.get(enricher, 8)))
+
+
+async def sliding_window(items, fetch, concurrency, on_result, name="enrichment", progress_every=500):
+    """
+    Await `fetch(item)` for every item with at most `concurrency` calls in flight.
+
+    Each slot picks the next item as soon as its own call finishes, so one slow call never idles
+    the others. `on_result(item, result, error)` is called for every completion (error is None on
+    success). Returns {completed, failed, elapsed, rps}.
+    """
+    items = iter(items)
+    stats = {"completed": 0, "failed": 0}
+    started = time.perf_counter()
+
+    async def slot():
+        for item in items:
+            try:
+                result, error = await fetch(item), None
+            except Exception as e:
+                result, error = None, e
+                stats["failed"] += 1
+            on_result(item, result, error)
+            stats["completed"] += 1
+            if stats["completed"] % progress_every == 0:
+                elapsed = time.perf_counter() - started
+                logging.info(
+                    f"{name}: {stats['completed']} done, {stats['failed']} failed, "
+                    f"{stats['completed'] / elapsed:.1f} req/s"
+                )
+
+    await asyncio.gather(*(slot() for _ in range(max(concurrency, 1))))
+    stats["elapsed"] = time.perf_counter() - started
+    stats["rps"] = stats["completed"] / max(stats["elapsed"], 1e-9)
+    return stats
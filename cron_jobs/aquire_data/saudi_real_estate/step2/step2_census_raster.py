@@ -0,0 +1,217 @@
+import logging
+import os
+
+import numpy as np
+import orjson
+
+from step2_stage_cache import file_digest
+
+# GeoJSON of the saudi_census step1 scripts with the property names of their step2 (run step2 first),
+# the same cells step4 loads into *_all_features_vN
+CENSUS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "saudi_census")
+CENSUS_RASTER_LEVEL = int(os.getenv("CENSUS_RASTER_LEVEL", 12))
+# Kept under ignore/ so step3 does not upload the rasters to the bucket
+CENSUS_RASTER_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "ignore", "census_rasters")
+
+HOUSEHOLD_PROPERTIES = ["Household_Average_Size", "Household_Median_Size", "density"]
+HOUSING_PROPERTIES = [
+    "Total_housings",
+    "Residential_housings",
+    "Non_Residential_housings",
+    "Owned_housings",
+    "Rented_housings",
+    "Provided_housings",
+    "Other_Residential_housings",
+    "Public_Housing",
+    "Work_Camps",
+    "Commercial_housings",
+    "Other_housings",
+    "density",
+]
+# layer -> (saudi_census folder, JSON folder, file name in its v{level} folder, properties)
+CENSUS_LAYERS = {
+    "household": ("household", "household_json_files", "features.json", HOUSEHOLD_PROPERTIES),
+    "housing": ("housing", "housing_json_files", "features.json", HOUSING_PROPERTIES),
+}
+
+
+class CensusRaster:
+    """
+    One census grid level as a raster: cell (row, col) indices plus one value array per property.
+
+    The grid only has to be rectilinear (columns share their lng edges, rows their lat edges),
+    so web-mercator style rows of varying height work as well. Window sums over the cells that
+    overlap a bbox, which is what `geometry && ST_MakeEnvelope(...)` selects, come from a
+    summed-area table: four lookups per location, whatever the radius.
+    """
+
+    def __init__(self, col_min, col_max, row_min, row_max, rows, cols, values):
+        self.col_min, self.col_max = col_min, col_max
+        self.row_min, self.row_max = row_min, row_max
+        self.rows, self.cols = rows, cols
+        self.values = values
+        self.shape = (len(row_min), len(col_min))
+
+    @classmethod
+    def from_geojson(cls, path, properties, decimals=7):
+        """
+        Rasterise the polygon cells of a census GeoJSON. Raises ValueError if they are not a grid
+        or if a property is on none of them (e.g. the file still has the raw names of step1).
+        """
+        with open(path, "rb") as f:
+            features = orjson.loads(f.read()).get("features", [])
+        missing = [
+            prop for prop in properties
+            if not any(prop in (feature.get("properties") or {}) for feature in features)
+        ]
+        if features and missing:
+            raise ValueError(f"{os.path.basename(path)} has no {', '.join(missing)} properties")
+        bounds = np.empty((len(features), 4))
+        values = {prop: np.zeros(len(features)) for prop in properties}
+        kept = 0
+        for feature in features:
+            coordinates = (feature.get("geometry") or {}).get("coordinates") or []
+            if not coordinates:
+                continue
+            ring = np.asarray(coordinates[0], dtype="float64").reshape(-1, 2)
+            bounds[kept] = (ring[:, 0].min(), ring[:, 0].max(), ring[:, 1].min(), ring[:, 1].max())
+            props = feature.get("properties") or {}
+            for prop in properties:
+                # Missing values count as 0, like the aggregation of the database rows
+                values[prop][kept] = float(props.get(prop) or 0)
+            kept += 1
+        bounds = bounds[:kept]
+        values = {prop: array[:kept] for prop, array in values.items()}
+
+        col_min, cols = np.unique(np.round(bounds[:, 0], decimals), return_inverse=True)
+        row_min, rows = np.unique(np.round(bounds[:, 2], decimals), return_inverse=True)
+        col_max = np.full(len(col_min), -np.inf)
+        row_max = np.full(len(row_min), -np.inf)
+        np.maximum.at(col_max, cols, bounds[:, 1])
+        np.maximum.at(row_max, rows, bounds[:, 3])
+        tolerance = 10.0**-decimals * 10
+        if (
+            np.any(np.abs(col_max[cols] - bounds[:, 1]) > tolerance)
+            or np.any(np.abs(row_max[rows] - bounds[:, 3]) > tolerance)
+            or np.any(col_min[1:] < col_max[:-1] - tolerance)
+            or np.any(row_min[1:] < row_max[:-1] - tolerance)
+        ):
+            raise ValueError(f"{os.path.basename(path)} cells do not form a rectilinear grid")
+        return cls(col_min, col_max, row_min, row_max, rows.astype("int32"), cols.astype("int32"), values)
+
+    def save(self, path, **metadata):
+        arrays = {f"value_{prop}": array for prop, array in self.values.items()}
+        metadata = {key: np.asarray(value) for key, value in metadata.items()}
+        np.savez(path, col_min=self.col_min, col_max=self.col_max, row_min=self.row_min,
+                 row_max=self.row_max, rows=self.rows, cols=self.cols, **arrays, **metadata)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            values = {name[len("value_"):]: data[name] for name in data.files if name.startswith("value_")}
+            raster = cls(data["col_min"], data["col_max"], data["row_min"], data["row_max"],
+                         data["rows"], data["cols"], values)
+            raster.metadata = {name: data[name].item() for name in data.files if name.startswith("meta_")}
+        return raster
+
+    def _summed_area(self, cell_values):
+        table = np.zeros((self.shape[0] + 1, self.shape[1] + 1))
+        np.add.at(table, (self.rows + 1, self.cols + 1), cell_values)
+        return table.cumsum(axis=0).cumsum(axis=1)
+
+    def window_sums(self, lat, lng, radii_km):
+        """
+        Number of cells and per-property sums over the cells overlapping each location's
+        ±radius/111 degree bbox, as {radius: (count, {property: sums})} with arrays aligned with lat/lng.
+        Every radius reuses the same summed-area tables, so extra radii only cost four lookups each.
+        """
+        lat = np.asarray(lat, dtype="float64")
+        lng = np.asarray(lng, dtype="float64")
+        windows = {}
+        for radius_km in radii_km:
+            delta = radius_km / 111
+            # First column/row ending at or after the bbox start, last one starting at or before its end
+            c0 = np.searchsorted(self.col_max, lng - delta, side="left")
+            c1 = np.searchsorted(self.col_min, lng + delta, side="right")
+            r0 = np.searchsorted(self.row_max, lat - delta, side="left")
+            r1 = np.searchsorted(self.row_min, lat + delta, side="right")
+            empty = (c0 >= c1) | (r0 >= r1)
+            windows[radius_km] = (r0, np.maximum(r1, r0), c0, np.maximum(c1, c0), empty)
+
+        def window_sums(table):
+            return {
+                radius_km: np.where(empty, 0.0, table[r1, c1] - table[r0, c1] - table[r1, c0] + table[r0, c0])
+                for radius_km, (r0, r1, c0, c1, empty) in windows.items()
+            }
+
+        counts = window_sums(self._summed_area(np.ones(len(self.rows))))
+        # One summed-area table at a time keeps memory at a single raster
+        sums = {prop: window_sums(self._summed_area(values)) for prop, values in self.values.items()}
+        return {
+            radius_km: (np.rint(counts[radius_km]).astype("int64"), {prop: sums[prop][radius_km] for prop in sums})
+            for radius_km in windows
+        }
+
+
+def census_source_path(layer, level=CENSUS_RASTER_LEVEL):
+    folder, json_folder, file_name, _ = CENSUS_LAYERS[layer]
+    return os.path.join(CENSUS_DIR, folder, json_folder, f"v{level}", file_name)
+
+
+def load_census_raster(layer, level=CENSUS_RASTER_LEVEL):
+    """
+    Raster of a census layer, rebuilt from its GeoJSON only when that file changed.
+    Raises FileNotFoundError when the census data has not been fetched on this machine.
+    """
+    source = census_source_path(layer, level)
+    if not os.path.exists(source):
+        raise FileNotFoundError(source)
+    digest = file_digest(source)
+    raster_path = os.path.join(CENSUS_RASTER_DIR, f"{layer}_v{level}.npz")
+    if os.path.exists(raster_path):
+        raster = CensusRaster.load(raster_path)
+        if raster.metadata.get("meta_digest") == digest:
+            return raster
+    logging.info(f"Rasterising {source}")
+    raster = CensusRaster.from_geojson(source, CENSUS_LAYERS[layer][3])
+    os.makedirs(CENSUS_RASTER_DIR, exist_ok=True)
+    raster.save(raster_path, meta_digest=digest)
+    logging.info(f"{layer} v{level}: {len(raster.rows)} cells on a {raster.shape[0]}x{raster.shape[1]} grid")
+    return raster
+
+
+def household_from_raster(raster, locations, radii_km=(1,)):
+    """aggregate_household of every {lat, lng, key} location per radius, as {radius: {key: result}}."""
+    lat, lng = [loc["lat"] for loc in locations], [loc["lng"] for loc in locations]
+    rings = {}
+    for radius_km, (count, sums) in raster.window_sums(lat, lng, radii_km).items():
+        safe_count = np.maximum(count, 1)
+        avg_size = np.where(count > 0, np.round(sums["Household_Average_Size"] / safe_count, 2), 0.0).tolist()
+        median_size = np.where(count > 0, np.round(sums["Household_Median_Size"] / safe_count, 2), 0.0).tolist()
+        density = np.round(sums["density"], 2).tolist()
+        count = count.tolist()
+        rings[radius_km] = {
+            loc["key"]: {
+                "total_households": count[i],
+                "avg_household_size": avg_size[i],
+                "median_household_size": median_size[i],
+                "density_sum": density[i],
+            }
+            for i, loc in enumerate(locations)
+        }
+    return rings
+
+
+def housing_from_raster(raster, locations, radii_km=(1,)):
+    """aggregate_housing of every {lat, lng, key} location per radius, as {radius: {key: result}}."""
+    lat, lng = [loc["lat"] for loc in locations], [loc["lng"] for loc in locations]
+    rings = {}
+    for radius_km, (_, sums) in raster.window_sums(lat, lng, radii_km).items():
+        # Floats whether or not the sums are whole, like the ::float8 sums of the database path
+        columns = {prop.lower(): sums[prop].astype("float64").tolist() for prop in HOUSING_PROPERTIES if prop != "density"}
+        columns["density_sum"] = np.round(sums["density"], 2).tolist()
+        rings[radius_km] = {
+            loc["key"]: {column: values[i] for column, values in columns.items()}
+            for i, loc in enumerate(locations)
+        }
+    return rings
@@ -0,0 +1,29 @@
+import os
+
+import numpy as np
+
+# Decimal places kept when quantising coordinates: 6 is ~0.1 m, 5 is ~1 m, 4 is ~11 m.
+# 7 is the most that still fits a key in a signed 64-bit integer.
+COORD_PRECISION = min(int(os.getenv("COORD_PRECISION", 6)), 7)
+
+
+def coord_key(lat, lng, precision=COORD_PRECISION):
+    """
+    Integer key of a coordinate rounded to `precision` decimal places.
+    Equal for every listing at the same (rounded) spot, unlike formatted float strings.
+    """
+    scale = 10**precision
+    lat_index = int(round((float(lat) + 90) * scale))
+    lng_index = int(round((float(lng) + 180) * scale))
+    return lat_index * (360 * scale + 1) + lng_index
+
+
+def coord_keys(lat, lng, precision=COORD_PRECISION):
+    """Vectorised coord_key over latitude/longitude arrays or Series; rows with missing coordinates give -1."""
+    scale = 10**precision
+    lat = np.asarray(lat, dtype="float64")
+    lng = np.asarray(lng, dtype="float64")
+    valid = ~(np.isnan(lat) | np.isnan(lng))
+    lat_index = np.rint((np.where(valid, lat, 0) + 90) * scale).astype("int64")
+    lng_index = np.rint((np.where(valid, lng, 0) + 180) * scale).astype("int64")
+    return np.where(valid, lat_index * (360 * scale + 1) + lng_index, -1)
@@ -0,0 +1,79 @@
+import os
+
+import orjson
+import pandas as pd
+
+# Columns that can be derived from the listing JSON in 'data': column -> (dotted key path, pandas dtype).
+# direction_id is a small nullable integer, matching step2_schema; step4 still infers it as REAL since it has blanks.
+DATA_FIELDS = {
+    "direction_id": ("direction_id", "Int16"),
+    "district_id": ("district_id", "Int64"),
+    "province_id": ("province_id", "Int64"),
+    "area": ("area", "float64"),
+    "rooms": ("rooms", "Int64"),
+    "beds": ("beds", "Int64"),
+    "livings": ("livings", "Int64"),
+    "wc": ("wc", "Int64"),
+    "age": ("age", "Int64"),
+    "street_width": ("street_width", "float64"),
+    "meter_price": ("meter_price", "float64"),
+    "last_update": ("last_update", "Int64"),
+    "published_at": ("published_at", "Int64"),
+    "advertiser_type": ("advertiser_type", "string"),
+    "user_type": ("user_type", "string"),
+    "user_paid": ("user.paid", "boolean"),
+    "district": ("district", "string"),
+}
+
+# Every extra column changes the schema of saudi_real_estate.csv in step4, so only direction_id is on by default
+DATA_EXTRACT_FIELDS = [
+    field.strip() for field in os.getenv("DATA_EXTRACT_FIELDS", "direction_id").split(",") if field.strip()
+]
+# Processes transforming chunks in parallel; each holds up to two chunks, so keep this low on small VMs
+DATA_EXTRACT_WORKERS = int(os.getenv("DATA_EXTRACT_WORKERS", min(2, os.cpu_count() or 1)))
+
+
+def _loads(blob):
+    """The listing dict of a JSON blob, {} when it is missing or not a JSON object."""
+    if isinstance(blob, (str, bytes)):
+        try:
+            listing = orjson.loads(blob)
+        except orjson.JSONDecodeError:
+            return {}
+        return listing if isinstance(listing, dict) else {}
+    return {}
+
+
+def extract_data_columns(data, fields=None):
+    """
+    Parse every JSON blob of the `data` Series once and return a DataFrame with one typed column
+    per requested field, aligned to `data`'s index. Unparseable or missing blobs give nulls.
+
+    Parsing is one orjson call per blob; the fields are then picked column-wise: top-level keys
+    by building a frame of only those keys, nested ones with Series.str.get on the dict column.
+    """
+    fields = fields or DATA_EXTRACT_FIELDS
+    unknown = [field for field in fields if field not in DATA_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown data fields {unknown}, expected some of {list(DATA_FIELDS)}")
+    paths = {field: DATA_FIELDS[field][0].split(".") for field in fields}
+
+    listings = [_loads(blob) for blob in data.tolist()]
+    top_level = list(dict.fromkeys(path[0] for path in paths.values()))
+    frame = pd.DataFrame(listings, columns=top_level, index=data.index)
+
+    columns = {}
+    for field, path in paths.items():
+        series = frame[path[0]]
+        for key in path[1:]:
+            # .str.get on non-dict values (scalars, None) gives NaN, like a missing key
+            series = series.where([isinstance(value, dict) for value in series.tolist()]).str.get(key)
+        dtype = DATA_FIELDS[field][1]
+        series = series.astype(object).where(series.notna(), None)
+        if dtype in ("float64", "Int64", "Int16", "Int32"):
+            series = pd.to_numeric(series, errors="coerce")
+        if dtype in ("Int64", "Int16", "Int32"):
+            # Fractional values cannot be held by an integer column
+            series = series.where(series % 1 == 0)
+        columns[field] = series.astype(dtype)
+    return pd.DataFrame(columns, index=data.index)
@@ -0,0 +1,410 @@
+import asyncio
+import logging
+import os
+from datetime import datetime
+
+import httpx
+
+from step2_add_demographics import aggregate_household, aggregate_housing
+from step2_add_demographics import DEMOGRAPHICS_TOKENS
+from step2_add_demographics import create_db_pool
+from step2_add_demographics import fetch_demographics_rings_async
+from step2_add_demographics import fetch_household_rings_async
+from step2_add_demographics import fetch_housing_rings_async
+from step2_async_engine import enricher_concurrency, sliding_window
+from step2_census_raster import household_from_raster, housing_from_raster, load_census_raster
+from step2_enrichment_cache import EnrichmentCache
+from step2_results_store import ResultsStore, materialise_combined
+from step2_traffic_analysis_api import TRAFFIC_TOKENS, TRAFFIC_REQUEST_TIMEOUT_SECONDS, process_traffic_batch_async
+from step2_traffic_analysis_api import traffic_scenario_key
+from service_guard import CircuitOpenError, log_service_stats
+
+# Enrichers that call their service on this run, e.g. ENRICHERS=traffic,household.
+# The others still contribute whatever the enrichment cache holds for them to the combined output.
+ENABLED_ENRICHERS = os.getenv("ENRICHERS", "traffic")
+# How household/housing are answered: "raster" from in-process census rasters (failing when the
+# census GeoJSON cannot be rasterised), "db" always from PostGIS, "auto" from the rasters when they
+# can be built and from PostGIS with a warning otherwise
+CENSUS_ENRICHMENT = os.getenv("CENSUS_ENRICHMENT", "auto")
+# Extra catchments of the demographics, household and housing enrichers, e.g. ENRICHMENT_EXTRA_RADII_KM=0.5,2,5.
+# Each adds its columns with a radius suffix (total_households_2km, avg_income_500m), computed from the
+# same lookup as the 1 km columns, which keep their names.
+ENRICHMENT_EXTRA_RADII_KM = [float(r) for r in os.getenv("ENRICHMENT_EXTRA_RADII_KM", "").split(",") if r.strip()]
+
+
+def radius_suffix(radius_km):
+    metres = round(radius_km * 1000)
+    return f"_{metres // 1000}km" if metres % 1000 == 0 else f"_{metres}m"
+
+
+class Enricher:
+    """
+    One enrichment source of the combined step2 output.
+
+    `fetch(locations)` gets a batch of `batch_size` {lat, lng, key} locations and returns
+    {key(location): result} with a value for each of `columns`. Locations whose call failed get
+    `default` (kept out of the enrichment cache so they are retried next run), or stay pending
+    for the next run when `default` is None. `renames` maps columns that would clash with another
+    enricher's to their name in the combined CSV. `cache_variant` keys the cached results by the
+    request parameters they depend on besides the location.
+
+    Enrichers with `extra_radii` compute every radius in the same fetch; the columns of radius_km
+    keep their names and those of the extra radii get a radius_suffix.
+    """
+
+    name = ""
+    columns = []
+    date_column = ""
+    default = None
+    radius_km = 0
+    extra_radii = []
+    batch_size = 1
+    # Completed results buffered before they are written to the store and cache
+    flush_every = 100
+    renames = {}
+    cache_variant = ""
+
+    @property
+    def radii(self):
+        return list(dict.fromkeys([self.radius_km, *self.extra_radii]))
+
+    def suffix(self, radius_km):
+        return "" if radius_km == self.radius_km else radius_suffix(radius_km)
+
+    @property
+    def stored_columns(self):
+        return [f"{column}{self.suffix(r)}" for r in self.radii for column in self.columns] + [self.date_column]
+
+    @property
+    def output_renames(self):
+        """`renames` applied to the columns of every radius."""
+        return {
+            f"{column}{self.suffix(r)}": f"{renamed}{self.suffix(r)}"
+            for r in self.radii
+            for column, renamed in self.renames.items()
+        }
+
+    def join_rings(self, rings):
+        """{radius: result} as one result holding the suffixed columns of every radius."""
+        joined = {}
+        for radius_km, result in rings.items():
+            for column, value in result.items():
+                joined[column if column == self.date_column else f"{column}{self.suffix(radius_km)}"] = value
+        return joined
+
+    def split_rings(self, result):
+        """join_rings reversed, each radius keeping the analysis date."""
+        return {
+            r: {
+                **{column: result.get(f"{column}{self.suffix(r)}") for column in self.columns},
+                self.date_column: result.get(self.date_column),
+            }
+            for r in self.radii
+        }
+
+    def join_ring_batches(self, rings):
+        """{radius: {key: result}} as {key: joined result}."""
+        return {key: self.join_rings({r: rings[r][key] for r in rings}) for key in rings[self.radius_km]}
+
+    def failed_result(self):
+        return self.join_rings({r: self.default for r in self.radii})
+
+    def key(self, location):
+        return location["key"]
+
+    async def open(self, concurrency):
+        """Set up clients, pools or auth shared by every fetch."""
+
+    async def close(self):
+        pass
+
+    async def fetch(self, locations):
+        raise NotImplementedError
+
+
+class DemographicsEnricher(Enricher):
+    name = "demographics"
+    columns = [
+        "total_population",
+        "avg_density",
+        "avg_median_age",
+        "avg_income",
+        "percentage_age_above_20",
+        "percentage_age_above_25",
+        "percentage_age_above_30",
+        "percentage_age_above_35",
+        "percentage_age_above_40",
+        "percentage_age_above_45",
+        "percentage_age_above_50",
+    ]
+    date_column = "demographics_analysis_date"
+    radius_km = 1
+    extra_radii = ENRICHMENT_EXTRA_RADII_KM
+
+    async def open(self, concurrency):
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        self.client = httpx.AsyncClient(limits=limits, timeout=60)
+
+    async def close(self):
+        await self.client.aclose()
+
+    async def fetch(self, locations):
+        (loc,) = locations
+        rings = await DEMOGRAPHICS_TOKENS.call_async(
+            lambda credentials: fetch_demographics_rings_async(
+                self.client, loc["lat"], loc["lng"], *credentials, self.radii
+            )
+        )
+        return {self.key(loc): self.join_rings(rings)}
+
+
+class HouseholdEnricher(Enricher):
+    name = "household"
+    columns = ["total_households", "avg_household_size", "median_household_size", "density_sum"]
+    date_column = "household_analysis_date"
+    default = aggregate_household([])
+    radius_km = 1
+    extra_radii = ENRICHMENT_EXTRA_RADII_KM
+    renames = {"density_sum": "household_density_sum"}
+    # Locations aggregated by PostGIS per round trip
+    batch_size = int(os.getenv("DB_ENRICHMENT_BATCH_SIZE", 2000))
+    fetch_batch = staticmethod(fetch_household_rings_async)
+    raster_results = staticmethod(household_from_raster)
+
+    async def open(self, concurrency):
+        self.raster = None
+        if CENSUS_ENRICHMENT == "raster":
+            self.raster = await asyncio.to_thread(load_census_raster, self.name)
+        elif CENSUS_ENRICHMENT == "auto":
+            try:
+                self.raster = await asyncio.to_thread(load_census_raster, self.name)
+            except (FileNotFoundError, ValueError) as e:
+                logging.warning(
+                    f"No {self.name} census raster ({type(e).__name__}: {e}), querying the database instead; "
+                    f"set CENSUS_ENRICHMENT=raster to fail instead"
+                )
+        if self.raster is not None:
+            # Array lookups, not round trips: everything in a few large batches
+            self.batch_size = 100000
+        else:
+            self.pool = await create_db_pool(max_size=concurrency)
+
+    async def close(self):
+        if self.raster is None:
+            await self.pool.close()
+
+    async def fetch(self, locations):
+        if self.raster is not None:
+            rings = self.raster_results(self.raster, locations, self.radii)
+        else:
+            rings = await self.fetch_batch(self.pool, locations, self.radii)
+        return self.join_ring_batches(rings)
+
+
+class HousingEnricher(HouseholdEnricher):
+    name = "housing"
+    columns = [
+        "total_housings",
+        "residential_housings",
+        "non_residential_housings",
+        "owned_housings",
+        "rented_housings",
+        "provided_housings",
+        "other_residential_housings",
+        "public_housing",
+        "work_camps",
+        "commercial_housings",
+        "other_housings",
+        "density_sum",
+    ]
+    date_column = "housing_analysis_date"
+    default = aggregate_housing([])
+    renames = {"density_sum": "housing_density_sum"}
+    fetch_batch = staticmethod(fetch_housing_rings_async)
+    raster_results = staticmethod(housing_from_raster)
+
+
+class TrafficEnricher(Enricher):
+    name = "traffic"
+    columns = [
+        "traffic_score",
+        "traffic_storefront_score",
+        "traffic_area_score",
+        "traffic_screenshot_filename",
+    ]
+    date_column = "traffic_analysis_date"
+    default = {
+        "traffic_score": 0,
+        "traffic_storefront_score": 0,
+        "traffic_area_score": 0,
+        "traffic_screenshot_filename": "",
+    }
+    batch_size = int(os.getenv("TRAFFIC_BATCH_SIZE", 10))
+    # Every batch takes minutes: store its results as soon as it completes
+    flush_every = 1
+    # Listings sharing a storefront location, or still listed on the next run, reuse the analysis
+    # of the same direction/day/time/zoom until the traffic TTL expires
+    cache_variant = traffic_scenario_key()
+
+    async def open(self, concurrency):
+        # Fail before any batch is sent when the API does not accept the credentials
+        await TRAFFIC_TOKENS.get_async()
+        logging.info("Successfully authenticated with API")
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        self.client = httpx.AsyncClient(limits=limits, timeout=TRAFFIC_REQUEST_TIMEOUT_SECONDS)
+
+    async def close(self):
+        await self.client.aclose()
+
+    async def fetch(self, locations):
+        return await TRAFFIC_TOKENS.call_async(
+            lambda token: process_traffic_batch_async(self.client, locations, token)
+        )
+
+
+ENRICHERS = [DemographicsEnricher, HouseholdEnricher, HousingEnricher, TrafficEnricher]
+
+
+class RingCache:
+    """
+    Enrichment cache of an enricher with one EnrichmentCache per radius: a result is served only
+    when every radius is cached, and adding a radius keeps the cached entries of the others.
+    """
+
+    def __init__(self, enricher):
+        self.enricher = enricher
+        self.caches = {
+            r: EnrichmentCache(enricher.name, radius_km=r, variant=enricher.cache_variant) for r in enricher.radii
+        }
+
+    def get_many(self, keys):
+        keys = list(keys)
+        found = {}
+        for radius_km, cache in self.caches.items():
+            found[radius_km] = cache.get_many(keys)
+            keys = [key for key in keys if key in found[radius_km]]
+        return {key: self.enricher.join_rings({r: found[r][key] for r in found}) for key in keys}
+
+    def put_many(self, results):
+        rings = {key: self.enricher.split_rings(result) for key, result in results.items()}
+        for radius_km, cache in self.caches.items():
+            cache.put_many({key: split[radius_km] for key, split in rings.items()})
+
+    def close(self):
+        for cache in self.caches.values():
+            cache.close()
+
+
+def take_cached_results(store, cache, locations):
+    """
+    Store the results the enrichment cache already holds for `locations`
+    and return the locations that still need a service call.
+    """
+    cached = cache.get_many(loc["key"] for loc in locations)
+    if cached:
+        store.save(cached)
+        logging.info(f"{store.table}: {len(cached)} of {len(locations)} locations served from the enrichment cache")
+    return [loc for loc in locations if loc["key"] not in cached]
+
+
+async def run_enricher(enricher, store, cache, locations, flush_every=None):
+    """
+    Fetch `locations` in batches through a sliding window, saving results to the store
+    and cache every `flush_every` results (the enricher's by default).
+    """
+    flush_every = flush_every or enricher.flush_every
+    concurrency = enricher_concurrency(enricher.name)
+    results = {}
+    failed_keys = set()
+
+    def flush():
+        store.save(results)
+        cache.put_many({key: value for key, value in results.items() if key not in failed_keys})
+        results.clear()
+
+    def on_result(batch, batch_results, error):
+        if isinstance(error, CircuitOpenError):
+            # Not called at all while the service is down: leave the batch pending for the next run
+            return
+        if error is not None:
+            logging.error(f"{enricher.name} failed for {len(batch)} locations from {batch[0]['lat']}, {batch[0]['lng']}: {error}")
+            if enricher.default is None:
+                return
+            batch_results = {enricher.key(loc): enricher.failed_result() for loc in batch}
+            failed_keys.update(batch_results)
+        analysis_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        for key, result in batch_results.items():
+            results[key] = {**result, enricher.date_column: analysis_date}
+        if len(results) >= flush_every:
+            flush()
+
+    # Opened first: an enricher may pick its batch size from what it could open
+    await enricher.open(concurrency)
+    batches = [locations[start:start + enricher.batch_size] for start in range(0, len(locations), enricher.batch_size)]
+    logging.info(
+        f"Enriching {len(locations)} locations with {enricher.name} in {len(batches)} calls, "
+        f"{concurrency} in flight"
+    )
+    try:
+        stats = await sliding_window(batches, enricher.fetch, concurrency, on_result, name=enricher.name)
+    finally:
+        flush()
+        await enricher.close()
+    logging.info(
+        f"{enricher.name} completed: {stats['completed']} calls ({stats['failed']} failed) "
+        f"in {stats['elapsed']:.1f}s, {stats['rps']:.1f} calls/s"
+    )
+    return stats
+
+
+async def _run_all(runs):
+    outcomes = await asyncio.gather(*(run_enricher(*run) for run in runs), return_exceptions=True)
+    for (enricher, *_), outcome in zip(runs, outcomes):
+        if isinstance(outcome, Exception):
+            logging.error(f"{enricher.name} enrichment stopped: {outcome}")
+
+
+def enrich_saudi_csv(saudi_csv_path, output_path, input_columns, enabled=None, enrichers=ENRICHERS):
+    """
+    Enrich the filtered Saudi CSV with every enricher in one pass and write one combined CSV.
+
+    The input is scanned once for its unique coordinates. Each enricher keeps its own results store
+    and cache; the enabled ones fetch what is still missing, all concurrently in one event loop,
+    and the others only contribute cached results. Returns the output path.
+    """
+    enabled = ENABLED_ENRICHERS if enabled is None else enabled
+    if isinstance(enabled, str):
+        enabled = enabled.split(",")
+    enabled = {name.strip() for name in enabled if name.strip()}
+    enrichers = [enricher_class() for enricher_class in enrichers]
+    logging.info(f"Input CSV: {saudi_csv_path}")
+    logging.info(f"Enriched Output CSV: {output_path}")
+
+    stores = {
+        e.name: ResultsStore(e.name, e.stored_columns, saudi_csv_path, variant=e.cache_variant) for e in enrichers
+    }
+    caches = {e.name: RingCache(e) for e in enrichers}
+    locations = next(iter(stores.values())).unique_locations()
+
+    runs = []
+    for enricher in enrichers:
+        store, cache = stores[enricher.name], caches[enricher.name]
+        pending = take_cached_results(store, cache, store.pending_locations(locations))
+        if enricher.name not in enabled:
+            logging.info(f"{enricher.name} is not enabled, {len(pending)} locations left without results")
+        elif pending:
+            runs.append((enricher, store, cache, pending))
+        else:
+            logging.info(f"All locations already have {enricher.name} data")
+
+    if runs:
+        asyncio.run(_run_all(runs))
+
+    logging.info("Finalizing enriched output file...")
+    rows = materialise_combined([(stores[e.name], e.output_renames) for e in enrichers], output_path, input_columns)
+    for enricher in enrichers:
+        stores[enricher.name].close()
+        caches[enricher.name].close()
+    log_service_stats()
+    logging.info(f"Enriched CSV with {rows} rows saved to: {output_path}")
+    return output_path
@@ -0,0 +1,175 @@
+import logging
+import os
+import sqlite3
+import time
+
+import orjson
+
+from step2_coord_keys import COORD_PRECISION
+
+# Kept under ignore/ so step3 does not upload the cache to the bucket
+ENRICHMENT_CACHE_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "ignore", "enrichment_cache.sqlite")
+
+# Census-derived data changes rarely, traffic much more often.
+# Override per enricher with ENRICHMENT_CACHE_TTL_DAYS_<ENRICHER>, e.g. ENRICHMENT_CACHE_TTL_DAYS_TRAFFIC=3
+DEFAULT_TTL_DAYS = {
+    "demographics": 90,
+    "household": 90,
+    "housing": 90,
+    "traffic": 7,
+}
+ENRICHMENT_CACHE_MAX_ENTRIES = int(os.getenv("ENRICHMENT_CACHE_MAX_ENTRIES", 500000))
+
+
+def ttl_seconds(enricher):
+    days = float(os.getenv(f"ENRICHMENT_CACHE_TTL_DAYS_{enricher.upper()}", DEFAULT_TTL_DAYS.get(enricher, 30)))
+    return days * 86400
+
+
+class EnrichmentCache:
+    """
+    Persistent cache of enrichment results across daily runs, per enricher.
+
+    Entries are keyed by (quantised coordinate key, key precision, radius) and by `variant`, the
+    request parameters other than the location that the results depend on (e.g. the traffic
+    scenario). They expire after the enricher's TTL and are evicted least-recently-used first once
+    the cache's own (enricher, variant, radius) holds more than `max_entries`, so the caches of the
+    other radii of a run never evict what it just stored. Only successful results should be put,
+    so failures are retried next run.
+    """
+
+    def __init__(self, enricher, radius_km=0, ttl=None, max_entries=ENRICHMENT_CACHE_MAX_ENTRIES,
+                 path=ENRICHMENT_CACHE_PATH, precision=COORD_PRECISION, variant=""):
+        self.enricher = enricher
+        self.variant = variant
+        self.radius_km = radius_km
+        self.ttl = ttl if ttl is not None else ttl_seconds(enricher)
+        self.max_entries = max_entries
+        self.precision = precision
+        self.stats = {"hits": 0, "misses": 0, "stored": 0, "evicted": 0}
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("BEGIN IMMEDIATE")
+        self._migrate()
+        self._create_table()
+        # Eviction counts and drops the entries of one (enricher, variant, radius) by last use
+        self.conn.execute("DROP INDEX IF EXISTS enrichment_cache_lru")
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS enrichment_cache_scope_lru "
+            "ON enrichment_cache (enricher, variant, radius_km, last_used)"
+        )
+        self.conn.commit()
+
+    def _create_table(self):
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS enrichment_cache (
+                enricher TEXT NOT NULL,
+                variant TEXT NOT NULL DEFAULT '',
+                coord_key INTEGER NOT NULL,
+                precision INTEGER NOT NULL,
+                radius_km REAL NOT NULL,
+                value BLOB NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (enricher, variant, coord_key, precision, radius_km)
+            ) WITHOUT ROWID
+            """
+        )
+
+    def _migrate(self):
+        """Move entries of caches that stored the variant in the enricher column as '<enricher>:<variant>'."""
+        columns = [info[1] for info in self.conn.execute("PRAGMA table_info(enrichment_cache)")]
+        if not columns or "variant" in columns:
+            return
+        logging.info("Moving enrichment cache variants to their own column")
+        self.conn.execute("ALTER TABLE enrichment_cache RENAME TO enrichment_cache_old")
+        self.conn.execute("DROP INDEX IF EXISTS enrichment_cache_lru")
+        self._create_table()
+        self.conn.execute(
+            """
+            INSERT INTO enrichment_cache
+            SELECT CASE WHEN instr(enricher, ':') > 0 THEN substr(enricher, 1, instr(enricher, ':') - 1) ELSE enricher END,
+                   CASE WHEN instr(enricher, ':') > 0 THEN substr(enricher, instr(enricher, ':') + 1) ELSE '' END,
+                   coord_key, precision, radius_km, value, created_at, last_used
+            FROM enrichment_cache_old
+            """
+        )
+        self.conn.execute("DROP TABLE enrichment_cache_old")
+
+    def get_many(self, keys, batch_size=500):
+        """Fresh cached results for `keys` as {coord_key: result}; marks them as recently used."""
+        now = time.time()
+        found = {}
+        keys = list(keys)
+        for start in range(0, len(keys), batch_size):
+            batch = keys[start:start + batch_size]
+            placeholders = ", ".join("?" for _ in batch)
+            rows = self.conn.execute(
+                f"""
+                SELECT coord_key, value FROM enrichment_cache
+                WHERE enricher = ? AND variant = ? AND precision = ? AND radius_km = ? AND created_at >= ?
+                  AND coord_key IN ({placeholders})
+                """,
+                (self.enricher, self.variant, self.precision, self.radius_km, now - self.ttl, *batch),
+            ).fetchall()
+            for key, value in rows:
+                found[key] = orjson.loads(value)
+        if found:
+            self.conn.executemany(
+                """
+                UPDATE enrichment_cache SET last_used = ?
+                WHERE enricher = ? AND variant = ? AND coord_key = ? AND precision = ? AND radius_km = ?
+                """,
+                [(now, self.enricher, self.variant, key, self.precision, self.radius_km) for key in found],
+            )
+            self.conn.commit()
+        self.stats["hits"] += len(found)
+        self.stats["misses"] += len(keys) - len(found)
+        return found
+
+    def put_many(self, results):
+        """Store {coord_key: result} as fresh entries."""
+        now = time.time()
+        rows = [
+            (self.enricher, self.variant, key, self.precision, self.radius_km,
+             orjson.dumps(result, option=orjson.OPT_SERIALIZE_NUMPY), now, now)
+            for key, result in results.items()
+        ]
+        self.conn.executemany("INSERT OR REPLACE INTO enrichment_cache VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        self.conn.commit()
+        self.stats["stored"] += len(rows)
+
+    def evict(self):
+        """Drop expired entries, then the least recently used ones of this variant and radius beyond `max_entries`."""
+        cursor = self.conn.execute(
+            "DELETE FROM enrichment_cache WHERE enricher = ? AND created_at < ?",
+            (self.enricher, time.time() - self.ttl),
+        )
+        evicted = cursor.rowcount
+        (count,) = self.conn.execute(
+            "SELECT COUNT(*) FROM enrichment_cache WHERE enricher = ? AND variant = ? AND radius_km = ?",
+            (self.enricher, self.variant, self.radius_km),
+        ).fetchone()
+        if count > self.max_entries:
+            cursor = self.conn.execute(
+                """
+                DELETE FROM enrichment_cache WHERE (enricher, variant, coord_key, precision, radius_km) IN (
+                    SELECT enricher, variant, coord_key, precision, radius_km FROM enrichment_cache
+                    WHERE enricher = ? AND variant = ? AND radius_km = ? ORDER BY last_used LIMIT ?
+                )
+                """,
+                (self.enricher, self.variant, self.radius_km, count - self.max_entries),
+            )
+            evicted += cursor.rowcount
+        self.conn.commit()
+        self.stats["evicted"] += evicted
+        return evicted
+
+    def close(self):
+        self.evict()
+        name = f"{self.enricher} {self.variant}" if self.variant else self.enricher
+        logging.info(f"Enrichment cache ({name}): {self.stats}")
+        self.conn.close()
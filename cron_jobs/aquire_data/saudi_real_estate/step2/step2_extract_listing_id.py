@@ -1,7 +1,7 @@
 import re
 
-import pandas as pd
 import os
+from step2_schema import read_real_estate_csv
 
 def extract_listing_id(url):
     """
@@ -28,7 +28,7 @@ def add_listing_ids_to_csv(csv_path, chunk_size=5000):
     temp_path = csv_path + ".tmp"
     first_chunk = True
     print(f"Processing CSV to add listing IDs: {csv_path}")
-    for chunk in pd.read_csv(csv_path, chunksize=chunk_size):
+    for chunk in read_real_estate_csv(csv_path, chunksize=chunk_size):
         print(f"Processing chunk with {len(chunk)} rows")
         chunk['listing_id'] = chunk['url'].apply(extract_listing_id)
         if first_chunk:
@@ -0,0 +1,204 @@
+"""
+Load test of the enrichment API clients against the local stand-ins of step2_mock_services.py.
+
+    python cron_jobs/aquire_data/saudi_real_estate/step2/step2_load_test.py --locations 500
+    python cron_jobs/aquire_data/saudi_real_estate/step2/step2_load_test.py --error-rate 0.1 --rate-limit 30 --token-ttl 5
+    python cron_jobs/aquire_data/saudi_real_estate/step2/step2_load_test.py --url http://127.0.0.1:8765 --scenarios traffic
+
+Starts the stand-ins in a background thread (or uses the server at --url), points the clients at
+them and drives the real code: the demographics and traffic enrichers through the step2 sliding
+window, and the fetch_dataset pagination of the Google-category step1. Prints throughput, latency
+percentiles and failures per scenario, with the retry, throttling and circuit breaker counters of
+the service guards and the logins of the token managers.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import random
+import socket
+import sys
+import threading
+import time
+from collections import Counter
+
+import numpy as np
+
+from step2_mock_services import add_settings_arguments, create_app, settings_from_args
+
+GGL_STEP1_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+                             "saudi_ggl_categories_full_data")
+SCENARIOS = ["demographics", "traffic", "dataset"]
+
+
+class CallStats:
+    """Latency and outcome of every call of one scenario."""
+
+    def __init__(self, name):
+        self.name = name
+        self.latencies = []
+        self.errors = Counter()
+        self.items = 0
+
+    async def measure(self, awaitable, items=1):
+        started = time.perf_counter()
+        try:
+            result = await awaitable
+        except Exception as e:
+            status = getattr(getattr(e, "response", None), "status_code", None) or getattr(e, "status", None)
+            self.errors[f"{type(e).__name__} {status}" if status else type(e).__name__] += 1
+            raise
+        finally:
+            self.latencies.append(time.perf_counter() - started)
+        if result is None:
+            # The fetch_dataset client logs and swallows its failures
+            self.errors["no response"] += 1
+        else:
+            self.items += items
+        return result
+
+    def report(self, elapsed, extra=None):
+        latencies = np.asarray(self.latencies or [0.0])
+        failed = sum(self.errors.values())
+        p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+        print(f"\n{self.name}")
+        print(f"  calls      {len(self.latencies)} in {elapsed:.1f}s: {len(self.latencies) / max(elapsed, 1e-9):.1f} calls/s, "
+              f"{self.items / max(elapsed, 1e-9):.1f} items/s")
+        print(f"  latency    p50 {p50 * 1000:.0f}ms  p90 {p90 * 1000:.0f}ms  p99 {p99 * 1000:.0f}ms  max {latencies.max() * 1000:.0f}ms")
+        print(f"  failed     {failed} ({dict(self.errors) if self.errors else 'none'})")
+        for label, value in (extra or {}).items():
+            print(f"  {label:<10} {value}")
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_mock_server(settings, port):
+    """step2_mock_services on 127.0.0.1:`port` in a daemon thread; set should_exit to stop it."""
+    import uvicorn
+
+    server = uvicorn.Server(uvicorn.Config(create_app(settings), host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+def random_locations(count, seed=0):
+    """Listings scattered over Riyadh, as the {lat, lng, key} locations the enrichers get."""
+    rng = random.Random(seed)
+    return [{"lat": rng.uniform(24.55, 24.95), "lng": rng.uniform(46.5, 46.9), "key": i} for i in range(count)]
+
+
+async def run_enricher_scenario(enricher, locations, concurrency):
+    from step2_async_engine import sliding_window
+
+    stats = CallStats(f"{enricher.name} ({concurrency} in flight, {enricher.batch_size} per call)")
+    await enricher.open(concurrency)
+    batches = [locations[start:start + enricher.batch_size] for start in range(0, len(locations), enricher.batch_size)]
+    started = time.perf_counter()
+    try:
+        await sliding_window(
+            batches,
+            lambda batch: stats.measure(enricher.fetch(batch), len(batch)),
+            concurrency,
+            lambda *_: None,
+            name=enricher.name,
+        )
+    finally:
+        await enricher.close()
+    return stats, time.perf_counter() - started
+
+
+async def run_dataset_scenario(queries, concurrency):
+    """Page through every query like step1_get_data.fetch_data, `concurrency` queries at a time."""
+    import aiohttp
+
+    sys.path.append(GGL_STEP1_DIR)
+    import step1_get_data
+    from token_manager import token_manager
+
+    stats = CallStats(f"fetch_dataset ({concurrency} queries in flight)")
+    auth_tokens = token_manager(
+        "fetch_dataset", lambda: step1_get_data.login_and_get_token("load-test@example.com", "load-test")
+    )
+    pending = list(queries)
+
+    async def crawl(session):
+        while pending:
+            query = pending.pop(0)
+            token, page = "", 1
+            while True:
+                response = await stats.measure(
+                    step1_get_data.make_api_call(session, query, token, page, "category_search", auth_tokens)
+                )
+                if not response or not response["data"]["next_page_token"]:
+                    break
+                token, page = response["data"]["next_page_token"], page + 1
+
+    started = time.perf_counter()
+    # The client prints every page
+    with contextlib.redirect_stdout(io.StringIO()):
+        async with aiohttp.ClientSession() as session:
+            await asyncio.gather(*(crawl(session) for _ in range(concurrency)))
+    return stats, time.perf_counter() - started, auth_tokens
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", help="Use the stand-ins already running at this URL instead of starting them")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"Comma separated, of {', '.join(SCENARIOS)}")
+    parser.add_argument("--locations", type=int, default=200, help="Listings sent to each enricher")
+    parser.add_argument("--queries", type=int, default=8, help="fetch_dataset queries to page through")
+    parser.add_argument("--demographics-concurrency", type=int, help="Defaults to the enrichment setting")
+    parser.add_argument("--traffic-concurrency", type=int, help="Defaults to the enrichment setting")
+    parser.add_argument("--dataset-concurrency", type=int, default=4)
+    add_settings_arguments(parser)
+    args = parser.parse_args()
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+
+    server = None
+    base_url = args.url
+    if base_url is None:
+        port = free_port()
+        server = start_mock_server(settings_from_args(args), port)
+        base_url = f"http://127.0.0.1:{port}"
+    base_url = base_url.rstrip("/")
+    print(f"Load testing {', '.join(scenarios)} against {base_url}")
+
+    # Read when the client modules are imported, so set before the imports below
+    os.environ["DEMOGRAPHICS_API_URL"] = f"{base_url}/fastapi"
+    os.environ["TRAFFIC_API_URL"] = base_url
+    os.environ["FETCH_DATASET_API_URL"] = f"{base_url}/fastapi"
+
+    from step2_async_engine import enricher_concurrency
+    from step2_enrichers import DemographicsEnricher, TrafficEnricher
+    from step2_add_demographics import DEMOGRAPHICS_TOKENS
+    from step2_traffic_analysis_api import TRAFFIC_TOKENS
+    from service_guard import service_guard
+
+    locations = random_locations(args.locations)
+    try:
+        if "demographics" in scenarios:
+            concurrency = args.demographics_concurrency or enricher_concurrency("demographics")
+            stats, elapsed = asyncio.run(run_enricher_scenario(DemographicsEnricher(), locations, concurrency))
+            stats.report(elapsed, {"guard": service_guard("demographics").stats, "logins": DEMOGRAPHICS_TOKENS.logins})
+        if "traffic" in scenarios:
+            concurrency = args.traffic_concurrency or enricher_concurrency("traffic")
+            stats, elapsed = asyncio.run(run_enricher_scenario(TrafficEnricher(), locations, concurrency))
+            stats.report(elapsed, {"guard": service_guard("traffic").stats, "logins": TRAFFIC_TOKENS.logins})
+        if "dataset" in scenarios:
+            queries = [("Jeddah", f"load_test_category_{i}") for i in range(args.queries)]
+            stats, elapsed, auth_tokens = asyncio.run(run_dataset_scenario(queries, args.dataset_concurrency))
+            stats.report(elapsed, {"logins": auth_tokens.logins})
+    finally:
+        if server is not None:
+            server.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
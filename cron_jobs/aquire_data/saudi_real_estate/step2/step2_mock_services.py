@@ -0,0 +1,256 @@
+"""
+Local stand-ins for the enrichment APIs, for load tests and concurrency changes without live hosts.
+
+    python cron_jobs/aquire_data/saudi_real_estate/step2/step2_mock_services.py --port 8765 --latency 0.2 --error-rate 0.05
+
+Serves the request/response shapes the clients rely on:
+    POST /fastapi/login                          demographics and fetch_dataset login (JWT idToken)
+    POST /fastapi/fetch_population_by_viewport   demographics cells covering the requested bbox
+    POST /fastapi/fetch_dataset                  paginated Google-category places (next_page_token)
+    POST /login                                  traffic login (form data, access_token)
+    POST /process-locations                      traffic results, after `traffic_latency` seconds
+    GET  /stats                                  requests per endpoint and status
+
+Every endpoint waits `latency` seconds (± `jitter`), fails with a 503 at `error_rate` and answers
+429 with Retry-After beyond `rate_limit` requests per second. Tokens expire after `token_ttl`
+seconds, so clients also go through their 401 handling. Point the clients at it with
+DEMOGRAPHICS_API_URL, TRAFFIC_API_URL and FETCH_DATASET_API_URL (step2_load_test.py does).
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import random
+import time
+import uuid
+from collections import Counter
+from urllib.parse import parse_qs
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+# Size in degrees of the demographics cells, about a zoom level 12 cell around Riyadh
+CELL_DEGREES = 0.005
+
+
+class MockSettings:
+    """Behaviour of the stand-in servers; `traffic_latency` is the duration of one traffic batch."""
+
+    def __init__(self, latency=0.05, jitter=0.02, error_rate=0.0, rate_limit=0, token_ttl=3600,
+                 traffic_latency=2.0, dataset_pages=3, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.token_ttl = token_ttl
+        self.traffic_latency = traffic_latency
+        self.dataset_pages = dataset_pages
+        self.seed = seed
+
+
+def _jwt(ttl):
+    """Unsigned JWT whose exp claim the token manager reads."""
+
+    def encode(data):
+        return base64.urlsafe_b64encode(json.dumps(data).encode()).decode().rstrip("=")
+
+    return f"{encode({'alg': 'none'})}.{encode({'exp': time.time() + ttl})}.mock"
+
+
+def _jwt_expired(token):
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        return json.loads(base64.urlsafe_b64decode(payload))["exp"] < time.time()
+    except Exception:
+        return True
+
+
+def _unit(*parts):
+    """Deterministic value in [0, 1) for the same inputs, so reruns see the same data."""
+    digest = hashlib.blake2b(repr(parts).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big") / 2**64
+
+
+def demographics_features(bottom_lng, bottom_lat, top_lng, top_lat):
+    """The CELL_DEGREES cells overlapping a bbox, with the properties summarise_demographics reads."""
+    features = []
+    col = int(bottom_lng // CELL_DEGREES)
+    while col * CELL_DEGREES <= top_lng:
+        row = int(bottom_lat // CELL_DEGREES)
+        while row * CELL_DEGREES <= top_lat:
+            lng, lat = col * CELL_DEGREES, row * CELL_DEGREES
+            features.append({
+                "type": "Feature",
+                "geometry": {
+                    "type": "Polygon",
+                    "coordinates": [[
+                        [lng, lat], [lng + CELL_DEGREES, lat], [lng + CELL_DEGREES, lat + CELL_DEGREES],
+                        [lng, lat + CELL_DEGREES], [lng, lat],
+                    ]],
+                },
+                "properties": {
+                    "Population_Count": int(_unit("population", col, row) * 800),
+                    "Population_Density_KM2": round(_unit("density", col, row) * 12000, 2),
+                    "Median_Age_Total": round(20 + _unit("age", col, row) * 15, 1),
+                    "income": round(5000 + _unit("income", col, row) * 25000, 2),
+                },
+            })
+            row += 1
+        col += 1
+    return features
+
+
+def traffic_result(location):
+    unit = _unit("traffic", round(location.get("lat", 0), 5), round(location.get("lng", 0), 5),
+                 location.get("storefront_direction"), location.get("day"), location.get("time"))
+    name = f"{location.get('lat')}_{location.get('lng')}.png"
+    return {
+        "score": round(unit * 100, 2),
+        "storefront_score": round(unit * 80, 2),
+        "area_score": round(unit * 60, 2),
+        "screenshot_url": f"http://mock/static/screenshots/{name}",
+    }
+
+
+def dataset_page(city_name, boolean_query, page, pages):
+    features = [
+        {
+            "type": "Feature",
+            "id": f"{city_name}-{boolean_query}-{page}-{i}",
+            "geometry": {"type": "Point", "coordinates": [39.1 + _unit(page, i, "lng"), 21.5 + _unit(page, i, "lat")]},
+            "properties": {"name": f"{boolean_query} {page}-{i}", "rating": round(1 + _unit(page, i) * 4, 1)},
+        }
+        for i in range(20)
+    ]
+    next_page_token = f"{boolean_query}|{page + 1}" if page + 1 < pages else ""
+    return {"message": "Request received", "request_id": str(uuid.uuid4()),
+            "data": {"type": "FeatureCollection", "features": features, "next_page_token": next_page_token}}
+
+
+def create_app(settings=None):
+    """FastAPI app of every stand-in endpoint behaving as `settings` says."""
+    settings = settings or MockSettings()
+    app = FastAPI(title="Enrichment API stand-ins")
+    rng = random.Random(settings.seed)
+    stats = Counter()
+    windows = {}
+
+    def reject(endpoint):
+        """The error response this request gets from rate limiting or injected failures, if any."""
+        if settings.rate_limit:
+            second = int(time.monotonic())
+            window_second, count = windows.get(endpoint, (second, 0))
+            count = count + 1 if window_second == second else 1
+            windows[endpoint] = (second, count)
+            if count > settings.rate_limit:
+                return JSONResponse({"detail": "Too many requests"}, status_code=429, headers={"Retry-After": "1"})
+        if rng.random() < settings.error_rate:
+            return JSONResponse({"detail": "Injected failure"}, status_code=503)
+        return None
+
+    def unauthorized(request):
+        token = request.headers.get("Authorization", "").removeprefix("Bearer ")
+        if not token or _jwt_expired(token):
+            return JSONResponse({"detail": "Invalid or expired token"}, status_code=401)
+        return None
+
+    async def delay(latency):
+        await asyncio.sleep(max(latency + rng.uniform(-settings.jitter, settings.jitter), 0))
+
+    @app.middleware("http")
+    async def count_requests(request, call_next):
+        response = await call_next(request)
+        if request.url.path != "/stats":
+            stats[f"{request.method} {request.url.path} {response.status_code}"] += 1
+        return response
+
+    @app.get("/stats")
+    async def get_stats():
+        return dict(stats)
+
+    @app.post("/fastapi/login")
+    async def fastapi_login(request: Request):
+        await delay(settings.latency)
+        body = (await request.json()).get("request_body", {})
+        return {"message": "Login successful", "request_id": str(uuid.uuid4()),
+                "data": {"localId": f"mock-{body.get('email', 'user')}", "idToken": _jwt(settings.token_ttl)}}
+
+    @app.post("/fastapi/fetch_population_by_viewport")
+    async def fetch_population_by_viewport(request: Request):
+        error = reject("population") or unauthorized(request)
+        if error:
+            return error
+        await delay(settings.latency)
+        body = (await request.json()).get("request_body", {})
+        features = demographics_features(body["bottom_lng"], body["bottom_lat"], body["top_lng"], body["top_lat"])
+        return {"message": "Request received", "request_id": str(uuid.uuid4()),
+                "data": {"type": "FeatureCollection", "features": features}}
+
+    @app.post("/fastapi/fetch_dataset")
+    async def fetch_dataset(request: Request):
+        error = reject("dataset") or unauthorized(request)
+        if error:
+            return error
+        await delay(settings.latency)
+        body = (await request.json()).get("request_body", {})
+        page_token = body.get("page_token") or ""
+        page = int(page_token.rsplit("|", 1)[1]) if page_token else 0
+        return dataset_page(body.get("city_name"), body.get("boolean_query"), page, settings.dataset_pages)
+
+    @app.post("/login")
+    async def traffic_login(request: Request):
+        await delay(settings.latency)
+        form = parse_qs((await request.body()).decode())
+        if not form.get("username"):
+            return JSONResponse({"detail": "Missing username"}, status_code=422)
+        return {"access_token": _jwt(settings.token_ttl), "token_type": "bearer"}
+
+    @app.post("/process-locations")
+    async def process_locations(request: Request):
+        error = reject("traffic") or unauthorized(request)
+        if error:
+            return error
+        locations = (await request.json()).get("locations", [])
+        await delay(settings.traffic_latency)
+        return {"request_id": str(uuid.uuid4()), "result": [traffic_result(loc) for loc in locations]}
+
+    return app
+
+
+def add_settings_arguments(parser):
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds every request takes")
+    parser.add_argument("--jitter", type=float, default=0.02, help="Random ± seconds added to the latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests failing with a 503")
+    parser.add_argument("--rate-limit", type=int, default=0, help="Requests per second per endpoint before 429s (0: none)")
+    parser.add_argument("--token-ttl", type=float, default=3600, help="Seconds before issued tokens expire")
+    parser.add_argument("--traffic-latency", type=float, default=2.0, help="Seconds one traffic batch takes")
+    parser.add_argument("--dataset-pages", type=int, default=3, help="Pages of places per fetch_dataset query")
+
+
+def settings_from_args(args):
+    return MockSettings(
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        rate_limit=args.rate_limit,
+        token_ttl=args.token_ttl,
+        traffic_latency=args.traffic_latency,
+        dataset_pages=args.dataset_pages,
+    )
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    add_settings_arguments(parser)
+    args = parser.parse_args()
+    uvicorn.run(create_app(settings_from_args(args)), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
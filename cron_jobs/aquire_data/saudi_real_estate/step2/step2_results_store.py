@@ -0,0 +1,125 @@
+import logging
+import os
+import sqlite3
+
+import pandas as pd
+
+from step2_coord_keys import COORD_PRECISION, coord_keys
+from step2_schema import read_real_estate_csv
+from step2_stage_cache import file_digest
+
+# Kept under ignore/ so step3 does not upload enrichment state to the bucket
+RESULTS_DB_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "ignore", "enrichment_results.sqlite")
+
+
+def _plain(value):
+    """SQLite only stores Python scalars: unwrap numpy scalars and drop nested structures."""
+    if isinstance(value, (dict, list)):
+        return None
+    if hasattr(value, "item"):
+        return value.item()
+    return value
+
+
+class ResultsStore:
+    """
+    Enrichment results of one enricher, one row per quantised coordinate key, in an SQLite table.
+
+    Each unique key is enriched once and the result fans out to every listing at that key
+    when materialise_combined writes the enriched CSV, once at the end, by joining the input with the table.
+    Results are tied to the content of the input CSV, the key precision and `variant` (the request
+    parameters besides the location, e.g. the traffic scenario): when any of them changes the table
+    is cleared, otherwise an interrupted run resumes with the keys still missing.
+    """
+
+    def __init__(self, enricher, columns, input_csv_path, path=RESULTS_DB_PATH, precision=COORD_PRECISION,
+                 variant=""):
+        self.table = f"results_{enricher}"
+        self.columns = list(dict.fromkeys(columns))
+        self.input_csv_path = input_csv_path
+        self.precision = precision
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS inputs (enricher TEXT PRIMARY KEY, input_digest TEXT)")
+        input_digest = f"{file_digest(input_csv_path)}:{precision}"
+        self._prepare_table(f"{input_digest}:{variant}" if variant else input_digest)
+
+    def _prepare_table(self, input_digest):
+        row = self.conn.execute("SELECT input_digest FROM inputs WHERE enricher = ?", (self.table,)).fetchone()
+        stored_columns = [info[1] for info in self.conn.execute(f'PRAGMA table_info("{self.table}")')]
+        if row is None or row[0] != input_digest or stored_columns[1:] != self.columns:
+            logging.info(f"Starting a new {self.table} table for {os.path.basename(self.input_csv_path)}")
+            self.conn.execute(f'DROP TABLE IF EXISTS "{self.table}"')
+        column_defs = ", ".join(f'"{column}"' for column in self.columns)
+        self.conn.execute(
+            f'CREATE TABLE IF NOT EXISTS "{self.table}" (coord_key INTEGER PRIMARY KEY, {column_defs})'
+        )
+        self.conn.execute(
+            "INSERT OR REPLACE INTO inputs (enricher, input_digest) VALUES (?, ?)", (self.table, input_digest)
+        )
+        self.conn.commit()
+
+    def _with_keys(self, df):
+        df["coord_key"] = coord_keys(df["latitude"], df["longitude"], self.precision)
+        missing = df["coord_key"] < 0
+        if missing.any():
+            logging.warning(f"{int(missing.sum())} listings without coordinates are not enriched")
+        return df[~missing]
+
+    def unique_locations(self):
+        """One {lat, lng, key} location per coordinate key of the input, in input order."""
+        df = self._with_keys(read_real_estate_csv(self.input_csv_path, columns=["latitude", "longitude"]))
+        unique = df.drop_duplicates("coord_key")
+        logging.info(f"{len(df)} listings share {len(unique)} unique coordinate keys")
+        return [
+            {"lat": float(lat), "lng": float(lng), "key": int(key)}
+            for lat, lng, key in zip(unique["latitude"], unique["longitude"], unique["coord_key"])
+        ]
+
+    def pending_locations(self, locations=None):
+        """
+        The locations that have no stored result yet, in input order.
+        `locations` (from unique_locations) lets several stores share one scan of the input.
+        """
+        if locations is None:
+            locations = self.unique_locations()
+        done = set(pd.read_sql_query(f'SELECT coord_key FROM "{self.table}"', self.conn)["coord_key"].tolist())
+        return [loc for loc in locations if loc["key"] not in done]
+
+    def save(self, results):
+        """Upsert {coord_key: {column: value}} in one transaction."""
+        rows = [
+            (key, *(_plain(result.get(column)) for column in self.columns))
+            for key, result in results.items()
+        ]
+        placeholders = ", ".join("?" for _ in range(len(self.columns) + 1))
+        self.conn.executemany(f'INSERT OR REPLACE INTO "{self.table}" VALUES ({placeholders})', rows)
+        self.conn.commit()
+
+    def results(self):
+        """Every stored result as a DataFrame with a coord_key column."""
+        return pd.read_sql_query(f'SELECT * FROM "{self.table}"', self.conn)
+
+    def close(self):
+        self.conn.close()
+
+
+def materialise_combined(stores, output_path, input_columns):
+    """
+    Write one enriched CSV from several stores over the same input and precision.
+    `stores` is a list of (store, renames) where renames maps a store column to its output name.
+    """
+    first = stores[0][0]
+    df = read_real_estate_csv(first.input_csv_path, columns=input_columns)[input_columns]
+    df["coord_key"] = coord_keys(df["latitude"], df["longitude"], first.precision)
+    output_columns = list(input_columns)
+    for store, renames in stores:
+        results = store.results().rename(columns=renames)
+        df = df.merge(results, on="coord_key", how="left")
+        output_columns += [renames.get(column, column) for column in store.columns]
+    temp_path = f"{output_path}.tmp"
+    df[output_columns].to_csv(temp_path, index=False)
+    os.replace(temp_path, output_path)
+    return len(df)
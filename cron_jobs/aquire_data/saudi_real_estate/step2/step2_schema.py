@@ -0,0 +1,42 @@
+import pandas as pd
+
+# Dtypes of the real-estate frames. Low-cardinality strings are categorical and IDs are nullable
+# integers; both write back to CSV exactly as before. Coordinates stay float64: they are written back
+# into the enriched outputs and quantised into integer coord_keys (step2_coord_keys), which float32
+# rounding would move to a neighbouring key.
+REAL_ESTATE_DTYPES = {
+    "listing_id": "string",
+    "latitude": "float64",
+    "longitude": "float64",
+    "category": "category",
+    "category_id": "Int16",
+    "city": "category",
+    "city_id": "Int32",
+    "price_description": "category",
+    "direction_id": "Int16",
+}
+# Part of the stage keys of the files written with this schema: bump it when the dtypes change so
+# outputs cached under the old dtypes are rebuilt
+SCHEMA_VERSION = 2
+
+
+def dtypes_for(columns=None):
+    """Schema dtypes restricted to `columns` (all known columns when None)."""
+    if columns is None:
+        return dict(REAL_ESTATE_DTYPES)
+    return {column: REAL_ESTATE_DTYPES[column] for column in columns if column in REAL_ESTATE_DTYPES}
+
+
+def read_real_estate_csv(path, columns=None, **kwargs):
+    """
+    pd.read_csv with the real-estate schema applied, reading only `columns` (every column when None).
+    Each stage passes the columns it uses so blobs such as 'data' are never loaded needlessly.
+    Passes `chunksize` and other kwargs through.
+    """
+    return pd.read_csv(path, usecols=columns, dtype=dtypes_for(columns), **kwargs)
+
+
+def apply_schema(df):
+    """Cast the known columns of an already loaded frame (e.g. from Parquet) to the schema."""
+    dtypes = {column: dtype for column, dtype in REAL_ESTATE_DTYPES.items() if column in df.columns}
+    return df.astype(dtypes)
@@ -1,16 +1,12 @@
 import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 from datetime import datetime
-import json
-
-def extract_direction_id(row):
-    if isinstance(row, str):
-        try:
-            data_dict = json.loads(row)
-            return data_dict.get('direction_id', None)
-        except Exception:
-            return None
-    return None
+from step2_data_extractor import DATA_EXTRACT_FIELDS, DATA_EXTRACT_WORKERS, extract_data_columns
+from step2_extract_listing_id import extract_listing_id
+from step2_schema import SCHEMA_VERSION, apply_schema, read_real_estate_csv
+from step2_stage_cache import is_fresh, record, stage_key
 
 category_mapping_en = {
     1: "apartment_for_rent",
@@ -45,12 +41,37 @@ rent_period_mapping = {
     3: "For Rent (Yearly)"
 }
 
-def process_raw_real_estate_data():
-    print("Processing raw data...")
-    file_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'ignore', 'raw_saudi_real_estate.csv')
-    print(f"Reading data from {file_path}...")
-    df = pd.read_csv(file_path)
-    
+# Must match the format step1 was run with: csv, parquet or both (parquet is read when available)
+RAW_FEED_FORMAT = os.getenv('RAW_FEED_FORMAT', 'csv')
+RAW_FEED_BASE = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'ignore', 'raw_saudi_real_estate')
+
+
+def raw_feed_path():
+    """The raw feed file step2 reads: the Parquet feed when step1 wrote one, else the CSV feed."""
+    parquet_path = f"{RAW_FEED_BASE}.parquet"
+    if RAW_FEED_FORMAT != 'csv' and os.path.exists(parquet_path):
+        return parquet_path
+    return f"{RAW_FEED_BASE}.csv"
+
+
+def iter_raw_real_estate(columns=None, chunk_size=5000):
+    """
+    Stream the raw crawl feed in DataFrame chunks of `chunk_size` rows, preferring the Parquet feed
+    when step1 wrote one. Only `columns` are read from Parquet, so callers that do not need 'data'
+    never decode it.
+    """
+    path = raw_feed_path()
+    print(f"Reading data from {path}...")
+    if path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size, columns=columns):
+            yield apply_schema(batch.to_pandas())
+        return
+    yield from read_real_estate_csv(path, columns=columns, chunksize=chunk_size)
+
+
+def transform_chunk(df):
+    """Derive dates, English category, direction_id, price_description and listing_id for one chunk."""
     if 'rent_period' not in df.columns or 'category_id' not in df.columns:
         raise ValueError("CSV must contain 'rent_period' and 'category_id' columns")
     
@@ -71,8 +92,9 @@ def process_raw_real_estate_data():
     df['category'] = df['category_id'].fillna(-1).astype(int).map(category_mapping_en).fillna('others')
     df['rent_period'] = pd.to_numeric(df['rent_period'], errors='coerce')
 
-    # from 'data' column extract 'direction_id' if exists and make it a column, using pandas apply and top-level function
-    df['direction_id'] = df['data'].apply(extract_direction_id)
+    # Parse each 'data' blob once and add the configured fields (DATA_EXTRACT_FIELDS, direction_id by default)
+    for column, values in extract_data_columns(df['data']).items():
+        df[column] = values
 
     # Set price_description based on category first
     for_sale_mask = df['category'].str.contains('for_sale', case=False, na=False)
@@ -86,10 +108,81 @@ def process_raw_real_estate_data():
     df.loc[~for_sale_mask & ~for_rent_mask, 'price_description'] = df.loc[~for_sale_mask & ~for_rent_mask, 'rent_period'].fillna(-1).astype(int).map(rent_period_mapping).fillna('')
 
     df = df.drop(columns=['category_ar'])
+    df['listing_id'] = df['url'].apply(extract_listing_id)
+    return df
 
+
+def transformed_chunks(chunks, workers=DATA_EXTRACT_WORKERS):
+    """
+    Run transform_chunk over `chunks` on `workers` processes, yielding results in input order.
+    At most two chunks per worker are in flight, so memory stays bounded by chunk size.
+    """
+    if workers <= 1:
+        for chunk in chunks:
+            yield transform_chunk(chunk)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(transform_chunk, chunk))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def process_raw_real_estate_data(saudi_category=None, saudi_columns=None, chunk_size=5000,
+                                 workers=DATA_EXTRACT_WORKERS):
+    """
+    Transform the raw feed into saudi_real_estate.csv in a single chunked pass.
+    When `saudi_category` is given, the category-filtered <base>_saudi.csv (restricted to
+    `saudi_columns`) is written in the same pass, so memory stays bounded by `chunk_size`.
+    Both files are written to temp paths and swapped in at the end. `workers` processes transform
+    chunks in parallel (1 transforms them in this process).
+    Skipped when the raw feed and parameters are unchanged since the outputs were built.
+    """
     output_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'saudi_real_estate.csv')
-    df.to_csv(output_path, index=False, mode='w')
+    saudi_csv_path = f"{output_path.rsplit('.csv', 1)[0]}_saudi.csv"
+    outputs = [output_path] + ([saudi_csv_path] if saudi_category else [])
+
+    key = stage_key([raw_feed_path()], {
+        'saudi_category': saudi_category,
+        'saudi_columns': saudi_columns,
+        'data_fields': DATA_EXTRACT_FIELDS,
+        'schema_version': SCHEMA_VERSION,
+    })
+    if is_fresh('transform', key, outputs):
+        print(f"Raw data unchanged, reusing {output_path}")
+        return output_path
+
+    print("Processing raw data...")
+
+    rows = 0
+    saudi_rows = 0
+    first_chunk = True
+    for chunk in transformed_chunks(iter_raw_real_estate(chunk_size=chunk_size), workers=workers):
+        mode = 'w' if first_chunk else 'a'
+        chunk.to_csv(f"{output_path}.tmp", index=False, mode=mode, header=first_chunk)
+        rows += len(chunk)
+        if saudi_category:
+            saudi_chunk = chunk[chunk['category'] == saudi_category]
+            if saudi_columns:
+                # Columns a chunk lacks (e.g. no listing_created_timestamp in it) are written empty,
+                # so every appended chunk lines up with the header of the first
+                saudi_chunk = saudi_chunk.reindex(columns=saudi_columns)
+            saudi_chunk.to_csv(f"{saudi_csv_path}.tmp", index=False, mode=mode, header=first_chunk)
+            saudi_rows += len(saudi_chunk)
+        first_chunk = False
+        print(f"Processed {rows} rows")
+
+    if first_chunk:
+        raise ValueError("Raw real estate feed is empty")
+    for path in outputs:
+        os.replace(f"{path}.tmp", path)
+    record('transform', key, outputs)
     print(f"CSV file saved to {output_path}")
+    if saudi_category:
+        print(f"Saudi Arabia records ({saudi_rows}) saved to: {saudi_csv_path}")
 
     return output_path
 
@@ -0,0 +1,102 @@
+import hashlib
+import json
+import os
+
+# Kept under ignore/ so step3 does not upload the manifests to the bucket
+STAGE_CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "ignore", "stage_cache")
+
+
+# Digests already known, by absolute path: {"size", "mtime_ns", "inode", "sha256"}
+DIGESTS_PATH = os.path.join(STAGE_CACHE_DIR, "digests.json")
+_digests = None
+
+
+def _load_digests():
+    global _digests
+    if _digests is None:
+        try:
+            with open(DIGESTS_PATH, "r", encoding="utf-8") as f:
+                _digests = json.load(f)
+        except (OSError, ValueError):
+            _digests = {}
+    return _digests
+
+
+def _save_digests():
+    os.makedirs(STAGE_CACHE_DIR, exist_ok=True)
+    temp_path = f"{DIGESTS_PATH}.{os.getpid()}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(_digests, f, indent=2)
+    os.replace(temp_path, DIGESTS_PATH)
+
+
+def _sha256(path, block_size):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def file_digest(path, block_size=1024 * 1024):
+    """
+    sha256 of a file's content. The file is only read when its (size, mtime_ns, inode) differ from
+    when it was last hashed; otherwise the digest memoised in digests.json is returned, so each file
+    is hashed once per change rather than on every stage check.
+    """
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    signature = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "inode": stat.st_ino}
+    digests = _load_digests()
+    known = digests.get(path)
+    if known and all(known.get(field) == value for field, value in signature.items()):
+        return known["sha256"]
+    digests[path] = {**signature, "sha256": _sha256(path, block_size)}
+    _save_digests()
+    return digests[path]["sha256"]
+
+
+def stage_key(inputs, params):
+    """Hash of the stage's input file contents and its parameters (JSON-serialisable)."""
+    digest = hashlib.sha256()
+    for path in inputs:
+        digest.update(os.path.basename(path).encode("utf-8"))
+        digest.update(file_digest(path).encode("utf-8"))
+    digest.update(json.dumps(params, sort_keys=True, default=str).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _manifest_path(stage):
+    return os.path.join(STAGE_CACHE_DIR, f"{stage}.json")
+
+
+def is_fresh(stage, key, outputs):
+    """
+    True when `stage` was last built from the same inputs and parameters (`key`)
+    and its outputs are still exactly what that build wrote.
+    """
+    try:
+        with open(_manifest_path(stage), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return False
+    if manifest.get("key") != key:
+        return False
+    recorded = manifest.get("outputs", {})
+    for path in outputs:
+        if not os.path.exists(path) or recorded.get(os.path.basename(path)) != file_digest(path):
+            return False
+    return True
+
+
+def record(stage, key, outputs):
+    """Store the manifest of a freshly built stage."""
+    os.makedirs(STAGE_CACHE_DIR, exist_ok=True)
+    manifest = {
+        "key": key,
+        "outputs": {os.path.basename(path): file_digest(path) for path in outputs},
+    }
+    temp_path = f"{_manifest_path(stage)}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(temp_path, _manifest_path(stage))
@@ -3,20 +3,38 @@
 
 import logging
 import os
+import sys
 from datetime import datetime
 from typing import Any
 
 import requests
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "..", "..")))
+from service_guard import service_guard
+from token_manager import token_manager
+
 logging.basicConfig(
     level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
 )
 
 logger = logging.getLogger(__name__)
 
-API_BASE_URL = "http://157.180.121.131:8000"  # Adjust if needed
+API_BASE_URL = os.getenv("TRAFFIC_API_URL", "http://157.180.121.131:8000")  # Adjust if needed
 LOGIN_ENDPOINT = f"{API_BASE_URL}/login"
 ANALYZE_ENDPOINT = f"{API_BASE_URL}/process-locations"
+TRAFFIC_REQUEST_TIMEOUT_SECONDS = float(os.getenv("TRAFFIC_REQUEST_TIMEOUT_SECONDS", 200))
+# Scenario analysed for every location, part of the traffic cache key.
+# TRAFFIC_ZOOM is only sent when set, the service defaults to 18z.
+TRAFFIC_SCENARIO = {
+    "storefront_direction": os.getenv("TRAFFIC_STOREFRONT_DIRECTION", "north"),
+    "day": os.getenv("TRAFFIC_DAY", "Monday"),
+    "time": os.getenv("TRAFFIC_TIME", "6PM"),
+}
+if os.getenv("TRAFFIC_ZOOM"):
+    TRAFFIC_SCENARIO["zoom"] = int(os.getenv("TRAFFIC_ZOOM"))
+# Jobs take minutes and save their rows (save_to_db), so a timed out job may still finish and a retry
+# would run it again: never retry, only stop calling after a few failures in a row
+TRAFFIC_GUARD = service_guard("traffic", max_retries=0, failure_threshold=3, reset_timeout=120)
 
 
 # Login to get token (you might want to move this outside the function)
@@ -40,37 +58,99 @@ def get_auth_token() -> str:
         raise
 
 
+# Refreshed before the token expires or after a 401 instead of on a fixed timer
+TRAFFIC_TOKENS = token_manager("traffic", get_auth_token)
+
+
+def traffic_scenario_key(scenario=TRAFFIC_SCENARIO) -> str:
+    """Direction, day, time and zoom of a scenario, e.g. "north/Monday/6PM/18"."""
+    return "/".join(
+        str(scenario.get(field, "default")) for field in ("storefront_direction", "day", "time", "zoom")
+    )
+
+
+def traffic_payload(locations_batch: list[dict[str, Any]]) -> dict[str, Any]:
+    return {
+        "save_to_static": True,
+        "save_to_db": True,
+        "locations": [
+            {
+                "lat": loc["lat"],
+                "lng": loc["lng"],
+                **TRAFFIC_SCENARIO,
+            }
+            for loc in locations_batch
+        ],
+    }
+
+
 def submit_traffic_job(
     locations_batch: list[dict[str, Any]], token: str
 ) -> dict[str, Any]:
     """Submit a batch of locations for traffic analysis"""
     try:
         headers = {"Authorization": f"Bearer {token}"}
-        payload = {
-            "save_to_static": True,
-            "save_to_db": True,
-            "locations": [
-                {
-                    "lat": loc["lat"],
-                    "lng": loc["lng"],
-                    "storefront_direction": "north",  # Default direction
-                    "day": "Monday",  # Default day
-                    "time": "6PM",  # Default time (6:00 PM)
-                    # "zoom": 18, # Default zoom (18z)
-                }
-                for loc in locations_batch
-            ],
-        }
-        response = requests.post(
-            ANALYZE_ENDPOINT, json=payload, headers=headers, timeout=200
-        )
-        response.raise_for_status()
-        return response.json()
+        payload = traffic_payload(locations_batch)
+
+        def post():
+            response = requests.post(
+                ANALYZE_ENDPOINT, json=payload, headers=headers, timeout=TRAFFIC_REQUEST_TIMEOUT_SECONDS
+            )
+            response.raise_for_status()
+            return response
+
+        return TRAFFIC_GUARD.call(post).json()
     except Exception as e:
         logger.error(f"Failed to submit traffic processing: {e}")
         raise
 
 
+async def submit_traffic_job_async(
+    client, locations_batch: list[dict[str, Any]], token: str
+) -> dict[str, Any]:
+    """
+    submit_traffic_job over a shared httpx.AsyncClient. The API answers once the batch is
+    analysed, so concurrency comes from the sliding window keeping several of these in flight.
+    """
+    headers = {"Authorization": f"Bearer {token}"}
+    payload = traffic_payload(locations_batch)
+
+    async def post():
+        response = await client.post(
+            ANALYZE_ENDPOINT, json=payload, headers=headers, timeout=TRAFFIC_REQUEST_TIMEOUT_SECONDS
+        )
+        response.raise_for_status()
+        return response
+
+    return (await TRAFFIC_GUARD.call_async(post)).json()
+
+
+def traffic_results(locations_batch: list[dict[str, Any]], resp: dict[str, Any]) -> dict[str, Any]:
+    """Results of a traffic response as {coord_key: columns}, in the order of the batch."""
+    batch_results = {}
+    results_data = resp.get("result") or []
+
+    for loc, result in zip(locations_batch, results_data):
+        coord_key = loc["key"]
+        traffic_score = result.get("score", 0)
+        traffic_storefront_score = result.get("storefront_score", 0)
+        traffic_area_score = result.get("area_score", 0)
+        screenshot_url = result.get("screenshot_url", "")
+        screenshot_filename = (
+            os.path.basename(screenshot_url) if screenshot_url else ""
+        )
+
+        batch_results[coord_key] = {
+            "traffic_score": traffic_score,
+            "traffic_storefront_score": traffic_storefront_score,
+            "traffic_area_score": traffic_area_score,
+            "traffic_screenshot_filename": screenshot_filename,
+            "traffic_analysis_date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        }
+
+    return batch_results
+
+
 def process_traffic_batch(
     locations_batch: list[dict[str, Any]], token: str
 ) -> dict[str, Any]:
@@ -81,44 +161,26 @@ def process_traffic_batch(
         logger.info(
             f"Submitted process request {resp.get('request_id', '')} for {len(locations_batch)} locations"
         )
+        return traffic_results(locations_batch, resp)
 
-        # Extract and format results
-        batch_results = {}
-        results_data = resp.get("result", [])
-
-        for loc, result in zip(locations_batch, results_data):
-            lat, lng = loc["lat"], loc["lng"]
-            coord_key = f"{lat}_{lng}"
-            traffic_score = result.get("score", 0)
-            traffic_storefront_score = result.get("storefront_score", 0)
-            traffic_area_score = result.get("area_score", 0)
-            screenshot_url = result.get("screenshot_url", "")
-            screenshot_filename = (
-                os.path.basename(screenshot_url) if screenshot_url else ""
-            )
+    except Exception as e:
+        logger.error(f"Failed to process traffic batch: {e}")
+        # The caller records fallback results for the batch and keeps them out of the enrichment cache
+        raise
 
-            batch_results[coord_key] = {
-                "traffic_score": traffic_score,
-                "traffic_storefront_score": traffic_storefront_score,
-                "traffic_area_score": traffic_area_score,
-                "traffic_screenshot_filename": screenshot_filename,
-                "traffic_analysis_date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            }
 
-        return batch_results
+async def process_traffic_batch_async(
+    client, locations_batch: list[dict[str, Any]], token: str
+) -> dict[str, Any]:
+    """process_traffic_batch over a shared httpx.AsyncClient."""
+    try:
+        resp = await submit_traffic_job_async(client, locations_batch, token)
+        logger.info(
+            f"Finished process request {resp.get('request_id', '')} "
+            f"for {len(locations_batch)} locations"
+        )
+        return traffic_results(locations_batch, resp)
 
     except Exception as e:
         logger.error(f"Failed to process traffic batch: {e}")
-        # Return empty results for all locations in batch
-        batch_results = {}
-        for loc in locations_batch:
-            lat, lng = loc["lat"], loc["lng"]
-            coord_key = f"{lat}_{lng}"
-            batch_results[coord_key] = {
-                "traffic_score": 0,
-                "traffic_storefront_score": 0,
-                "traffic_area_score": 0,
-                "traffic_screenshot_filename": "",
-                "traffic_analysis_date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            }
-        return batch_results
+        raise
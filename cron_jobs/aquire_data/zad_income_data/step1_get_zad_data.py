@@ -18,6 +18,9 @@ if(args.log_file):
     from logging_utils import setup_logging
     setup_logging(args.log_file)
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..")))
+from service_guard import service_guard
+
 def swap_coordinates(nested_coords):
     def recursive_swap(coords):
         if isinstance(coords[0], (float, int)) and isinstance(
@@ -40,6 +43,20 @@ geojson_features = []  # This will store the final GeoJSON features
 
 url = "https://api.map.910ths.sa/api/graphql/"
 headers = {"Content-Type": "application/json"}
+# One request per area and query: rate limit them, retry transient failures with jitter
+# and stop calling the API while it keeps failing
+ZAD_GUARD = service_guard("zad", rate=2)
+
+
+def post_graphql(payload):
+    def post():
+        response = requests.post(url, headers=headers, data=payload, timeout=60)
+        response.raise_for_status()
+        return response
+
+    return ZAD_GUARD.call(post)
+
+
 query_all_areas_income = """
 query getIncomeQuery($areas: [String]!) {
   all: averageIncome(filters: {male: null, saudi: null, parentAreas: $areas}, orders: {id: "value", direction: "desc"}) {
@@ -134,7 +151,7 @@ payload = json.dumps(
     }
 )
 
-response = requests.post(url, headers=headers, data=payload)
+response = post_graphql(payload)
 areas = response.json()["data"]["all"]["facts"]
 overall_income = response.json()["data"]["all"]["facts"]
 males_income = response.json()["data"]["male"]["facts"]
@@ -203,7 +220,7 @@ for idx, data in enumerate(areas):
         }
     )
 
-    response_data = requests.post(url, headers=headers, data=payload_data)
+    response_data = post_graphql(payload_data)
     json_data = response_data.json()["data"]
     # This checks if geometry exists or not
     if(json_data["area"]["simplifiedShape"]):
@@ -271,7 +288,7 @@ for idx, data in enumerate(areas):
           }
       )
 
-      demo_response = requests.post(url, headers=headers, data=payload_demo)
+      demo_response = post_graphql(payload_demo)
       demo_data = demo_response.json().get("data", {})
 
       def extract_value(key):
@@ -340,4 +357,6 @@ if geojson_features:
 
     with open(filename_json, "w", encoding="utf-8") as f:
         json.dump(final_geojson, f, ensure_ascii=False, indent=4)
-    logging.info(f"\n📁 Saved collected Data to Geo-json file: {filename_json}")
\ No newline at end of file
+    logging.info(f"\n📁 Saved collected Data to Geo-json file: {filename_json}")
+
+ZAD_GUARD.log_stats()
\ No newline at end of file
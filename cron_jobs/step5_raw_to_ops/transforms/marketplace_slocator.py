@@ -319,7 +319,9 @@ def create_enriched_demographic_table():
                 THEN TRUE 
                 ELSE FALSE 
             END AS is_current
-        FROM raw_schema_marketplace."saudi_real_estate_saudi_enriched_with_demographics" red
+        FROM raw_schema_marketplace."saudi_real_estate_saudi_enriched" red
+        -- Listings the demographics enricher has not covered yet have no analysis date
+        WHERE red.demographics_analysis_date IS NOT NULL
     ),
     current_only AS (
         SELECT *
@@ -436,7 +438,7 @@ def create_enriched_household_table():
             total_households,
             avg_household_size,
             median_household_size,
-            density_sum,
+            household_density_sum AS density_sum,
             household_analysis_date,
             CASE 
                 WHEN ROW_NUMBER() OVER (
@@ -446,7 +448,8 @@ def create_enriched_household_table():
                 THEN TRUE 
                 ELSE FALSE 
             END AS is_current
-        FROM raw_schema_marketplace."saudi_real_estate_saudi_enriched_with_household"
+        FROM raw_schema_marketplace."saudi_real_estate_saudi_enriched"
+        WHERE household_analysis_date IS NOT NULL
     ),
     current_records AS (
         SELECT *
@@ -534,7 +537,7 @@ def create_enriched_housing_table():
             work_camps,
             commercial_housings,
             other_housings,
-            density_sum,
+            housing_density_sum AS density_sum,
             housing_analysis_date,
             CASE 
                 WHEN ROW_NUMBER() OVER (
@@ -544,7 +547,8 @@ def create_enriched_housing_table():
                 THEN TRUE 
                 ELSE FALSE 
             END AS is_current
-        FROM raw_schema_marketplace."saudi_real_estate_saudi_enriched_with_housing"
+        FROM raw_schema_marketplace."saudi_real_estate_saudi_enriched"
+        WHERE housing_analysis_date IS NOT NULL
     ),
     current_records AS (
         SELECT *
@@ -674,7 +678,8 @@ def create_enriched_traffic_table():
             THEN TRUE 
             ELSE FALSE 
         END AS is_current
-    FROM raw_schema_marketplace."saudi_real_estate_saudi_enriched_with_traffic" te
+    FROM raw_schema_marketplace."saudi_real_estate_saudi_enriched" te
+    WHERE te.traffic_analysis_date IS NOT NULL
     ),
     current_only AS (
         SELECT *
@@ -0,0 +1,217 @@
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+
+_guards = {}
+_guards_lock = threading.Lock()
+
+# Exceptions of these client libraries without an HTTP status are transport errors worth retrying
+_TRANSPORT_MODULES = ("requests", "urllib3", "httpx", "httpcore", "aiohttp")
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a service whose circuit breaker is open."""
+
+
+def error_status(error):
+    response = getattr(error, "response", None)
+    return getattr(response, "status_code", None) or getattr(error, "status", None)
+
+
+def is_retryable(error):
+    """429s, 5xxs, timeouts and connection errors are worth another attempt; other 4xxs and bugs are not."""
+    if isinstance(error, CircuitOpenError):
+        return False
+    status = error_status(error)
+    if isinstance(status, int):
+        return status == 429 or status >= 500
+    return (
+        isinstance(error, (OSError, TimeoutError, asyncio.TimeoutError))
+        or type(error).__module__.split(".")[0] in _TRANSPORT_MODULES
+    )
+
+
+def _retry_after(error):
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """Allows `rate` calls per second on average with bursts of up to `burst`; rate 0 disables it."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = max(burst or rate, 1)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Take a token and return how long to wait before using it (callers queue in order)."""
+        if not self.rate:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures and rejects calls for `reset_timeout`
+    seconds, then lets a single trial call through: success closes it, failure opens it again.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.reset_timeout or self.trial_running:
+                return False
+            self.trial_running = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self):
+        """Count a failure; True when this failure tripped the breaker."""
+        with self._lock:
+            self.failures += 1
+            reopened = self.trial_running
+            self.trial_running = False
+            if reopened or (self.opened_at is None and self.failures >= self.failure_threshold):
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+
+class ServiceGuard:
+    """
+    Rate limit, circuit breaker and jittered retry in front of one remote service.
+
+    Every attempt waits for a token bucket slot. Retryable failures back off with full jitter
+    (honouring Retry-After) up to `max_retries` times, and enough consecutive failures open
+    the breaker so callers fail fast instead of piling retries onto a degraded service.
+    Thread-safe; use call() from threads and call_async() from coroutines.
+    """
+
+    def __init__(self, name, rate=0, burst=None, max_retries=3, base_delay=1.0, max_delay=30.0,
+                 failure_threshold=5, reset_timeout=30):
+        self.name = name
+        self.bucket = TokenBucket(rate, burst)
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.stats = {"calls": 0, "throttled": 0, "retried": 0, "tripped": 0, "rejected": 0, "failed": 0}
+        self._stats_lock = threading.Lock()
+
+    def _count(self, stat):
+        with self._stats_lock:
+            self.stats[stat] += 1
+
+    def _before_attempt(self):
+        """Raise if the breaker is open, else the seconds to wait for a rate limit slot."""
+        if not self.breaker.allow():
+            self._count("rejected")
+            raise CircuitOpenError(f"{self.name} circuit is open after repeated failures")
+        self._count("calls")
+        wait = self.bucket.reserve()
+        if wait > 0:
+            self._count("throttled")
+        return wait
+
+    def _after_failure(self, error, attempt):
+        """Record a failed attempt; the backoff before the next one, or None to give up."""
+        if not is_retryable(error):
+            # The service answered, it is up: do not count this against the breaker
+            self.breaker.record_success()
+            return None
+        if self.breaker.record_failure():
+            self._count("tripped")
+            logging.warning(f"{self.name} circuit opened for {self.breaker.reset_timeout}s: {error}")
+        if attempt >= self.max_retries:
+            self._count("failed")
+            return None
+        self._count("retried")
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+        return max(delay, min(_retry_after(error) or 0, self.max_delay))
+
+    def call(self, fn, *args, **kwargs):
+        attempt = 0
+        while True:
+            wait = self._before_attempt()
+            if wait > 0:
+                time.sleep(wait)
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                delay = self._after_failure(e, attempt)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+                continue
+            self.breaker.record_success()
+            return result
+
+    async def call_async(self, fn, *args, **kwargs):
+        attempt = 0
+        while True:
+            wait = self._before_attempt()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            try:
+                result = await fn(*args, **kwargs)
+            except Exception as e:
+                delay = self._after_failure(e, attempt)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            self.breaker.record_success()
+            return result
+
+    def log_stats(self):
+        logging.info(f"{self.name} requests: {self.stats}")
+
+
+def service_guard(name, rate=0, burst=None, **kwargs):
+    """
+    The process-wide ServiceGuard of service `name`, created on first use.
+    SERVICE_RATE_<NAME> (calls/s, 0 for no limit) and SERVICE_BURST_<NAME> override the defaults.
+    """
+    with _guards_lock:
+        if name not in _guards:
+            env_name = name.upper().replace("-", "_")
+            rate = float(os.getenv(f"SERVICE_RATE_{env_name}", rate))
+            burst = float(os.getenv(f"SERVICE_BURST_{env_name}", burst or rate))
+            _guards[name] = ServiceGuard(name, rate=rate, burst=burst, **kwargs)
+        return _guards[name]
+
+
+def log_service_stats():
+    """Log throttled, tripped and retried counts of every guard used by this process."""
+    for guard in list(_guards.values()):
+        guard.log_stats()
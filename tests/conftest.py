@@ -0,0 +1,10 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REAL_ESTATE_DIR = os.path.join(ROOT, "cron_jobs", "aquire_data", "saudi_real_estate")
+
+# The step scripts import their siblings by bare name, as when run from their own directory
+for path in (ROOT, REAL_ESTATE_DIR, os.path.join(REAL_ESTATE_DIR, "step2")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
@@ -0,0 +1,139 @@
+import asyncio
+
+import pytest
+
+import service_guard
+from service_guard import CircuitOpenError, ServiceGuard, TokenBucket
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+    async def async_sleep(self, seconds):
+        self.sleep(seconds)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(service_guard.time, "monotonic", clock.monotonic)
+    monkeypatch.setattr(service_guard.time, "sleep", clock.sleep)
+    monkeypatch.setattr(service_guard.asyncio, "sleep", clock.async_sleep)
+    return clock
+
+
+class Response:
+    def __init__(self, headers=None):
+        self.headers = headers or {}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, headers=None):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+        self.response = Response(headers)
+
+
+class Flaky:
+    """Raises the given errors in turn, then returns "ok"."""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return "ok"
+
+
+def test_retryable_failures_are_retried_with_backoff(clock):
+    guard = ServiceGuard("service", max_retries=3, base_delay=1.0)
+    fn = Flaky(HTTPError(503), ConnectionError("reset"))
+
+    assert guard.call(fn) == "ok"
+    assert fn.calls == 3
+    assert guard.stats["retried"] == 2
+    # Full jitter: at most base_delay * 2**attempt
+    assert len(clock.sleeps) == 2 and clock.sleeps[0] <= 1.0 and clock.sleeps[1] <= 2.0
+
+
+def test_gives_up_after_max_retries(clock):
+    guard = ServiceGuard("service", max_retries=2, failure_threshold=10)
+    fn = Flaky(*(HTTPError(500) for _ in range(5)))
+
+    with pytest.raises(HTTPError):
+        guard.call(fn)
+    assert fn.calls == 3
+    assert guard.stats["failed"] == 1
+
+
+def test_client_errors_are_not_retried_and_keep_the_breaker_closed(clock):
+    guard = ServiceGuard("service", max_retries=3, failure_threshold=1)
+    fn = Flaky(HTTPError(404))
+
+    with pytest.raises(HTTPError):
+        guard.call(fn)
+    assert fn.calls == 1
+    assert guard.breaker.opened_at is None
+
+
+def test_retry_after_is_honoured(clock):
+    guard = ServiceGuard("service", max_retries=1, base_delay=0.1)
+
+    assert guard.call(Flaky(HTTPError(429, {"Retry-After": "7"}))) == "ok"
+    assert clock.sleeps == [7.0]
+
+
+def test_breaker_opens_then_lets_one_trial_through(clock):
+    guard = ServiceGuard("service", max_retries=0, failure_threshold=3, reset_timeout=30)
+    for _ in range(3):
+        with pytest.raises(HTTPError):
+            guard.call(Flaky(HTTPError(503)))
+    assert guard.stats["tripped"] == 1
+
+    untouched = Flaky()
+    with pytest.raises(CircuitOpenError):
+        guard.call(untouched)
+    assert untouched.calls == 0
+
+    # A failed trial opens the breaker again for another reset_timeout
+    clock.now += 31
+    with pytest.raises(HTTPError):
+        guard.call(Flaky(HTTPError(503)))
+    with pytest.raises(CircuitOpenError):
+        guard.call(untouched)
+
+    clock.now += 31
+    assert guard.call(untouched) == "ok"
+    assert guard.call(untouched) == "ok"
+    assert guard.breaker.opened_at is None
+
+
+def test_call_async_retries_like_call(clock):
+    guard = ServiceGuard("service", max_retries=2)
+    fn = Flaky(HTTPError(502))
+
+    async def request():
+        return fn()
+
+    assert asyncio.run(guard.call_async(request)) == "ok"
+    assert fn.calls == 2 and guard.stats["retried"] == 1
+
+
+def test_token_bucket_spaces_calls_beyond_the_burst(clock):
+    bucket = TokenBucket(rate=2, burst=2)
+
+    assert [bucket.reserve() for _ in range(4)] == [0.0, 0.0, 0.5, 1.0]
+    clock.now += 10
+    assert bucket.reserve() == 0.0
@@ -0,0 +1,96 @@
+import pytest
+
+import step1_adaptive
+from step1_adaptive import AdaptiveCrawlController
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(step1_adaptive.time, "monotonic", clock.monotonic)
+    return clock
+
+
+@pytest.fixture
+def controller(tmp_path, clock):
+    def make(**kwargs):
+        kwargs.setdefault("window", 10)
+        return AdaptiveCrawlController(state_path=str(tmp_path / "adaptive_crawl_state.json"), **kwargs)
+
+    return make
+
+
+def run_window(controller, clock, listings_per_second, latency=1.0):
+    """Record one window of responses that took 10s and returned `listings_per_second` * 10 listings."""
+    clock.now += 10
+    for _ in range(controller.window):
+        controller.record_response(latency, 200, 1000, listings_per_second * 10 // controller.window)
+
+
+def test_throttled_responses_count_once_towards_the_window(controller, clock):
+    crawl = controller(initial_concurrency=8)
+    for _ in range(9):
+        crawl.record_response(1.0, 429, 100, 0)
+    # Nine responses do not fill a window of ten, however many of them were throttled
+    assert crawl.concurrency == 8
+
+    crawl.record_failure(1.0)
+    assert crawl.concurrency == 4
+
+
+def test_error_rate_is_errors_over_responses(controller, clock):
+    crawl = controller(window=20, initial_concurrency=8, max_error_rate=0.05)
+    crawl.record_response(1.0, 503, 100, 0)
+    for _ in range(19):
+        crawl.record_response(1.0, 200, 100, 20)
+
+    # 1 in 20 is not above 5%
+    assert crawl.concurrency == 8
+
+
+def test_concurrency_is_held_while_page_size_is_probed(controller, clock):
+    crawl = controller(initial_page_size=20, initial_concurrency=4)
+
+    run_window(crawl, clock, 100)
+    assert (crawl.page_size, crawl.concurrency) == (30, 4)
+    run_window(crawl, clock, 200)
+    assert (crawl.page_size, crawl.concurrency) == (45, 4)
+
+    # No gain: roll back the last increase, then start growing concurrency
+    run_window(crawl, clock, 200)
+    assert crawl.page_size_settled
+    assert (crawl.page_size, crawl.concurrency) == (30, 4)
+    run_window(crawl, clock, 200)
+    assert (crawl.page_size, crawl.concurrency) == (30, 5)
+
+
+def test_page_size_gains_are_measured_per_in_flight_request(controller, clock):
+    crawl = controller(initial_page_size=20, initial_concurrency=4, target_latency=5.0)
+
+    run_window(crawl, clock, 100)
+    assert crawl.page_size == 30
+    run_window(crawl, clock, 90, latency=8.0)
+    assert (crawl.page_size, crawl.concurrency) == (30, 3)
+
+    # Fewer listings/s overall, but more per request at the lower concurrency
+    run_window(crawl, clock, 90)
+    assert not crawl.page_size_settled
+    assert (crawl.page_size, crawl.concurrency) == (45, 3)
+
+
+def test_settled_values_are_where_the_next_run_starts(controller, clock):
+    crawl = controller(initial_page_size=20, initial_concurrency=4)
+    run_window(crawl, clock, 100)
+    state = crawl.save_state()
+
+    assert (state["page_size"], state["concurrency"]) == (30, 4)
+    resumed = controller(initial_page_size=20, initial_concurrency=2)
+    assert (resumed.page_size, resumed.concurrency) == (30, 4)
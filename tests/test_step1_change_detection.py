@@ -0,0 +1,143 @@
+import csv
+import json
+
+import pytest
+from scrapy.exceptions import DropItem
+
+from step1_change_detection import ChangeDetectionPipeline, listing_fingerprint
+
+
+class FakeSpider:
+    def __init__(self, run_id, full_catalogue=True, abandoned_pages=0, worker_id=None):
+        self.run_id = run_id
+        self.extraction_timestamp = 1700000000
+        self.full_catalogue = full_catalogue
+        self.abandoned_pages = abandoned_pages
+        self.worker_id = worker_id
+        self.logger = self
+
+    def covers_full_catalogue(self):
+        return self.full_catalogue
+
+    def info(self, message):
+        pass
+
+    warning = info
+
+
+class FakeStats:
+    def __init__(self, values=None):
+        self.values = values or {}
+
+    def get_stats(self):
+        return self.values
+
+
+def item(listing_id, price):
+    listing = {"id": listing_id, "price": price, "last_update": 1, "status": 1}
+    return {"url": f"https://sa.aqar.fm/{listing_id}", "data": json.dumps(listing)}
+
+
+def run(tmp_path, run_id, items, reason="finished", feed_closed=True, stats=None, **spider_kwargs):
+    """One crawl through the pipeline; returns the ids that reached the feed and the pipeline."""
+    pipeline = ChangeDetectionPipeline(
+        db_path=str(tmp_path / "fingerprints.sqlite"),
+        batch_size=2,
+        stats=stats,
+        tombstones_path=str(tmp_path / "tombstones.csv"),
+    )
+    spider = FakeSpider(run_id, **spider_kwargs)
+    pipeline.open_spider(spider)
+    emitted = []
+    for listing in items:
+        try:
+            emitted.append(json.loads(pipeline.process_item(listing, spider)["data"]).get("id"))
+        except DropItem:
+            pass
+    pipeline.close_spider(spider)
+    if feed_closed:
+        pipeline.feed_exporter_closed()
+    pipeline.spider_closed(spider, reason)
+    return emitted, pipeline
+
+
+def tombstoned_ids(tmp_path):
+    with open(tmp_path / "tombstones.csv", encoding="utf-8-sig") as f:
+        return [row["listing_id"] for row in csv.DictReader(f)]
+
+
+def test_fingerprint_tracks_price_update_and_status():
+    base = {"price": 100, "last_update": 1, "status": 1}
+    assert listing_fingerprint(base) == listing_fingerprint(dict(base, title="other"))
+    assert listing_fingerprint(base) != listing_fingerprint(dict(base, price=101))
+    assert listing_fingerprint(base) != listing_fingerprint(dict(base, status=2))
+
+
+def test_only_new_or_changed_listings_are_emitted(tmp_path):
+    emitted, _ = run(tmp_path, "run1", [item(1, 100), item(2, 200), item(3, 300)])
+    assert emitted == [1, 2, 3]
+    emitted, pipeline = run(tmp_path, "run2", [item(1, 100), item(2, 250), item(3, 300), item(4, 400)])
+    assert emitted == [2, 4]
+    assert pipeline.stats["unchanged"] == 2
+
+
+def test_listings_without_an_id_always_go_through(tmp_path):
+    def without_id(price):
+        return {"url": "https://sa.aqar.fm/no-id", "data": json.dumps({"price": price, "last_update": 1, "status": 1})}
+
+    run(tmp_path, "run1", [without_id(100), without_id(100), item(1, 100)])
+    emitted, pipeline = run(tmp_path, "run2", [without_id(100), without_id(100), item(1, 100)])
+    assert emitted == [None, None]
+    assert pipeline.stats["without_id"] == 2
+
+
+@pytest.mark.parametrize(
+    "failure",
+    [
+        {"reason": "shutdown"},
+        {"feed_closed": False},
+        {"stats": FakeStats({"feedexport/failed_count/FileFeedStorage": 1})},
+    ],
+)
+def test_failed_run_does_not_promote_fingerprints(tmp_path, failure):
+    run(tmp_path, "run1", [item(1, 100)])
+    emitted, _ = run(tmp_path, "run2", [item(1, 150), item(2, 200)], **failure)
+    assert emitted == [1, 2]
+    # The next run emits the same listings again instead of losing them
+    emitted, _ = run(tmp_path, "run3", [item(1, 150), item(2, 200)])
+    assert emitted == [1, 2]
+
+
+def test_promotion_waits_for_both_spider_and_feed_close(tmp_path):
+    pipeline = ChangeDetectionPipeline(
+        db_path=str(tmp_path / "fingerprints.sqlite"), tombstones_path=str(tmp_path / "tombstones.csv")
+    )
+    spider = FakeSpider("run1")
+    pipeline.open_spider(spider)
+    pipeline.process_item(item(1, 100), spider)
+    pipeline.close_spider(spider)
+    pipeline.spider_closed(spider, "finished")
+    assert pipeline.stats["promoted"] == 0
+    pipeline.feed_exporter_closed()
+    assert pipeline.stats["promoted"] == 1
+
+
+def test_full_crawl_writes_tombstones_for_vanished_listings(tmp_path):
+    run(tmp_path, "run1", [item(1, 100), item(2, 200)])
+    _, pipeline = run(tmp_path, "run2", [item(1, 100)])
+    assert pipeline.stats["tombstones"] == 1
+    assert tombstoned_ids(tmp_path) == ["2"]
+    # Tombstoned listings are forgotten: seen again, they are emitted as new
+    emitted, _ = run(tmp_path, "run3", [item(1, 100), item(2, 200)])
+    assert emitted == [2]
+
+
+@pytest.mark.parametrize("spider_kwargs", [{"abandoned_pages": 1}, {"full_catalogue": False}, {"worker_id": 0}])
+def test_partial_crawls_write_no_tombstones(tmp_path, spider_kwargs):
+    run(tmp_path, "run1", [item(1, 100), item(2, 200)])
+    _, pipeline = run(tmp_path, "run2", [item(1, 100)], **spider_kwargs)
+    assert pipeline.stats["tombstones"] == 0
+    assert tombstoned_ids(tmp_path) == []
+    # Listing 2 is still known, so it is not re-emitted when its page comes back
+    emitted, _ = run(tmp_path, "run3", [item(1, 100), item(2, 200)])
+    assert emitted == []
@@ -0,0 +1,55 @@
+import json
+
+from step1_fast_parse import listing_slices, parse_listings_page
+
+
+def page(listings, **json_kwargs):
+    body = {"data": {"Web": {"find": {"total": len(listings), "listings": listings, "__typename": "WebResults"}}}}
+    return json.dumps(body, **json_kwargs).encode("utf-8")
+
+
+def json_parse(body):
+    """The json.loads / json.dumps path parse_listings_page replaced."""
+    listings = json.loads(body)["data"]["Web"]["find"]["listings"]
+    return [(listing, json.dumps(listing)) for listing in listings]
+
+
+TRICKY_LISTINGS = [
+    {"id": 1, "title": "شقة للإيجار في حي الملقا", "location": {"lat": 24.8, "lng": 46.6}},
+    {"id": 2, "content": 'braces { } [ ] and "quotes" inside a string', "imgs": []},
+    {"id": 3, "content": "a backslash at the end \\", "native": {"title": None, "image": None}},
+    {"id": 4, "content": '"listings":[{"id": 99}]', "extended_details": {"nested": {"deeper": [1, {"x": "}"}]}}},
+    {"id": 5, "price": 1.5e3, "flags": [True, False, None], "empty": {}},
+]
+
+
+def test_listings_match_the_json_path():
+    for json_kwargs in ({}, {"ensure_ascii": False}, {"indent": 2}, {"separators": (",", ":")}):
+        body = page(TRICKY_LISTINGS, **json_kwargs)
+        _, parsed = parse_listings_page(body)
+
+        expected = json_parse(body)
+        assert [listing for listing, _ in parsed] == [listing for listing, _ in expected]
+        # The raw text is the listing's own JSON: it decodes to the same object
+        assert [json.loads(raw) for _, raw in parsed] == [listing for listing, _ in expected]
+
+
+def test_raw_text_is_the_original_bytes():
+    body = page(TRICKY_LISTINGS, ensure_ascii=False, separators=(",", ":"))
+    _, parsed = parse_listings_page(body)
+
+    for raw in (raw for _, raw in parsed):
+        assert raw.encode("utf-8") in body
+
+
+def test_scanning_stops_after_the_expected_count():
+    body = page(TRICKY_LISTINGS)
+
+    assert len(listing_slices(body)) == len(TRICKY_LISTINGS)
+    assert len(listing_slices(body, expected=2)) == 2
+
+
+def test_pages_without_listings():
+    assert parse_listings_page(page([]))[1] == []
+    assert parse_listings_page(b'{"data": {"Web": {"find": null}}}')[1] == []
+    assert listing_slices(b'{"errors": [{"message": "rate limited"}]}') == []
@@ -0,0 +1,56 @@
+import time
+
+import pytest
+
+from step1_frontier import Frontier, SQLiteFrontier
+
+
+@pytest.fixture
+def frontier(tmp_path):
+    frontier = SQLiteFrontier(str(tmp_path / "frontier.sqlite"), lease_seconds=0.2)
+    yield frontier
+    frontier.close()
+
+
+def test_incomplete_backend_fails_on_creation():
+    class PartialFrontier(Frontier):
+        def push(self, tasks):
+            pass
+
+    with pytest.raises(TypeError):
+        PartialFrontier()
+
+
+def test_claimed_task_is_not_handed_out_twice(frontier):
+    frontier.push([("page", {"from": 0}), ("page", {"from": 20})])
+    first = frontier.claim(0)
+    second = frontier.claim(1)
+    assert [task["payload"]["from"] for task in first + second] == [0, 20]
+    assert frontier.claim(2) == []
+
+
+def test_expired_lease_is_handed_out_again(frontier):
+    frontier.push([("page", {"from": 0})])
+    (task,) = frontier.claim(0)
+    time.sleep(0.3)
+    assert [t["id"] for t in frontier.claim(1)] == [task["id"]]
+
+
+def test_renewed_lease_is_kept(frontier):
+    frontier.push([("page", {"from": 0})])
+    frontier.claim(0)
+    time.sleep(0.15)
+    frontier.renew(0)
+    time.sleep(0.15)
+    assert frontier.claim(1) == []
+
+
+def test_release_fails_task_after_max_attempts(frontier):
+    frontier.push([("page", {"from": 0})])
+    (task,) = frontier.claim(0)
+    frontier.release(task["id"], max_attempts=2)
+    (task,) = frontier.claim(0)
+    frontier.release(task["id"], max_attempts=2)
+    assert frontier.claim(0) == []
+    assert frontier.is_drained()
+    assert frontier.stats() == {"failed": 1}
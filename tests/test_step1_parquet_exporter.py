@@ -0,0 +1,68 @@
+import json
+
+import pytest
+
+pq = pytest.importorskip("pyarrow.parquet")
+
+from step1_parquet_exporter import ParquetItemExporter, merge_parquet_shards
+
+
+def item(listing_id, **fields):
+    return {
+        "url": f"https://sa.aqar.fm/{listing_id}",
+        "price": "1500.5",
+        "latitude": 24.7,
+        "longitude": 46.6,
+        "category": "apartment-for-rent",
+        "category_id": "1",
+        "city": "الرياض",
+        "city_id": 21,
+        "rent_period": 3,
+        "listing_created_timestamp": 1700000000,
+        "extraction_timestamp": 1700000500,
+        "data": json.dumps({"id": listing_id}),
+        **fields,
+    }
+
+
+def export(path, items, row_group_size=10000):
+    with open(path, "wb") as file:
+        exporter = ParquetItemExporter(file, row_group_size=row_group_size)
+        exporter.start_exporting()
+        for entry in items:
+            exporter.export_item(entry)
+        exporter.finish_exporting()
+    return pq.read_table(path).to_pylist()
+
+
+def test_values_are_cast_to_the_column_types(tmp_path):
+    [row] = export(tmp_path / "feed.parquet", [item(1, title=None, address="")])
+
+    assert row["price"] == 1500.5 and row["category_id"] == 1 and row["city_id"] == 21
+    assert row["city"] == "الرياض"
+    assert row["title"] is None and row["address"] is None
+    assert json.loads(row["data"]) == {"id": 1}
+
+
+def test_timestamps_are_read_as_epochs_or_iso_dates(tmp_path):
+    rows = export(
+        tmp_path / "feed.parquet",
+        [
+            item(1, listing_created_timestamp="2023-11-14T22:13:20Z"),
+            item(2, listing_created_timestamp="1700000000.0"),
+            item(3, listing_created_timestamp="not a date", rent_period="monthly"),
+        ],
+    )
+
+    assert [row["listing_created_timestamp"] for row in rows] == [1700000000, 1700000000, None]
+    # Values that do not fit a column are dropped rather than failing the whole row group
+    assert rows[2]["rent_period"] is None
+
+
+def test_shards_are_merged_keeping_each_url_once(tmp_path):
+    export(tmp_path / "worker0.parquet", [item(1), item(2)], row_group_size=1)
+    export(tmp_path / "worker1.parquet", [item(2), item(3)], row_group_size=1)
+
+    merged = tmp_path / "merged.parquet"
+    assert merge_parquet_shards([tmp_path / "worker0.parquet", tmp_path / "worker1.parquet"], merged) == 3
+    assert [row["url"].rsplit("/", 1)[1] for row in pq.read_table(merged).to_pylist()] == ["1", "2", "3"]
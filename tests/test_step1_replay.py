@@ -0,0 +1,31 @@
+import csv
+import functools
+import json
+
+import pytest
+
+pytest.importorskip("zstandard")
+
+import step1_replay
+from step1_archive import ResponseArchive, iter_archive, load_manifest
+
+
+def page(*ids):
+    listings = [{"id": listing_id, "path": f"/listing-{listing_id}", "price": 1000} for listing_id in ids]
+    return json.dumps({"data": {"Web": {"find": {"total": 3, "listings": listings}}}}).encode("utf-8")
+
+
+def test_listings_archived_by_several_workers_are_replayed_once(tmp_path, monkeypatch):
+    archive_dir = str(tmp_path / "archive")
+    for prefix, body in (("worker0-", page(1, 2)), ("worker1-", page(2, 3))):
+        archive = ResponseArchive("run", 1700000000, prefix=prefix, archive_dir=archive_dir)
+        archive.write({"from": 0, "size": 2}, body)
+        archive.close()
+    monkeypatch.setattr(step1_replay, "iter_archive", functools.partial(iter_archive, archive_dir=archive_dir))
+    monkeypatch.setattr(step1_replay, "load_manifest", functools.partial(load_manifest, archive_dir=archive_dir))
+    monkeypatch.setattr(step1_replay, "feed_formats", lambda: ["csv"])
+    output_base = str(tmp_path / "raw_saudi_real_estate")
+
+    assert step1_replay.replay_run("run", output_base) == 3
+    with open(f"{output_base}.csv", encoding="utf-8-sig") as f:
+        assert sorted(row["url"].rsplit("-", 1)[1] for row in csv.DictReader(f)) == ["1", "2", "3"]
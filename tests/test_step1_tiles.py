@@ -0,0 +1,86 @@
+import json
+
+import pytest
+from scrapy.http import Request, TextResponse
+
+import step1_scrapy_aquire_data
+from step1_scrapy_aquire_data import AqarStandaloneSpider
+from step1_tiles import Tile, should_split
+
+
+def test_quadrants_cover_the_tile_exactly_one_level_deeper():
+    tile = Tile.root()
+    children = tile.split()
+
+    assert [child.depth for child in children] == [1, 1, 1, 1]
+    assert len({child.key for child in children}) == 4
+    assert {(child.min_lat, child.max_lat) for child in children} == {
+        (tile.min_lat, (tile.min_lat + tile.max_lat) / 2),
+        ((tile.min_lat + tile.max_lat) / 2, tile.max_lat),
+    }
+    assert {(child.min_lng, child.max_lng) for child in children} == {
+        (tile.min_lng, (tile.min_lng + tile.max_lng) / 2),
+        ((tile.min_lng + tile.max_lng) / 2, tile.max_lng),
+    }
+    area = sum((child.max_lat - child.min_lat) * (child.max_lng - child.min_lng) for child in children)
+    assert area == pytest.approx((tile.max_lat - tile.min_lat) * (tile.max_lng - tile.min_lng))
+
+
+def test_polygon_is_a_closed_ring():
+    polygon = Tile(24.0, 46.0, 25.0, 47.0, 0).polygon()
+
+    assert polygon[0] == polygon[-1] == {"lat": 24.0, "lng": 46.0}
+    assert {(point["lat"], point["lng"]) for point in polygon} == {(24.0, 46.0), (24.0, 47.0), (25.0, 47.0), (25.0, 46.0)}
+
+
+def test_tiles_split_until_they_are_small_enough_or_too_deep():
+    assert should_split(Tile.root(), 1001, max_listings=1000, max_depth=12)
+    assert not should_split(Tile.root(), 1000, max_listings=1000, max_depth=12)
+    assert not should_split(Tile(24.0, 46.0, 25.0, 47.0, 12), 5000, max_listings=1000, max_depth=12)
+
+
+def tile_response(tile, body, **meta):
+    request = Request("https://sa.aqar.fm/graphql", method="POST", body=b"{}", meta={"tile": tile, **meta})
+    return TextResponse(url=request.url, body=json.dumps(body).encode("utf-8"), encoding="utf-8", request=request)
+
+
+def total(count):
+    return {"data": {"Web": {"find": {"total": count}}}}
+
+
+@pytest.fixture
+def spider(monkeypatch):
+    monkeypatch.setattr(step1_scrapy_aquire_data, "TILE_MAX_LISTINGS", 100)
+    spider = AqarStandaloneSpider(archive=False)
+    spider.tile_mode = True
+    spider.controller = None
+    spider.page_size = 40
+    return spider
+
+
+def test_crowded_tiles_are_split_and_leaf_tiles_paged(spider):
+    root = Tile.root()
+    requests = list(spider.parse_tile_total(tile_response(root, total(500))))
+    assert [request.meta["tile"] for request in requests] == root.split()
+
+    leaf = root.split()[0]
+    pages = list(spider.parse_tile_total(tile_response(leaf, total(90))))
+    assert [(page.meta["page_from"], page.meta["page_size"], page.meta["tile"]) for page in pages] == [
+        (0, 40, leaf), (40, 40, leaf), (80, 40, leaf),
+    ]
+    assert json.loads(pages[0].body)["variables"]["polygon"] == leaf.polygon()
+
+
+def test_listings_on_tile_edges_are_emitted_once(spider):
+    west, east = Tile.root().split()[:2]
+
+    def page(tile, ids):
+        listings = [{"id": listing_id, "path": f"/{listing_id}", "location": {}} for listing_id in ids]
+        meta = {"page_from": 0, "page_size": 40, "page_total": len(ids)}
+        return tile_response(tile, {"data": {"Web": {"find": {"listings": listings}}}}, **meta)
+
+    spider.in_flight = 2
+    items = [output for tile, ids in ((west, [1, 2]), (east, [2, 3])) for output in spider.parse(page(tile, ids))]
+
+    assert [item["url"].rsplit("/", 1)[1] for item in items] == ["1", "2", "3"]
+    assert spider.duplicate_count == 1
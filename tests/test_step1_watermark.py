@@ -0,0 +1,84 @@
+import json
+
+import pytest
+
+import step1_scrapy_aquire_data
+from step1_scrapy_aquire_data import AqarStandaloneSpider
+from step1_watermark import load_watermark, save_watermark, to_timestamp
+
+
+def test_to_timestamp_reads_epochs_numeric_strings_and_iso_dates():
+    assert to_timestamp(1700000000) == 1700000000
+    assert to_timestamp(1700000000.7) == 1700000000
+    assert to_timestamp("1700000000") == 1700000000
+    assert to_timestamp("1700000000.5") == 1700000000
+    assert to_timestamp("2023-11-14T22:13:20Z") == 1700000000
+    assert to_timestamp("2023-11-14T22:13:20+00:00") == 1700000000
+
+
+def test_to_timestamp_rejects_bools_and_garbage():
+    assert to_timestamp(True) is None
+    assert to_timestamp(False) is None
+    assert to_timestamp(None) is None
+    assert to_timestamp("yesterday") is None
+    assert to_timestamp({"t": 1}) is None
+
+
+def test_watermark_never_moves_backwards(tmp_path):
+    path = str(tmp_path / "crawl_watermark.json")
+    assert load_watermark(path) is None
+
+    save_watermark(200, 300, path=path)
+    watermark = save_watermark(100, 400, path=path)
+    assert (watermark["create_time"], watermark["last_update"]) == (200, 400)
+    save_watermark(None, None, path=path)
+    with open(path, encoding="utf-8") as f:
+        assert {key: value for key, value in json.load(f).items() if key != "saved_at"} == {
+            "create_time": 200,
+            "last_update": 400,
+        }
+
+
+@pytest.fixture
+def saved(monkeypatch):
+    saved = []
+    monkeypatch.setattr(
+        step1_scrapy_aquire_data, "save_watermark", lambda create_time, last_update: saved.append(create_time) or {}
+    )
+    return saved
+
+
+def spider(**attributes):
+    spider = AqarStandaloneSpider(archive=False)
+    spider.max_create_time = 1700000000
+    spider.max_last_update = 1700000500
+    for name, value in attributes.items():
+        setattr(spider, name, value)
+    return spider
+
+
+def test_full_and_incremental_runs_save_the_watermark(saved):
+    spider().closed("finished")
+    spider(incremental_cutoff=1690000000).closed("finished")
+    assert saved == [1700000000, 1700000000]
+
+
+def test_runs_that_lost_pages_or_did_not_finish_keep_the_old_watermark(saved):
+    spider(abandoned_pages=1).closed("finished")
+    spider(incremental_cutoff=1690000000, abandoned_pages=2).closed("finished")
+    spider().closed("shutdown")
+    spider(max_create_time=None).closed("finished")
+    assert saved == []
+
+
+class Frontier:
+    def stats(self):
+        return {}
+
+    def close(self):
+        pass
+
+
+def test_distributed_workers_do_not_save_the_watermark(saved):
+    spider(frontier=Frontier(), worker_id=1).closed("finished")
+    assert saved == []
@@ -0,0 +1,53 @@
+import asyncio
+import re
+
+from step2_add_demographics import (
+    HOUSING_BATCH_AGGREGATES,
+    HOUSING_BATCH_SOURCE,
+    _batch_args,
+    fetch_housing_rings_async,
+    rings_batch_sql,
+)
+
+
+def test_ring_batch_query_binds_every_parameter():
+    radii_km = [1, 2, 3, 5, 7, 10, 15, 20, 25]
+    locations = [{"lat": 24.7, "lng": 46.6, "key": 1}, {"lat": 24.8, "lng": 46.7, "key": 2}]
+    args = _batch_args(locations, radii_km)
+    assert len(args) == 13
+
+    sql = rings_batch_sql(HOUSING_BATCH_SOURCE, HOUSING_BATCH_AGGREGATES, len(radii_km))
+
+    # $12 and $13 are placeholders of their own, not $1 followed by a digit
+    assert {int(index) for index in re.findall(r"\$(\d+)\b", sql)} == set(range(1, len(args) + 1))
+    assert args[11] == 20 / 111 and args[12] == 25 / 111
+
+
+def test_housing_sums_are_cast_to_float8():
+    for alias, aggregate in HOUSING_BATCH_AGGREGATES.items():
+        assert aggregate.endswith("::float8"), alias
+
+
+class FakePool:
+    def __init__(self, rows):
+        self.rows = rows
+        self.fetched = []
+
+    async def fetch(self, sql, *args):
+        self.fetched.append((sql, args))
+        return self.rows
+
+
+def test_ring_rows_are_split_by_radius():
+    row = {"coord_key": 7}
+    for index, value in enumerate((10.0, 30.0)):
+        row.update({f"{alias}__{index}": value for alias in HOUSING_BATCH_AGGREGATES})
+    pool = FakePool([row])
+
+    rings = asyncio.run(fetch_housing_rings_async(pool, [{"lat": 24.7, "lng": 46.6, "key": 7}], [1, 3]))
+
+    assert rings[1][7]["total_housings"] == 10.0
+    assert rings[3][7]["total_housings"] == 30.0
+    assert set(rings[3][7]) == set(HOUSING_BATCH_AGGREGATES)
+    [(_, args)] = pool.fetched
+    assert args[:3] == ([7], [24.7], [46.6])
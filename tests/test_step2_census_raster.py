@@ -0,0 +1,125 @@
+import json
+
+import pytest
+
+import step2_census_raster
+import step2_stage_cache
+from step2_census_raster import CensusRaster, household_from_raster, housing_from_raster, load_census_raster
+
+CELL = 0.01
+ORIGIN_LNG, ORIGIN_LAT = 46.6, 24.7
+
+
+def cell(col, row, properties):
+    lng, lat = ORIGIN_LNG + col * CELL, ORIGIN_LAT + row * CELL
+    ring = [[lng, lat], [lng + CELL, lat], [lng + CELL, lat + CELL], [lng, lat + CELL], [lng, lat]]
+    return {"type": "Feature", "geometry": {"type": "Polygon", "coordinates": [ring]}, "properties": properties}
+
+
+def household_features(size=4):
+    """A size x size grid with the property names the census step2 writes; cell (0, 0) has no values."""
+    features = []
+    for col in range(size):
+        for row in range(size):
+            properties = {"Main_ID": f"{col}-{row}", "density": float(col + row)}
+            if (col, row) != (0, 0):
+                properties["Household_Average_Size"] = 4.0 + col
+                properties["Household_Median_Size"] = 3.0 + row
+            features.append(cell(col, row, properties))
+    return features
+
+
+def housing_features(size=4):
+    features = []
+    for col in range(size):
+        for row in range(size):
+            properties = {prop: col * size + row for prop in step2_census_raster.HOUSING_PROPERTIES}
+            properties["density"] = 0.5
+            features.append(cell(col, row, properties))
+    return features
+
+
+@pytest.fixture
+def census_dir(tmp_path, monkeypatch):
+    """saudi_census/<layer>/<layer>_json_files/v12/features.json, as the census step1 and step2 leave them."""
+    census_dir = tmp_path / "saudi_census"
+    for layer, features in (("household", household_features()), ("housing", housing_features())):
+        level_dir = census_dir / layer / f"{layer}_json_files" / "v12"
+        level_dir.mkdir(parents=True)
+        (level_dir / "features.json").write_text(json.dumps({"type": "FeatureCollection", "features": features}))
+    monkeypatch.setattr(step2_census_raster, "CENSUS_DIR", str(census_dir))
+    monkeypatch.setattr(step2_census_raster, "CENSUS_RASTER_DIR", str(tmp_path / "census_rasters"))
+    monkeypatch.setattr(step2_stage_cache, "STAGE_CACHE_DIR", str(tmp_path / "stage_cache"))
+    monkeypatch.setattr(step2_stage_cache, "DIGESTS_PATH", str(tmp_path / "stage_cache" / "digests.json"))
+    monkeypatch.setattr(step2_stage_cache, "_digests", None)
+    return census_dir
+
+
+def brute_force_household(features, lat, lng, radius_km):
+    """aggregate_household over the cells a PostGIS && bbox query would return."""
+    delta = radius_km / 111
+    hits = []
+    for feature in features:
+        ring = feature["geometry"]["coordinates"][0]
+        lngs, lats = [point[0] for point in ring], [point[1] for point in ring]
+        if min(lngs) <= lng + delta and max(lngs) >= lng - delta and min(lats) <= lat + delta and max(lats) >= lat - delta:
+            hits.append(feature["properties"])
+    count = len(hits)
+    return {
+        "total_households": count,
+        "avg_household_size": round(sum(p.get("Household_Average_Size") or 0 for p in hits) / count, 2) if count else 0.0,
+        "median_household_size": round(sum(p.get("Household_Median_Size") or 0 for p in hits) / count, 2) if count else 0.0,
+        "density_sum": round(sum(p["density"] for p in hits), 2),
+    }
+
+
+def test_census_source_path_follows_the_census_scripts(census_dir):
+    assert step2_census_raster.census_source_path("household", 12) == str(
+        census_dir / "household" / "household_json_files" / "v12" / "features.json"
+    )
+    assert step2_census_raster.census_source_path("housing", 12).endswith("housing_json_files/v12/features.json")
+
+
+def test_household_raster_matches_the_bbox_aggregation(census_dir):
+    raster = load_census_raster("household", 12)
+    locations = [
+        {"lat": 24.715, "lng": 46.615, "key": 1},
+        {"lat": 24.701, "lng": 46.601, "key": 2},
+        {"lat": 24.5, "lng": 46.0, "key": 3},
+    ]
+    rings = household_from_raster(raster, locations, radii_km=(0.5, 1, 2))
+
+    features = household_features()
+    for radius_km, results in rings.items():
+        for loc in locations:
+            assert results[loc["key"]] == brute_force_household(features, loc["lat"], loc["lng"], radius_km)
+    assert rings[1][3]["total_households"] == 0
+
+
+def test_housing_raster_sums_every_property(census_dir):
+    raster = load_census_raster("housing", 12)
+    [result] = housing_from_raster(raster, [{"lat": 24.745, "lng": 46.645, "key": 1}], radii_km=(10,))[10].values()
+
+    # Every cell of the grid falls in the 10km bbox
+    assert result["total_housings"] == sum(range(16))
+    # Whole sums stay floats, like the database path's ::float8 sums
+    assert all(isinstance(value, float) for value in result.values())
+    assert result["density_sum"] == 8.0
+
+
+def test_raster_is_rebuilt_only_when_the_geojson_changes(census_dir, monkeypatch):
+    load_census_raster("household", 12)
+    monkeypatch.setattr(CensusRaster, "from_geojson", classmethod(lambda *args: pytest.fail("rasterised again")))
+    load_census_raster("household", 12)
+
+
+def test_missing_or_unprocessed_census_files_raise(census_dir):
+    with pytest.raises(FileNotFoundError):
+        load_census_raster("household", 14)
+
+    # Straight from the census step1, before step2 renamed the properties
+    raw = [cell(0, 0, {"HHAVG": 4.0, "HHMED": 3.0})]
+    path = census_dir / "household" / "household_json_files" / "v12" / "features.json"
+    path.write_text(json.dumps({"type": "FeatureCollection", "features": raw}))
+    with pytest.raises(ValueError):
+        load_census_raster("household", 12)
@@ -0,0 +1,34 @@
+import random
+
+import numpy as np
+
+from step2_coord_keys import coord_key, coord_keys
+
+
+def test_vectorised_keys_match_coord_key():
+    rng = random.Random(0)
+    lat = [rng.uniform(-90, 90) for _ in range(1000)] + [24.7136, -90.0, 90.0]
+    lng = [rng.uniform(-180, 180) for _ in range(1000)] + [46.6753, -180.0, 180.0]
+
+    for precision in (4, 6, 7):
+        keys = coord_keys(lat, lng, precision)
+        assert keys.tolist() == [coord_key(a, b, precision) for a, b in zip(lat, lng)]
+
+
+def test_keys_are_equal_within_the_precision_and_distinct_beyond_it():
+    assert coord_key(24.7136001, 46.6753004, 6) == coord_key(24.7136, 46.6753, 6)
+    assert coord_key(24.713601, 46.6753, 6) != coord_key(24.7136, 46.6753, 6)
+    # Latitude and longitude steps never collide
+    assert coord_key(24.7137, 46.6753, 4) != coord_key(24.7136, 46.6754, 4)
+    assert len({coord_key(lat / 10, lng / 10, 1) for lat in range(-5, 5) for lng in range(-5, 5)}) == 100
+
+
+def test_missing_coordinates_get_minus_one():
+    keys = coord_keys([24.7, np.nan, 24.8], [46.6, 46.7, None], 6)
+
+    assert keys[0] == coord_key(24.7, 46.6, 6)
+    assert keys[1:].tolist() == [-1, -1]
+
+
+def test_keys_fit_a_signed_64_bit_integer_at_precision_7():
+    assert coord_keys([90.0], [180.0], 7)[0] == coord_key(90.0, 180.0, 7) < 2**63
@@ -0,0 +1,41 @@
+import json
+
+import pandas as pd
+import pytest
+
+from step2_data_extractor import extract_data_columns
+
+
+def blob(**listing):
+    return json.dumps(listing)
+
+
+def test_fields_are_typed_and_aligned_to_the_index():
+    data = pd.Series(
+        [
+            blob(direction_id=3, area=120.5, rooms="4", user={"paid": True}, district="Olaya"),
+            blob(direction_id=None, area="n/a", rooms=2.5, user="unknown"),
+            "not json",
+            None,
+            "[1, 2]",
+        ],
+        index=[10, 11, 12, 13, 14],
+    )
+    columns = extract_data_columns(data, ["direction_id", "area", "rooms", "user_paid", "district"])
+
+    assert list(columns.index) == [10, 11, 12, 13, 14]
+    assert columns["direction_id"].tolist()[0] == 3
+    assert str(columns["direction_id"].dtype) == "Int16"
+    assert columns["direction_id"].isna().tolist() == [False, True, True, True, True]
+    assert columns["area"].isna().tolist() == [False, True, True, True, True]
+    # Fractional values cannot be held by the integer column
+    assert columns["rooms"].tolist() == [4, pd.NA, pd.NA, pd.NA, pd.NA]
+    assert columns["user_paid"].tolist() == [True, pd.NA, pd.NA, pd.NA, pd.NA]
+    assert columns["district"].tolist() == ["Olaya", pd.NA, pd.NA, pd.NA, pd.NA]
+    assert str(columns["rooms"].dtype) == "Int64"
+    assert str(columns["user_paid"].dtype) == "boolean"
+
+
+def test_unknown_fields_are_rejected():
+    with pytest.raises(ValueError):
+        extract_data_columns(pd.Series([blob(area=1)]), ["area", "colour"])
@@ -0,0 +1,123 @@
+import sqlite3
+import time
+
+import pytest
+
+import step2_stage_cache
+from step2_enrichment_cache import EnrichmentCache
+from step2_results_store import ResultsStore
+
+
+@pytest.fixture
+def cache_path(tmp_path):
+    return str(tmp_path / "enrichment_cache.sqlite")
+
+
+def test_results_are_served_until_their_ttl(cache_path, monkeypatch):
+    cache = EnrichmentCache("traffic", ttl=100, path=cache_path)
+    cache.put_many({1: {"traffic_score": 10}, 2: {"traffic_score": 20}})
+
+    assert cache.get_many([1, 2, 3]) == {1: {"traffic_score": 10}, 2: {"traffic_score": 20}}
+    assert cache.stats["hits"] == 2 and cache.stats["misses"] == 1
+
+    now = time.time()
+    monkeypatch.setattr("step2_enrichment_cache.time.time", lambda: now + 101)
+    assert cache.get_many([1, 2]) == {}
+
+
+def test_variants_and_radii_are_cached_separately(cache_path):
+    monday = EnrichmentCache("traffic", path=cache_path, variant="north/Monday/6PM/default")
+    friday = EnrichmentCache("traffic", path=cache_path, variant="north/Friday/6PM/default")
+    wider = EnrichmentCache("traffic", radius_km=2, path=cache_path, variant="north/Monday/6PM/default")
+    monday.put_many({1: {"traffic_score": 10}})
+
+    assert monday.get_many([1]) == {1: {"traffic_score": 10}}
+    assert friday.get_many([1]) == {}
+    assert wider.get_many([1]) == {}
+
+
+def test_least_recently_used_entries_are_evicted_per_variant_and_radius(cache_path):
+    monday = EnrichmentCache("traffic", path=cache_path, variant="Monday", max_entries=2)
+    friday = EnrichmentCache("traffic", path=cache_path, variant="Friday", max_entries=2)
+    other = EnrichmentCache("household", path=cache_path, max_entries=2)
+    monday.put_many({1: {"score": 1}, 2: {"score": 2}, 3: {"score": 3}})
+    friday.put_many({4: {"score": 4}, 5: {"score": 5}})
+    other.put_many({6: {}, 7: {}})
+    monday.get_many([1, 3])
+
+    assert monday.evict() == 1
+    assert monday.get_many([1, 2, 3]) == {1: {"score": 1}, 3: {"score": 3}}
+    assert friday.evict() == 0 and other.evict() == 0
+    assert len(friday.get_many([4, 5])) == 2 and len(other.get_many([6, 7])) == 2
+
+
+def test_radii_closing_in_turn_keep_each_others_entries(cache_path):
+    rings = [EnrichmentCache("household", radius_km=radius_km, path=cache_path, max_entries=2) for radius_km in (1, 3, 5)]
+    for ring in rings:
+        ring.put_many({1: {"total_households": 1}, 2: {"total_households": 2}})
+    for ring in rings:
+        ring.close()
+
+    for radius_km in (1, 3, 5):
+        ring = EnrichmentCache("household", radius_km=radius_km, path=cache_path, max_entries=2)
+        assert len(ring.get_many([1, 2])) == 2
+
+
+def test_eviction_queries_use_the_lru_index(cache_path):
+    cache = EnrichmentCache("traffic", path=cache_path, variant="Monday")
+    for query in (
+        "SELECT COUNT(*) FROM enrichment_cache WHERE enricher = ? AND variant = ? AND radius_km = ?",
+        "SELECT enricher, variant, coord_key, precision, radius_km FROM enrichment_cache "
+        "WHERE enricher = ? AND variant = ? AND radius_km = ? ORDER BY last_used LIMIT 10",
+    ):
+        plan = " ".join(row[-1] for row in cache.conn.execute(f"EXPLAIN QUERY PLAN {query}", ("traffic", "Monday", 0)))
+        assert "enrichment_cache_scope_lru" in plan
+        assert "TEMP B-TREE" not in plan
+
+
+def test_caches_with_the_variant_in_the_enricher_column_are_migrated(cache_path):
+    conn = sqlite3.connect(cache_path)
+    conn.execute(
+        """
+        CREATE TABLE enrichment_cache (
+            enricher TEXT NOT NULL, coord_key INTEGER NOT NULL, precision INTEGER NOT NULL,
+            radius_km REAL NOT NULL, value BLOB NOT NULL, created_at REAL NOT NULL, last_used REAL NOT NULL,
+            PRIMARY KEY (enricher, coord_key, precision, radius_km)
+        ) WITHOUT ROWID
+        """
+    )
+    now = time.time()
+    conn.executemany(
+        "INSERT INTO enrichment_cache VALUES (?, ?, ?, ?, ?, ?, ?)",
+        [
+            ("traffic:north/Monday/6PM/default", 1, 4, 0, b'{"traffic_score": 10}', now, now),
+            ("household", 1, 4, 1, b'{"total_households": 3}', now, now),
+        ],
+    )
+    conn.commit()
+    conn.close()
+
+    traffic = EnrichmentCache("traffic", path=cache_path, precision=4, variant="north/Monday/6PM/default")
+    household = EnrichmentCache("household", radius_km=1, path=cache_path, precision=4)
+    assert traffic.get_many([1]) == {1: {"traffic_score": 10}}
+    assert household.get_many([1]) == {1: {"total_households": 3}}
+
+
+def test_results_store_starts_over_when_the_variant_changes(tmp_path, monkeypatch):
+    monkeypatch.setattr(step2_stage_cache, "STAGE_CACHE_DIR", str(tmp_path / "stage_cache"))
+    monkeypatch.setattr(step2_stage_cache, "DIGESTS_PATH", str(tmp_path / "stage_cache" / "digests.json"))
+    monkeypatch.setattr(step2_stage_cache, "_digests", None)
+    input_csv = tmp_path / "saudi.csv"
+    input_csv.write_text("latitude,longitude\n24.7,46.6\n")
+    path = str(tmp_path / "results.sqlite")
+
+    def store(variant):
+        return ResultsStore("traffic", ["traffic_score"], str(input_csv), path=path, variant=variant)
+
+    monday = store("Monday")
+    [location] = monday.pending_locations()
+    monday.save({location["key"]: {"traffic_score": 10}})
+    monday.close()
+
+    assert store("Monday").pending_locations() == []
+    assert store("Friday").pending_locations() == [location]
@@ -0,0 +1,95 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import step2_stage_cache
+from step2_results_store import ResultsStore, materialise_combined
+
+
+@pytest.fixture
+def input_csv(tmp_path, monkeypatch):
+    monkeypatch.setattr(step2_stage_cache, "STAGE_CACHE_DIR", str(tmp_path / "stage_cache"))
+    monkeypatch.setattr(step2_stage_cache, "DIGESTS_PATH", str(tmp_path / "stage_cache" / "digests.json"))
+    monkeypatch.setattr(step2_stage_cache, "_digests", None)
+    path = tmp_path / "saudi.csv"
+    path.write_text(
+        "listing_id,latitude,longitude\n"
+        "1,24.7,46.6\n"
+        "2,24.7,46.6\n"
+        "3,24.8,46.7\n"
+        "4,,\n"
+    )
+    return path
+
+
+@pytest.fixture
+def open_store(tmp_path, input_csv):
+    def open_store(columns=("traffic_score",), **kwargs):
+        return ResultsStore("traffic", list(columns), str(input_csv), path=str(tmp_path / "results.sqlite"), **kwargs)
+
+    return open_store
+
+
+def test_each_coordinate_key_is_enriched_once(open_store):
+    store = open_store()
+    locations = store.unique_locations()
+
+    # Listings 1 and 2 share a location, listing 4 has none
+    assert [(loc["lat"], loc["lng"]) for loc in locations] == [(24.7, 46.6), (24.8, 46.7)]
+    assert store.pending_locations(locations) == locations
+
+
+def test_an_interrupted_run_resumes_with_the_missing_keys(open_store):
+    store = open_store()
+    first, second = store.pending_locations()
+    store.save({first["key"]: {"traffic_score": np.float64(10.5)}})
+    store.close()
+
+    assert open_store().pending_locations() == [second]
+
+
+def test_results_are_cleared_when_the_input_changes(open_store, input_csv):
+    store = open_store()
+    store.save({location["key"]: {"traffic_score": 1} for location in store.pending_locations()})
+    store.close()
+
+    input_csv.write_text(input_csv.read_text() + "5,24.9,46.8\n")
+    assert len(open_store().pending_locations()) == 3
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [{"precision": 4}, {"variant": "Friday"}, {"columns": ["traffic_score", "traffic_level"]}],
+    ids=["precision", "variant", "columns"],
+)
+def test_results_are_cleared_when_the_key_variant_or_columns_change(open_store, kwargs):
+    store = open_store()
+    store.save({location["key"]: {"traffic_score": 1} for location in store.pending_locations()})
+    store.close()
+
+    assert open_store().pending_locations() == []
+    assert len(open_store(**kwargs).pending_locations()) == 2
+
+
+def test_results_fan_out_to_every_listing_at_the_key(open_store, tmp_path):
+    traffic = open_store()
+    household = ResultsStore(
+        "household", ["total_households"], traffic.input_csv_path, path=str(tmp_path / "results.sqlite")
+    )
+    first, second = traffic.pending_locations()
+    traffic.save({first["key"]: {"traffic_score": 10}, second["key"]: {"traffic_score": 20}})
+    household.save({first["key"]: {"total_households": np.int64(3)}})
+    output_path = tmp_path / "enriched.csv"
+
+    rows = materialise_combined(
+        [(traffic, {}), (household, {"total_households": "households_1km"})],
+        str(output_path),
+        ["listing_id", "latitude", "longitude"],
+    )
+
+    assert rows == 4
+    df = pd.read_csv(output_path)
+    assert list(df.columns) == ["listing_id", "latitude", "longitude", "traffic_score", "households_1km"]
+    assert df["traffic_score"].tolist()[:3] == [10, 10, 20]
+    assert df["households_1km"].tolist()[:2] == [3, 3]
+    assert df.iloc[2:][["households_1km"]].isna().all().all()
@@ -0,0 +1,82 @@
+import hashlib
+import os
+
+import pytest
+
+import step2_stage_cache
+from step2_stage_cache import file_digest, is_fresh, record, stage_key
+
+
+@pytest.fixture(autouse=True)
+def stage_cache_dir(tmp_path, monkeypatch):
+    cache_dir = tmp_path / "stage_cache"
+    monkeypatch.setattr(step2_stage_cache, "STAGE_CACHE_DIR", str(cache_dir))
+    monkeypatch.setattr(step2_stage_cache, "DIGESTS_PATH", str(cache_dir / "digests.json"))
+    monkeypatch.setattr(step2_stage_cache, "_digests", None)
+    return cache_dir
+
+
+def write(path, text, mtime_ns=None):
+    path.write_text(text)
+    if mtime_ns is not None:
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+    return str(path)
+
+
+def count_hashes(monkeypatch):
+    calls = []
+    sha256 = step2_stage_cache._sha256
+
+    def counting(path, block_size):
+        calls.append(path)
+        return sha256(path, block_size)
+
+    monkeypatch.setattr(step2_stage_cache, "_sha256", counting)
+    return calls
+
+
+def test_digest_is_hashed_once_and_kept_across_runs(tmp_path, monkeypatch):
+    path = write(tmp_path / "feed.csv", "a,b\n1,2\n")
+    calls = count_hashes(monkeypatch)
+
+    assert file_digest(path) == hashlib.sha256(b"a,b\n1,2\n").hexdigest()
+    file_digest(path)
+    # A new run starts without the in-memory digests and reads them back from disk
+    monkeypatch.setattr(step2_stage_cache, "_digests", None)
+    file_digest(path)
+    assert len(calls) == 1
+
+
+def test_digest_is_recomputed_when_the_file_changes(tmp_path, monkeypatch):
+    path = write(tmp_path / "feed.csv", "a,b\n1,2\n", mtime_ns=1_000_000_000)
+    first = file_digest(path)
+    calls = count_hashes(monkeypatch)
+
+    # Same size, only the modification time tells the files apart
+    write(tmp_path / "feed.csv", "a,b\n3,4\n", mtime_ns=2_000_000_000)
+    assert file_digest(path) != first
+    assert len(calls) == 1
+
+
+def test_stage_key_follows_contents_and_parameters(tmp_path):
+    path = write(tmp_path / "feed.csv", "a\n1\n")
+    key = stage_key([path], {"category": "shop_for_rent"})
+
+    assert stage_key([path], {"category": "shop_for_rent"}) == key
+    assert stage_key([path], {"category": "villa_for_sale"}) != key
+    write(tmp_path / "feed.csv", "a\n2\n", mtime_ns=3_000_000_000)
+    assert stage_key([path], {"category": "shop_for_rent"}) != key
+
+
+def test_stage_is_fresh_until_its_key_or_outputs_change(tmp_path):
+    output = write(tmp_path / "out.csv", "x\n1\n")
+    assert not is_fresh("transform", "key-1", [output])
+
+    record("transform", "key-1", [output])
+    assert is_fresh("transform", "key-1", [output])
+    assert not is_fresh("transform", "key-2", [output])
+
+    write(tmp_path / "out.csv", "x\n10\n")
+    assert not is_fresh("transform", "key-1", [output])
+    os.remove(output)
+    assert not is_fresh("transform", "key-1", [output])
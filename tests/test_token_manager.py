@@ -0,0 +1,117 @@
+import base64
+import json
+import threading
+import time
+
+import pytest
+
+import token_manager
+from token_manager import TokenManager
+
+
+class Clock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(token_manager.time, "time", clock)
+    return clock
+
+
+def jwt(exp):
+    def encode(data):
+        return base64.urlsafe_b64encode(json.dumps(data).encode()).decode().rstrip("=")
+
+    return f"{encode({'alg': 'none'})}.{encode({'exp': exp})}.signature"
+
+
+class Login:
+    def __init__(self, clock, ttl):
+        self.clock = clock
+        self.ttl = ttl
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return jwt(self.clock.now + self.ttl)
+
+
+def test_refreshes_margin_seconds_before_expiry(clock):
+    login = Login(clock, ttl=3600)
+    tokens = TokenManager("service", login, margin=300)
+
+    first = tokens.get()
+    clock.now += 3299
+    assert tokens.get() == first
+    clock.now += 2
+    assert tokens.get() != first
+    assert login.calls == 2
+
+
+def test_margin_is_capped_at_half_the_token_lifetime(clock):
+    # A 300s margin on a 60s token would otherwise log in again on every call
+    login = Login(clock, ttl=60)
+    tokens = TokenManager("service", login, margin=300)
+
+    tokens.get()
+    clock.now += 29
+    tokens.get()
+    assert login.calls == 1
+    clock.now += 2
+    tokens.get()
+    assert login.calls == 2
+
+
+def test_tokens_without_exp_claim_use_the_default_ttl(clock):
+    logins = []
+    tokens = TokenManager("service", lambda: logins.append(1) or "opaque-token", margin=10, default_ttl=100)
+
+    tokens.get()
+    clock.now += 89
+    tokens.get()
+    assert len(logins) == 1
+    clock.now += 2
+    tokens.get()
+    assert len(logins) == 2
+
+
+class Unauthorized(Exception):
+    status = 401
+
+
+def test_call_logs_in_again_once_after_a_401(clock):
+    login = Login(clock, ttl=3600)
+    tokens = TokenManager("service", login)
+    rejected = tokens.get()
+
+    def request(token):
+        if token == rejected:
+            raise Unauthorized()
+        return "ok"
+
+    clock.now += 1
+    assert tokens.call(request) == "ok"
+    assert login.calls == 2
+
+
+def test_concurrent_callers_share_one_login(clock):
+    calls = []
+
+    def slow_login():
+        calls.append(1)
+        time.sleep(0.05)
+        return "opaque-token"
+
+    tokens = TokenManager("service", slow_login)
+    threads = [threading.Thread(target=tokens.get) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
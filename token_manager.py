@@ -0,0 +1,134 @@
+import asyncio
+import base64
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+
+# Refresh this many seconds before a token expires, at most half of the token's lifetime
+TOKEN_REFRESH_MARGIN_SECONDS = float(os.getenv("TOKEN_REFRESH_MARGIN_SECONDS", 300))
+# Lifetime assumed for tokens that are not JWTs or carry no exp claim
+TOKEN_DEFAULT_TTL_SECONDS = float(os.getenv("TOKEN_DEFAULT_TTL_SECONDS", 1800))
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+def jwt_expiry(token):
+    """The exp claim of a JWT as a unix timestamp, or None when the token is not a JWT."""
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        return float(json.loads(base64.urlsafe_b64decode(payload))["exp"])
+    except Exception:
+        return None
+
+
+def is_unauthorized(error):
+    """True for a 401 raised by requests, httpx or aiohttp."""
+    response = getattr(error, "response", None)
+    status = getattr(response, "status_code", None) or getattr(error, "status", None)
+    return status == 401
+
+
+class TokenManager:
+    """
+    Caches the credentials of one service and logs in again shortly before the token expires,
+    or after the service rejected it with a 401.
+
+    `login` returns the credentials (sync or async); `token` picks the bearer token out of them,
+    its JWT exp claim decides when to refresh: `margin` seconds before expiry, or halfway through
+    the token's lifetime when that is shorter. Safe to share across threads and asyncio tasks:
+    concurrent callers wait for a single login instead of each logging in.
+    """
+
+    def __init__(self, name, login, token=None, margin=TOKEN_REFRESH_MARGIN_SECONDS,
+                 default_ttl=TOKEN_DEFAULT_TTL_SECONDS):
+        self.name = name
+        self.login = login
+        self.token = token or (lambda credentials: credentials)
+        self.margin = margin
+        self.default_ttl = default_ttl
+        self.credentials = None
+        self.expires_at = 0.0
+        self.refresh_at = 0.0
+        self.logins = 0
+        self._lock = threading.Lock()
+
+    def _valid(self):
+        return self.credentials is not None and time.time() < self.refresh_at
+
+    def get(self):
+        """Current credentials, logging in first when there are none or they are about to expire."""
+        if self._valid():
+            return self.credentials
+        with self._lock:
+            if not self._valid():
+                credentials = self.login()
+                if inspect.isawaitable(credentials):
+                    credentials = asyncio.run(credentials)
+                token = self.token(credentials) if credentials else None
+                if not token:
+                    raise RuntimeError(f"{self.name} login returned no token")
+                now = time.time()
+                self.credentials = credentials
+                self.expires_at = jwt_expiry(token) or now + self.default_ttl
+                # A margin longer than the token lives would refresh it on every call
+                ttl = max(self.expires_at - now, 0.0)
+                self.refresh_at = self.expires_at - min(self.margin, ttl / 2)
+                self.logins += 1
+                logging.info(
+                    f"Logged in to {self.name}, token valid for {self.expires_at - time.time():.0f}s"
+                )
+            return self.credentials
+
+    async def get_async(self):
+        """get() for coroutines: a needed login runs in a worker thread so the event loop keeps going."""
+        if self._valid():
+            return self.credentials
+        return await asyncio.to_thread(self.get)
+
+    def invalidate(self, credentials=None):
+        """
+        Forget the cached credentials, e.g. after a 401. Passing the rejected credentials only
+        forgets them if no other caller has refreshed them already.
+        """
+        with self._lock:
+            if credentials is None or credentials == self.credentials:
+                self.credentials = None
+                self.expires_at = 0.0
+                self.refresh_at = 0.0
+
+    def call(self, request):
+        """`request(credentials)`, logging in again and retrying once if it fails with a 401."""
+        credentials = self.get()
+        try:
+            return request(credentials)
+        except Exception as e:
+            if not is_unauthorized(e):
+                raise
+            logging.warning(f"{self.name} rejected the token, logging in again")
+            self.invalidate(credentials)
+            return request(self.get())
+
+    async def call_async(self, request):
+        """call() for a coroutine function `request(credentials)`."""
+        credentials = await self.get_async()
+        try:
+            return await request(credentials)
+        except Exception as e:
+            if not is_unauthorized(e):
+                raise
+            logging.warning(f"{self.name} rejected the token, logging in again")
+            self.invalidate(credentials)
+            return await request(await self.get_async())
+
+
+def token_manager(name, login, token=None, **kwargs):
+    """The process-wide TokenManager of service `name`, created on first use."""
+    with _managers_lock:
+        if name not in _managers:
+            _managers[name] = TokenManager(name, login, token=token, **kwargs)
+        return _managers[name]